@@ -0,0 +1,100 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import config
+from database import db
+from logging_conf import configure_logging
+from outbox import outbox_message
+from utils import as_utc, local_to_utc, render_agenda, utc_now, utc_to_local
+
+logger = logging.getLogger("app")
+
+
+def next_agenda_at(agenda_time, time_zone, after):
+    # First local `agenda_time` ("HH:MM") after `after`, in UTC
+    time_zone = time_zone or "UTC"
+    hour, minute = (int(part) for part in agenda_time.split(":"))
+    local_day = utc_to_local(after, time_zone).date()
+    # Two days ahead covers a DST jump past today's time
+    for days in range(3):
+        day = local_day + timedelta(days=days)
+        date = local_to_utc(
+            datetime(day.year, day.month, day.day, hour, minute), time_zone
+        )
+        if date > after:
+            return date
+
+
+def run_agendas(now=None) -> int:
+    # Enqueues the due agendas and schedules the next ones. Users with no
+    # reminders in the next 24 hours get no message. The key makes an agenda
+    # enqueued by two scheduler processes go out once.
+    now = now or utc_now()
+    enqueued = 0
+    while True:
+        users = db.get_due_agendas(now, config.AGENDA_BATCH_SIZE)
+        if not users:
+            break
+
+        # Users without agenda_next_at just set their agenda, only schedule it
+        due = [user["id"] for user in users if user["agenda_next_at"] is not None]
+        agendas = {}
+        if due:
+            reminders = db.get_agenda_reminders(due, now, now + timedelta(days=1))
+            for reminder in reminders:
+                agendas.setdefault(reminder["user_id"], []).append(reminder)
+
+        messages = []
+        schedules = []
+        for user in users:
+            reminders = agendas.get(user["id"])
+            if reminders:
+                fire_time = as_utc(user["agenda_next_at"])
+                text = render_agenda(
+                    reminders, user["time_zone"], config.AGENDA_MAX_ITEMS
+                )
+                key = f"agenda:{user['id']}:{int(fire_time.timestamp())}"
+                messages.append(
+                    outbox_message(key, "agenda", user["id"], text, fire_time, now)
+                )
+            schedules.append(
+                {
+                    "_id": user["id"],
+                    "agenda_next_at": next_agenda_at(
+                        user["agenda_time"], user["time_zone"], now
+                    ),
+                }
+            )
+
+        db.enqueue_agendas(messages, schedules)
+        enqueued += len(messages)
+        if len(users) < config.AGENDA_BATCH_SIZE:
+            break
+
+    if enqueued:
+        logger.info("%d agendas enqueued", enqueued)
+    return enqueued
+
+
+def start_agendas(stopped: threading.Event, notify=None) -> threading.Thread:
+    # Runs every AGENDA_INTERVAL_SECONDS until `stopped`, `notify` wakes the
+    # outbox sender when something was enqueued
+    def loop():
+        while True:
+            try:
+                if run_agendas() and notify:
+                    notify()
+            except Exception as exc:
+                logger.error("Error enqueuing agendas: %s", exc)
+            if stopped.wait(config.AGENDA_INTERVAL_SECONDS):
+                break
+
+    thread = threading.Thread(target=loop, name="agenda", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    configure_logging()
+    run_agendas()
@@ -1,109 +1,435 @@
+import hmac
+import json
 import logging
-
+from datetime import datetime
 from functools import wraps
-from flask import Flask, jsonify, request
 
+import pytz
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+
+import config
+import metrics
+from broadcast import MAX_BROADCAST_LENGTH, get_progress
+from database import db
 from logging_conf import configure_logging
+from utils import (as_utc, get_tz, page_key, parse_agenda_time,
+                   parse_digest_minutes, parse_page_key, utc_now)
 
-configure_logging()
 logger = logging.getLogger("app")
-app = Flask(__name__)
+api = Blueprint("api", __name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows per insert while importing and per query while exporting
+STREAM_BATCH_SIZE = 1000
+
+# Field -> accepted types, datetimes are ISO 8601 strings
+USER_FIELDS = {
+    "id": (int,),
+    "username": (str, type(None)),
+    "first_name": (str,),
+    "last_name": (str, type(None)),
+    "time_zone": (str,),
+    "default_reminder_minutes": (int,),
+    "is_active": (bool,),
+    "digest_minutes": (int, type(None)),
+    "agenda_time": (str, type(None)),
+}
+REMINDER_FIELDS = {
+    "id": (int,),
+    "user_id": (int,),
+    "title": (str,),
+    "description": (str, type(None)),
+    "date": (datetime,),
+    "reminder_time": (datetime,),
+    "status": (str,),
+    "recurrence": (str, type(None)),
+    "series_start": (datetime, type(None)),
+    "occurrence": (int,),
+    "created_at": (datetime,),
+}
+BROADCAST_FIELDS = {"text": (str,)}
+DATETIME_FIELDS = ("date", "reminder_time", "series_start", "created_at")
+# Routes served without API_TOKEN
+PUBLIC_ENDPOINTS = ("api.get_metrics",)
+
+
+@api.before_request
+def check_token():
+    # The API reads and writes every user's data and can message all of them
+    if request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    if not config.API_TOKEN:
+        return jsonify({"error": "API deshabilitada, configure API_TOKEN"}), 403
+
+    header = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(header, f"Bearer {config.API_TOKEN}".encode()):
+        return jsonify({"error": "Token inválido"}), 401
+    return None
+
+
+def load_fields(data, fields, required=()):
+    # Returns (values, error), values ready to be written to the table
+    if not isinstance(data, dict):
+        return None, "Los datos deben ser un objeto JSON"
 
-users = [{"name": "Juan", "age": 30}, {"name": "Pedro", "age": 35}]
+    unknown = set(data) - set(fields)
+    if unknown:
+        return None, f"Campos no permitidos: {', '.join(sorted(unknown))}"
 
+    for name in required:
+        if data.get(name) is None:
+            return None, f"El campo '{name}' es requerido"
 
-def validate_user_data(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
+    values = {}
+    for name, value in data.items():
+        if name in DATETIME_FIELDS and isinstance(value, str):
+            try:
+                value = as_utc(datetime.fromisoformat(value))
+            except ValueError:
+                return None, f"El campo '{name}' debe ser una fecha ISO 8601"
+
+        # bool is an int subclass, don't accept it for integer fields
+        if not isinstance(value, fields[name]) or (
+            isinstance(value, bool) and bool not in fields[name]
+        ):
+            return None, f"El campo '{name}' no tiene un tipo válido"
+        values[name] = value
+
+    if "time_zone" in values:
+        try:
+            values["time_zone"] = get_tz(values["time_zone"]).zone
+        except pytz.exceptions.UnknownTimeZoneError:
+            return None, f"Zona horaria no válida: {values['time_zone']}"
+
+    if values.get("agenda_time") is not None:
         try:
-            if request.method in ['POST', 'PUT']:
-                user_data = request.get_json()
-                
-                if not isinstance(user_data, dict):
-                    return jsonify({"error": "Los datos deben ser un objeto JSON"}), 400
+            values["agenda_time"] = parse_agenda_time(values["agenda_time"])
+        except ValueError:
+            return None, "El campo 'agenda_time' debe tener el formato HH:MM"
+
+    if values.get("digest_minutes") is not None:
+        try:
+            values["digest_minutes"] = parse_digest_minutes(
+                str(values["digest_minutes"])
+            )
+        except ValueError:
+            return None, "El campo 'digest_minutes' debe estar entre 1 y 1440"
+
+    return values, None
+
 
-                if "name" not in user_data or not isinstance(user_data["name"], str):
-                    return jsonify({"error": "El campo 'name' es requerido y debe ser string"}), 400
+def validate_data(fields, required=()):
+    # Validates the JSON body and passes the loaded values as `data`
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data, error = load_fields(request.get_json(silent=True), fields, required)
+            if error:
+                return jsonify({"error": error}), 400
+            return func(*args, data=data, **kwargs)
 
-                if "age" not in user_data or not isinstance(user_data["age"], int):
-                    return jsonify({"error": "El campo 'age' es requerido y debe ser entero"}), 400
+        return wrapper
 
-            return func(*args, **kwargs)
-            
-        except Exception as exc:
-            logger.error(f"Error en validación: {str(exc)}")
-            return jsonify({"error": "Error en validación de datos"}), 400
-    
-    return wrapper
+    return decorator
 
 
-@app.route("/users", methods=["GET"])
-def get_all_users():
-    logger.info(f"get_all_users: {users}")
-    return jsonify(users), 200
+def serialize(row):
+    return {
+        name: as_utc(value).isoformat() if isinstance(value, datetime) else value
+        for name, value in row.items()
+    }
 
 
-@app.route("/users/<string:name>", methods=["GET"])
-def get_user_by_name(name):
+def page_limit():
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def not_found(resource, id):
+    return jsonify({"error": f"No se encontró el {resource} {id}"}), 404
+
+
+# Users
+@api.route("/users", methods=["GET"])
+def get_users():
+    # ?cursor=<last id>&limit=<n>, next_cursor is null on the last page
+    limit = page_limit()
+    after = request.args.get("cursor", type=int)
+    logger.info("get users after %s", after)
+    users = db.get_models_page(db.users, limit, after)
+    next_cursor = users[-1]["id"] if len(users) == limit else None
+    return jsonify(
+        {"items": [serialize(user) for user in users], "next_cursor": next_cursor}
+    ), 200
+
+
+@api.route("/users/<int:user_id>", methods=["GET"])
+def get_user(user_id):
+    logger.info("get user: %s", user_id)
+    user = db.get_model(user_id, db.users)
+    if not user:
+        return not_found("usuario", user_id)
+    return jsonify(serialize(user)), 200
+
+
+@api.route("/users/<string:username>", methods=["GET"])
+def get_user_by_name(username):
+    logger.info("get user: %s", username)
+    user = db.get_user_by_username(username)
+    if not user:
+        return not_found("usuario", username)
+    return jsonify(serialize(user)), 200
+
+
+@api.route("/users", methods=["POST"])
+@validate_data(USER_FIELDS, required=("id", "first_name"))
+def insert_user(data):
+    logger.info("insert user %s", data["id"])
     try:
-        logger.info(f"get user: {name}")
-        for user in users:
-            if user.get("name") == name:
-                return jsonify(user), 200
+        db.create_model(data, db.users)
+    except IntegrityError:
+        return jsonify({"error": f"El usuario {data['id']} ya existe"}), 409
+    return jsonify(serialize(db.get_model(data["id"], db.users))), 201
 
-        return jsonify(f"No se encontró el usuario {name}"), 404
 
-    except Exception as exc:
-        logger.error(exc)
-        return jsonify("Error de servidor"), 500
+@api.route("/users/<int:user_id>", methods=["PUT"])
+@validate_data(USER_FIELDS)
+def update_user(user_id, data):
+    logger.info("update user %s", user_id)
+    data.pop("id", None)
+    if "time_zone" in data or "agenda_time" in data:
+        # The agenda job schedules it again
+        data["agenda_next_at"] = None
+    if data:
+        found = db.update_model(user_id, data, db.users)
+    else:
+        found = db.get_model(user_id, db.users) is not None
+    if not found:
+        return not_found("usuario", user_id)
+    return jsonify(serialize(db.get_model(user_id, db.users))), 200
+
 
+@api.route("/users/<int:user_id>", methods=["DELETE"])
+def remove_user(user_id):
+    logger.info("remove user %s", user_id)
+    if not db.delete_model(user_id, db.users):
+        return not_found("usuario", user_id)
+    return jsonify({"id": user_id}), 200
 
-@app.route("/users", methods=["POST"])
-@validate_user_data
-def insert_user():
+
+@api.route("/users/<int:user_id>/reminders", methods=["GET"])
+def get_user_reminders(user_id):
+    # ?status=<status>&cursor=<date micros>:<id>&limit=<n>, in date order
+    limit = page_limit()
+    status = request.args.get("status", "pending")
+    cursor = request.args.get("cursor")
     try:
-        user_data = request.json
-        logger.info(f"insert user {user_data}")
-        users.append(user_data)
-        return jsonify(users), 201
+        after = parse_page_key(*cursor.split(":")) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Cursor no válido"}), 400
 
-    except Exception as exc:
-        logger.error(exc)
-        return jsonify("Error de servidor"), 500
+    reminders = db.get_reminders_page(user_id, limit, after=after, status=status)
+    next_cursor = page_key(reminders[-1]) if len(reminders) == limit else None
+    return jsonify(
+        {
+            "items": [serialize(reminder) for reminder in reminders],
+            "next_cursor": next_cursor,
+        }
+    ), 200
+
+
+# Reminders
+@api.route("/reminders/<int:reminder_id>", methods=["GET"])
+def get_reminder(reminder_id):
+    reminder = db.get_model(reminder_id, db.reminders)
+    if not reminder:
+        return not_found("recordatorio", reminder_id)
+    return jsonify(serialize(reminder)), 200
 
 
-@app.route("/users/<string:name>", methods=["PUT"])
-@validate_user_data
-def update_user(name):
+@api.route("/reminders", methods=["POST"])
+@validate_data(REMINDER_FIELDS, required=("user_id", "title", "date"))
+def insert_reminder(data):
+    data.setdefault("reminder_time", data["date"])
+    data.setdefault("series_start", data["date"])
+    logger.info("insert reminder for user %s", data["user_id"])
     try:
-        logger.info(f"update user {name}")
-        user_data = request.json
-        user_index = next((i for i, u in enumerate(users) if u["name"] == name), None)
-        
-        if user_index is None:
-            return jsonify({"error": f"No se encontró el usuario {name}"}), 404
-            
-        users[user_index] = user_data
-        return jsonify(users), 200
-
-    except Exception as exc:
+        reminder_id = db.create_model(data, db.reminders)
+    except IntegrityError as exc:
         logger.error(exc)
-        return jsonify("Error de servidor"), 500
+        return jsonify({"error": "El recordatorio no es válido"}), 409
+    return jsonify(serialize(db.get_model(reminder_id, db.reminders))), 201
 
 
-@app.route("/users/<string:name>", methods=["DELETE"])
-def remove_user(name):
+@api.route("/reminders/<int:reminder_id>", methods=["PUT"])
+@validate_data(REMINDER_FIELDS)
+def update_reminder(reminder_id, data):
+    logger.info("update reminder %s", reminder_id)
+    data.pop("id", None)
+    if data:
+        found = db.update_model(reminder_id, data, db.reminders)
+    else:
+        found = db.get_model(reminder_id, db.reminders) is not None
+    if not found:
+        return not_found("recordatorio", reminder_id)
+    return jsonify(serialize(db.get_model(reminder_id, db.reminders))), 200
+
+
+@api.route("/reminders/<int:reminder_id>", methods=["DELETE"])
+def remove_reminder(reminder_id):
+    logger.info("remove reminder %s", reminder_id)
+    if not db.delete_model(reminder_id, db.reminders):
+        return not_found("recordatorio", reminder_id)
+    return jsonify({"id": reminder_id}), 200
+
+
+# Bulk NDJSON import/export, one JSON object per line
+BULK_TABLES = {
+    "users": (db.users, USER_FIELDS, ("id", "first_name")),
+    "reminders": (db.reminders, REMINDER_FIELDS, ("user_id", "title", "date")),
+}
+
+
+@api.route("/export/<string:name>", methods=["GET"])
+def export_rows(name):
+    if name not in BULK_TABLES:
+        return jsonify({"error": f"No se puede exportar {name}"}), 404
+    table, fields, _ = BULK_TABLES[name]
+
+    def generate():
+        # Only importable fields, claims and updated_at are runtime state
+        after = None
+        while True:
+            rows = db.get_models_page(table, STREAM_BATCH_SIZE, after)
+            for row in rows:
+                row = {field: row[field] for field in fields}
+                yield json.dumps(serialize(row), ensure_ascii=False) + "\n"
+            if len(rows) < STREAM_BATCH_SIZE:
+                break
+            after = rows[-1]["id"]
+
+    logger.info("export %s", name)
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@api.route("/import/<string:name>", methods=["POST"])
+def import_rows(name):
+    # Each batch is its own transaction, on error the response says how many
+    # rows were imported before the failing line
+    if name not in BULK_TABLES:
+        return jsonify({"error": f"No se puede importar {name}"}), 404
+    table, fields, required = BULK_TABLES[name]
+
+    imported = 0
+    batch = []
     try:
-        logger.info(f"remove user {name}")
-        global users
-        users = [u for u in users if u["name"] != name]
-        return jsonify(users), 200
+        for line_number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError:
+                return import_error(imported, line_number, "JSON no válido")
 
-    except Exception as exc:
+            values, error = load_fields(data, fields, required)
+            if error:
+                return import_error(imported, line_number, error)
+            if table is db.reminders:
+                values.setdefault("reminder_time", values["date"])
+                values.setdefault("series_start", values["date"])
+
+            batch.append(values)
+            if len(batch) == STREAM_BATCH_SIZE:
+                imported += db.create_many(batch, table, f"import {len(batch)} {name}")
+                batch = []
+
+        imported += db.create_many(batch, table, f"import {len(batch)} {name}")
+    except IntegrityError as exc:
         logger.error(exc)
-        return jsonify("Error de servidor"), 500
+        return jsonify(
+            {"error": "Filas duplicadas o no válidas", "imported": imported}
+        ), 409
+    finally:
+        db.reset_id_sequence(table)
+
+    logger.info("imported %d %s", imported, name)
+    return jsonify({"imported": imported}), 201
+
+
+def import_error(imported, line_number, error):
+    return jsonify(
+        {"error": f"Línea {line_number}: {error}", "imported": imported}
+    ), 400
+
+
+# Broadcasts to every active user, see broadcast.py
+@api.route("/broadcasts", methods=["POST"])
+@validate_data(BROADCAST_FIELDS, required=("text",))
+def insert_broadcast(data):
+    text = data["text"].strip()
+    if not text or len(text) > MAX_BROADCAST_LENGTH:
+        error = f"El texto debe tener entre 1 y {MAX_BROADCAST_LENGTH} caracteres"
+        return jsonify({"error": error}), 400
+
+    broadcast = db.create_broadcast(text, None)
+    logger.info(
+        "broadcast %s created for %d users", broadcast["id"], broadcast["total"]
+    )
+    return jsonify(serialize(get_progress(broadcast["id"]))), 201
+
+
+@api.route("/broadcasts/<int:broadcast_id>", methods=["GET"])
+def get_broadcast(broadcast_id):
+    # Progress with throughput (messages_per_second) and eta_seconds
+    progress = get_progress(broadcast_id)
+    if progress is None:
+        return not_found("envío", broadcast_id)
+    return jsonify(serialize(progress)), 200
+
+
+@api.route("/broadcasts/<int:broadcast_id>/cancel", methods=["POST"])
+def cancel_broadcast(broadcast_id):
+    logger.info("cancel broadcast %s", broadcast_id)
+    if db.get_model(broadcast_id, db.broadcasts) is None:
+        return not_found("envío", broadcast_id)
+    if not db.cancel_broadcast(broadcast_id, utc_now()):
+        return jsonify({"error": f"El envío {broadcast_id} ya terminó"}), 409
+    return jsonify(serialize(get_progress(broadcast_id))), 200
+
+
+@api.route("/admin/tables", methods=["GET"])
+def get_table_stats():
+    return jsonify(db.table_stats()), 200
+
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    body, content_type = metrics.render()
+    return body, 200, {"Content-Type": content_type}
+
+
+@api.app_errorhandler(Exception)
+def handle_error(exc):
+    if isinstance(exc, HTTPException):
+        return exc
+    logger.error(exc)
+    return jsonify("Error de servidor"), 500
+
+
+def create_app() -> Flask:
+    # Importing the module only defines the routes, the app is built by the
+    # process that serves it
+    configure_logging()
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    return app
 
 
 if __name__ == "__main__":
+    app = create_app()
     logger.info("API Ready!")
     app.run(debug=True)
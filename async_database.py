@@ -0,0 +1,297 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import config
+from database import (LRUCache, DatabaseManager, _chunks, digest_windows,
+                      merge_digest_claims)
+from metrics import instrument_engine, track_cache, track_pool
+from sqlalchemy import Table, delete, insert, update
+from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
+                                    create_async_engine)
+
+logger = logging.getLogger("app")
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(database_url: str) -> str:
+    scheme, rest = database_url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+class AsyncDatabaseManager:
+    # asyncio counterpart of DatabaseManager for the async runtime. Tables and
+    # query builders come from the sync manager, only execution differs.
+
+    def __init__(self, schema: DatabaseManager, database_url: Optional[str] = None):
+        self.schema = schema
+        self.users = schema.users
+        self.reminders = schema.reminders
+        self.database_url = database_url
+        self._engine = None
+        self._session_factory = None
+        self.user_cache = LRUCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+        track_cache("users", self.user_cache)
+
+    def _create_engine(self) -> None:
+        # Only touched from the event loop thread, no lock needed. The URL
+        # defaults to ASYNC_DATABASE_URL or the schema's with an async driver.
+        if self.database_url is None:
+            self.database_url = config.ASYNC_DATABASE_URL or to_async_url(
+                self.schema.database_url
+            )
+        engine = create_async_engine(
+            self.database_url, **self.schema._get_engine_options()
+        )
+        instrument_engine(engine.sync_engine)
+        track_pool("async", self)
+        self._session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        self._engine = engine
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._create_engine()
+        return self._engine
+
+    @property
+    def Session(self) -> async_sessionmaker:
+        if self._engine is None:
+            self._create_engine()
+        return self._session_factory
+
+    async def disconnect(self):
+        if self._engine is None:
+            return
+
+        await self._engine.dispose()
+        logger.info("Disconnected from database")
+
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncSession:
+        session = self.Session()
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    def pool_stats(self) -> Dict:
+        return self.schema._pool_stats(self.engine.pool)
+
+    def _invalidate_cache(self, table: Table, ids: List) -> None:
+        if table is self.users:
+            self.user_cache.invalidate(*ids)
+
+    # Generic CRUD
+    async def create_model(
+        self, data: Dict, table: Table, debug_info: str = None
+    ) -> int:
+        if debug_info:
+            logger.debug(debug_info)
+
+        async with self.session_scope() as session:
+            result = await session.execute(insert(table).values(data))
+        self._invalidate_cache(table, [data.get("id")])
+        return result.inserted_primary_key[0]
+
+    async def get_model(
+        self, id: int, table: Table, debug_info: str = None
+    ) -> Optional[Dict]:
+        if debug_info:
+            logger.debug(debug_info)
+
+        if table is self.users:
+            cached = self.user_cache.get(id)
+            if cached is not LRUCache._MISSING:
+                return dict(cached)
+
+        query = table.select().where(table.c.id == id)
+        async with self.session_scope() as session:
+            row = (await session.execute(query)).fetchone()
+        model = row._asdict() if row else None
+
+        # Misses are not cached, a user may register right after
+        if table is self.users and model is not None:
+            self.user_cache.set(id, model)
+            return dict(model)
+        return model
+
+    async def update_model(
+        self, id: int, data: Dict, table: Table, debug_info: str = None
+    ) -> bool:
+        if debug_info:
+            logger.debug(debug_info)
+
+        query = update(table).where(table.c.id == id).values(data)
+        async with self.session_scope() as session:
+            result = await session.execute(query)
+        self._invalidate_cache(table, [id])
+        return result.rowcount > 0
+
+    async def update_many(
+        self, ids: Iterable[int], data: Dict, table: Table, debug_info: str = None
+    ) -> int:
+        if debug_info:
+            logger.debug(debug_info)
+
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        updated = 0
+        async with self.session_scope() as session:
+            for chunk in _chunks(ids):
+                query = update(table).where(table.c.id.in_(chunk)).values(data)
+                updated += (await session.execute(query)).rowcount
+        self._invalidate_cache(table, ids)
+        return updated
+
+    # Reminders
+    async def claim_due_reminders(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ) -> List[Dict]:
+        # Same digest handling as DatabaseManager.claim_due_reminders
+        claimed = await self._claim(
+            *self.schema._claim_queries(worker_id, now, lease, limit)
+        )
+        windows = digest_windows(claimed)
+        if not windows:
+            return claimed
+
+        digests = await self._claim(
+            *self.schema._digest_claim_queries(worker_id, now, lease, windows)
+        )
+        return merge_digest_claims(claimed, digests)
+
+    async def _claim(self, candidates, claim, claimed) -> List[Dict]:
+        reminders = self.reminders
+
+        async with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True, of=reminders)
+                ids = (await session.execute(candidates)).scalars().all()
+                if ids:
+                    await session.execute(claim.where(reminders.c.id.in_(ids)))
+            else:
+                await session.execute(claim.where(reminders.c.id.in_(candidates)))
+
+        async with self.session_scope() as session:
+            return [row._asdict() for row in await session.execute(claimed)]
+
+    async def enqueue_deliveries(
+        self,
+        messages: List[Dict],
+        transitions: Dict[str, List[int]],
+        advances: List[Dict],
+    ) -> None:
+        schema = self.schema
+        async with self.session_scope() as session:
+            for chunk in _chunks(messages):
+                await session.execute(schema._outbox_insert(), chunk)
+            for query in schema._transition_queries(transitions):
+                await session.execute(query)
+            for chunk in _chunks(advances):
+                await session.execute(schema._advance_query(), chunk)
+
+    async def release_claims(self, worker_id: str, ids: List[int]) -> None:
+        async with self.session_scope() as session:
+            for query in self.schema._release_queries(worker_id, ids):
+                await session.execute(query)
+
+    async def claim_outbox(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ) -> List[Dict]:
+        candidates, claim, claimed = self.schema._outbox_claim_queries(
+            worker_id, now, lease, limit
+        )
+        outbox = self.schema.outbox
+
+        async with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True)
+                ids = (await session.execute(candidates)).scalars().all()
+                if ids:
+                    await session.execute(claim.where(outbox.c.id.in_(ids)))
+            else:
+                await session.execute(claim.where(outbox.c.id.in_(candidates)))
+
+        async with self.session_scope() as session:
+            return [row._asdict() for row in await session.execute(claimed)]
+
+    async def mark_outbox_sent(self, ids: List[int], now: datetime) -> None:
+        if not ids:
+            return
+
+        async with self.session_scope() as session:
+            for chunk in _chunks(ids):
+                await session.execute(self.schema._outbox_sent_query(chunk, now))
+
+    async def mark_outbox_failed(self, rows: List[Dict]) -> None:
+        if not rows:
+            return
+
+        async with self.session_scope() as session:
+            for chunk in _chunks(rows):
+                await session.execute(self.schema._outbox_failed_query(), chunk)
+
+    async def get_upcoming_reminders(self, until: datetime) -> List[Dict]:
+        query = self.schema._schedule_query().where(self.schema._fire_filter(until))
+        async with self.session_scope() as session:
+            return [row._asdict() for row in await session.execute(query)]
+
+    async def get_changed_reminders(self, since: datetime) -> List[Dict]:
+        query = self.schema._schedule_query().where(
+            self.reminders.c.updated_at >= since
+        )
+        async with self.session_scope() as session:
+            return [row._asdict() for row in await session.execute(query)]
+
+    async def get_reminders_page(
+        self,
+        user_id: int,
+        limit: int,
+        after: Optional[tuple] = None,
+        before: Optional[tuple] = None,
+        status: str = "pending",
+    ) -> List[Dict]:
+        query = self.schema._reminders_page_query(
+            user_id, limit, after, before, status
+        )
+        async with self.session_scope() as session:
+            rows = [row._asdict() for row in await session.execute(query)]
+        return rows[::-1] if before else rows
+
+    async def apply_reminder_action(
+        self, id: int, user_id: int, values: Dict, now: datetime
+    ) -> Optional[Dict]:
+        query = self.schema._reminder_action_query(id, user_id, values, now)
+        async with self.session_scope() as session:
+            row = (await session.execute(query)).fetchone()
+        return row._asdict() if row else None
+
+    async def confirm_draft(self, id: int, user_id: int) -> bool:
+        query = update(self.reminders).where(self.schema._draft_filter(id, user_id))
+        async with self.session_scope() as session:
+            result = await session.execute(query.values(status="pending"))
+        return result.rowcount > 0
+
+    async def table_stats(self) -> Dict:
+        # Admin only and rare, the sync query runs in a worker thread
+        return await asyncio.to_thread(self.schema.table_stats)
+
+    async def discard_draft(self, id: int, user_id: int) -> bool:
+        query = delete(self.reminders).where(self.schema._draft_filter(id, user_id))
+        async with self.session_scope() as session:
+            result = await session.execute(query)
+        return result.rowcount > 0
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from telebot import Handler, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import BaseMiddleware, CancelUpdate
+
+import config
+import handlers
+from agenda import run_agendas
+from async_database import AsyncDatabaseManager
+from broadcast import BroadcastRunner
+from database import db
+from dispatcher import AsyncMessageDispatcher
+from logging_conf import configure_logging
+from metrics import REMINDERS_DUE, SCHEDULER_TICK_SECONDS
+from migrations import migrate
+from outbox import AsyncOutboxSender, plan_deliveries
+from scheduler import AsyncReminderScheduler
+from step_state import StepStateBackend
+from utils import utc_now
+
+logger = logging.getLogger("app")
+
+if config.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = config.TELEGRAM_API_URL
+
+
+class AsyncMyBot(AsyncTeleBot):
+    # Next steps as in TeleBot, kept by a StepStateBackend whose table is read
+    # and written in worker threads, see NextStepMiddleware
+
+    def __init__(self, token, **kwargs):
+        super().__init__(token, **kwargs)
+        self.next_step_backend = StepStateBackend()
+
+    async def send_message(self, chat_id, text, typing=True, **kwargs):
+        if typing:
+            await self.send_chat_action(chat_id, "typing")
+        return await super().send_message(chat_id, text, **kwargs)
+
+    async def register_next_step_handler(self, message, callback, *args, **kwargs):
+        handler = Handler(callback, *args, **kwargs)
+        await asyncio.to_thread(
+            self.next_step_backend.register_handler, message.chat.id, handler
+        )
+
+
+class NextStepMiddleware(BaseMiddleware):
+    # A message of a chat with a pending step goes to the step instead of the
+    # handlers, as in TeleBot
+
+    def __init__(self, bot: AsyncMyBot):
+        super().__init__()
+        self.update_types = ["message"]
+        self.bot = bot
+
+    async def pre_process(self, message, data):
+        steps = await asyncio.to_thread(
+            self.bot.next_step_backend.get_handlers, message.chat.id
+        )
+        if not steps:
+            return None
+
+        for step in steps:
+            try:
+                await step.callback(message, *step.args, **step.kwargs)
+            except Exception as exc:
+                logger.error("Error in step %s: %s", step.callback.__name__, exc)
+        return CancelUpdate()
+
+    async def post_process(self, message, data, exception):
+        pass
+
+
+bot = AsyncMyBot(config.TELEGRAM_TOKEN)
+adb = AsyncDatabaseManager(db)
+dispatcher = AsyncMessageDispatcher(bot)
+
+
+# Scheduler and outbox sender, run as tasks on the same event loop
+async def check_reminders():
+    lease = timedelta(seconds=config.CLAIM_LEASE_SECONDS)
+    with SCHEDULER_TICK_SECONDS.time():
+        while True:
+            now = utc_now()
+            reminders = await adb.claim_due_reminders(
+                config.WORKER_ID, now, lease, config.CLAIM_BATCH_SIZE
+            )
+            logger.debug(
+                "%d reminders claimed by %s", len(reminders), config.WORKER_ID
+            )
+            REMINDERS_DUE.inc(len(reminders))
+            messages, transitions, advances = plan_deliveries(reminders, now)
+            try:
+                await adb.enqueue_deliveries(messages, transitions, advances)
+            except Exception:
+                # Same as reminder.check_reminders
+                scheduler.wake_at(now + lease)
+                await release_claims(reminders)
+                raise
+            if messages:
+                sender.notify()
+
+            if len(reminders) < config.CLAIM_BATCH_SIZE:
+                break
+
+
+async def release_claims(reminders):
+    try:
+        await adb.release_claims(
+            config.WORKER_ID, [reminder["id"] for reminder in reminders]
+        )
+    except Exception as exc:
+        logger.error("Error releasing %d claims: %s", len(reminders), exc)
+
+
+scheduler = AsyncReminderScheduler(check_reminders, adb)
+sender = AsyncOutboxSender(dispatcher, adb)
+
+
+def setup() -> None:
+    # The shared handlers of handlers.py, on this loop's bot and database
+    bot.next_step_backend = StepStateBackend(
+        db if config.STEP_STATE_STORE == "database" else None
+    )
+    bot.setup_middleware(NextStepMiddleware(bot))
+    handlers.setup(bot, adb, asyncio.to_thread, scheduler.push)
+    handlers.registry.register(bot)
+
+
+async def run_agendas_forever(stopped: asyncio.Event):
+    # A batched query per minute, the sync job runs in a worker thread
+    while not stopped.is_set():
+        try:
+            if await asyncio.to_thread(run_agendas):
+                sender.notify()
+        except Exception as exc:
+            logger.error("Error enqueuing agendas: %s", exc)
+        try:
+            await asyncio.wait_for(stopped.wait(), config.AGENDA_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    stopped = asyncio.Event()
+    tasks = [asyncio.create_task(scheduler.run())]
+    if config.OUTBOX_SENDER:
+        tasks.append(asyncio.create_task(sender.run()))
+    if config.AGENDA_INTERVAL_SECONDS:
+        tasks.append(asyncio.create_task(run_agendas_forever(stopped)))
+    runner = None
+    if config.BROADCAST_RUNNER:
+        # Sync runner in a worker thread, it wakes the sender on the loop
+        loop = asyncio.get_running_loop()
+        runner = BroadcastRunner(
+            notify=lambda: loop.call_soon_threadsafe(sender.notify)
+        )
+        tasks.append(asyncio.create_task(asyncio.to_thread(runner.run_forever)))
+    polling = None
+    failed = None
+    try:
+        await bot.delete_webhook()
+        polling = asyncio.create_task(bot.infinity_polling())
+        # The background tasks only end by failing. Stop polling then, a bot
+        # that answers but no longer delivers reminders is worse than a restart.
+        done, _ = await asyncio.wait(
+            [polling, *tasks], return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            if task is not polling and task.exception():
+                failed = task.exception()
+                logger.error("Background task failed, stopping: %s", failed)
+    finally:
+        if polling:
+            polling.cancel()
+        stopped.set()
+        scheduler.stop()
+        sender.stop()
+        if runner:
+            runner.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await bot.close_session()
+        await adb.disconnect()
+    if failed:
+        raise failed
+
+
+if __name__ == "__main__":
+    configure_logging()
+    if config.AUTO_MIGRATE:
+        # The schema is managed with the sync engine, before the loop starts
+        migrate(db)
+    setup()
+    logger.info("Bot Online! (asyncio)")
+    asyncio.run(main())
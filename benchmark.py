@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+# Settings are read on import, so the benchmark ones go first
+parser = argparse.ArgumentParser(
+    description="Scheduler tick, /list and /reminder wizard benchmarks"
+)
+parser.add_argument("--database-url", default="sqlite:///benchmark.db")
+parser.add_argument(
+    "--scales",
+    default="10000,100000",
+    help="comma separated reminder counts, e.g. 10000,100000,1000000,10000000",
+)
+parser.add_argument("--reminders-per-user", type=int, default=10)
+parser.add_argument("--due-ratio", type=float, default=0.01)
+parser.add_argument("--heavy-user-reminders", type=int, default=1000)
+parser.add_argument("--wizard-runs", type=int, default=200)
+parser.add_argument("--output", default="benchmark_results.json")
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = args.database_url
+os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+# Measure our code, not Telegram's flood limits
+os.environ["DISPATCH_GLOBAL_RATE"] = "1000000"
+os.environ["DISPATCH_CHAT_RATE"] = "1000000"
+
+import handlers  # noqa: E402
+import main  # noqa: E402
+import reminder  # noqa: E402
+from database import db  # noqa: E402
+from handlers import sync_handler  # noqa: E402
+from sqlalchemy import event, text  # noqa: E402
+from telebot import apihelper  # noqa: E402
+from telebot.types import Update  # noqa: E402
+from utils import utc_now  # noqa: E402
+
+INSERT_BATCH = 10000
+
+
+class TelegramStub:
+    # Answers Bot API calls locally and counts them
+
+    def __init__(self):
+        self.calls = {}
+        self.message_id = 0
+
+    def __call__(self, token, method_name, method="get", params=None, files=None):
+        self.calls[method_name] = self.calls.get(method_name, 0) + 1
+        if method_name != "sendMessage":
+            return True
+
+        self.message_id += 1
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text"),
+        }
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def rows_scanned():
+    # Only Postgres keeps per-table read counters
+    if db.engine.dialect.name != "postgresql":
+        return None
+
+    with db.engine.connect() as connection:
+        row = connection.execute(
+            text(
+                "SELECT coalesce(seq_tup_read, 0) + coalesce(idx_tup_fetch, 0) "
+                "FROM pg_stat_user_tables WHERE relname = 'reminders'"
+            )
+        ).scalar()
+    return row
+
+
+def query_plan(query):
+    if db.engine.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+
+    # Expanding IN parameters are rendered so the driver sees plain binds
+    compiled = query.compile(db.engine, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [" ".join(str(column) for column in row) for row in rows]
+
+
+def measure(func, counter):
+    queries = counter.count
+    scanned = rows_scanned()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    after = rows_scanned()
+    return {
+        "seconds": round(elapsed, 6),
+        "queries": counter.count - queries,
+        "rows_scanned": after - scanned if after is not None else None,
+        "memory_peak_bytes": peak,
+    }
+
+
+def reset_schema():
+    db.user_cache.clear()
+    db.metadata.drop_all(db.engine)
+    db.metadata.create_all(db.engine)
+
+
+def populate(scale):
+    now = utc_now()
+    users = max(scale // args.reminders_per_user, 1)
+    db.create_many(
+        [
+            {"id": user_id, "first_name": f"user{user_id}", "time_zone": "UTC"}
+            for user_id in range(1, users + 1)
+        ],
+        db.users,
+    )
+
+    heavy = min(args.heavy_user_reminders, scale)
+    batch = []
+    for reminder_id in range(1, scale + 1):
+        user_id = 1 if reminder_id <= heavy else random.randint(1, users)
+        roll = random.random()
+        if roll < args.due_ratio:
+            date, status = now - timedelta(minutes=1), "pending"
+        elif roll < 0.3:
+            date, status = now - timedelta(days=random.randint(1, 365)), "completed"
+        else:
+            date = now + timedelta(minutes=random.randint(5, 60 * 24 * 30))
+            status = "pending"
+
+        batch.append(
+            {
+                "id": reminder_id,
+                "user_id": user_id,
+                "title": f"Reminder {reminder_id}",
+                "date": date,
+                "reminder_time": date - timedelta(minutes=60),
+                "status": status,
+            }
+        )
+        if len(batch) == INSERT_BATCH:
+            db.create_many(batch, db.reminders)
+            batch = []
+
+    db.create_many(batch, db.reminders)
+    return users
+
+
+def make_update(update_id, chat_id, text):
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {
+                    "id": chat_id,
+                    "is_bot": False,
+                    "first_name": f"user{chat_id}",
+                    "username": f"user{chat_id}",
+                },
+                "text": text,
+            },
+        }
+    )
+
+
+def run_wizards(users):
+    steps = ["/reminder", "Benchmark", "saltar", "25/12/2099 15:30", "No", "Sí"]
+    update_id = 0
+    for run in range(args.wizard_runs):
+        chat_id = run % users + 1
+        for step in steps:
+            update_id += 1
+            main.bot.process_new_updates([make_update(update_id, chat_id, step)])
+
+
+def bench_scale(scale, counter, stub):
+    reset_schema()
+    start = time.perf_counter()
+    users = populate(scale)
+    result = {
+        "scale": scale,
+        "users": users,
+        "populate_seconds": round(time.perf_counter() - start, 3),
+    }
+
+    now = utc_now()
+    plan_query = (
+        db.reminders.select()
+        .where(db._fire_filter(now))
+        .order_by(db.reminders.c.date.asc())
+    )
+    result["due_query_plan"] = query_plan(plan_query)
+
+    sent = stub.calls.get("sendMessage", 0)
+    result["tick"] = measure(reminder.check_reminders, counter)
+    result["outbox_drain"] = measure(reminder.get_sender().drain, counter)
+    result["outbox_drain"]["messages_sent"] = stub.calls.get("sendMessage", 0) - sent
+    result["idle_tick"] = measure(reminder.check_reminders, counter)
+
+    list_message = make_update(0, 1, "/list").message
+    list_reminders = sync_handler(handlers.list_reminders)
+    result["list"] = measure(lambda: list_reminders(list_message), counter)
+
+    result["wizard"] = measure(lambda: run_wizards(users), counter)
+    result["wizard"]["ops_per_second"] = round(
+        args.wizard_runs / result["wizard"]["seconds"], 2
+    )
+    return result
+
+
+if __name__ == "__main__":
+    main.setup()
+    started_at = utc_now()
+    stub = TelegramStub()
+    apihelper._make_request = stub
+    main.bot.threaded = False
+    counter = QueryCounter(db.engine)
+
+    results = []
+    for scale in [int(value) for value in args.scales.split(",")]:
+        print(f"Benchmarking {scale} reminders...")
+        results.append(bench_scale(scale, counter, stub))
+        print(json.dumps(results[-1], indent=2, default=str))
+
+    report = {
+        "database": db.engine.dialect.name,
+        "python": platform.python_version(),
+        "started_at": started_at.isoformat(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(report, file, indent=2, default=str)
+    print(f"Results written to {args.output}")
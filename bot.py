@@ -2,19 +2,61 @@ import os
 
 import telebot
 from dotenv import load_dotenv
+from telebot import apihelper
+
+import config
 
 load_dotenv()
 
+if config.TELEGRAM_API_URL:
+    apihelper.API_URL = config.TELEGRAM_API_URL
+
 
 class MyBot(telebot.TeleBot):
     def __init__(self, token, **kwargs):
         super().__init__(token, **kwargs)
 
-    def send_message(self, chat_id, text, **kwargs):
-        self.send_chat_action(chat_id, "typing")
+    def send_message(self, chat_id, text, typing=True, **kwargs):
+        if typing:
+            self.send_chat_action(chat_id, "typing")
         return super().send_message(chat_id, text, **kwargs)
 
 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Handlers use their own database sessions, so they can run in parallel
+NUM_THREADS = int(os.getenv("BOT_THREADS", "8"))
+
+
+def create_bot(**kwargs) -> MyBot:
+    # TeleBot starts its worker threads when built, so only the process that
+    # serves the handlers builds one
+    kwargs.setdefault("num_threads", NUM_THREADS)
+    return MyBot(TOKEN, **kwargs)
+
+
+class HandlerRegistry:
+    # Collects handlers while a module is imported, they are registered on
+    # the bot that create_bot() builds later
+    def __init__(self):
+        self._handlers = []
+
+    def message_handler(self, **filters):
+        return self._collect("message", filters)
+
+    def callback_query_handler(self, **filters):
+        return self._collect("callback_query", filters)
+
+    def _collect(self, kind, filters):
+        def decorator(func):
+            self._handlers.append((kind, func, filters))
+            return func
+
+        return decorator
 
-bot = MyBot(TOKEN)
+    def register(self, bot, wrap=None) -> None:
+        # In declaration order, TeleBot runs the first matching handler. `wrap`
+        # adapts the handlers to the bot, see handlers.sync_handler.
+        for kind, func, filters in self._handlers:
+            if wrap:
+                func = wrap(func)
+            getattr(bot, f"register_{kind}_handler")(func, **filters)
@@ -0,0 +1,194 @@
+import logging
+import threading
+from datetime import timedelta
+
+import config
+from database import db
+from dispatcher import TokenBucket
+from logging_conf import configure_logging
+from utils import as_utc, render_broadcasts, utc_now
+
+logger = logging.getLogger("app")
+
+# Telegram's limit for a message text
+MAX_BROADCAST_LENGTH = 4096
+# Broadcasts listed by a bare /broadcast
+RECENT_BROADCASTS = 5
+
+
+def broadcast_progress(broadcast, counts, now):
+    # Live counts come from the outbox while the broadcast runs, afterwards
+    # from the totals stored on it
+    finished = broadcast["status"] in ("completed", "cancelled")
+    if finished:
+        sent, failed, pending = broadcast["sent"], broadcast["failed"], 0
+    else:
+        sent = counts.get("sent", 0)
+        failed = counts.get("failed", 0)
+        pending = counts.get("pending", 0)
+
+    elapsed = 0
+    if broadcast["started_at"]:
+        end = broadcast["finished_at"] or now
+        elapsed = (as_utc(end) - as_utc(broadcast["started_at"])).total_seconds()
+    rate = (sent + failed) / elapsed if elapsed > 0 else 0
+
+    eta = None
+    if finished:
+        eta = 0
+    elif rate:
+        eta = round(max(broadcast["total"] - sent - failed, 0) / rate)
+
+    return {
+        "id": broadcast["id"],
+        "status": broadcast["status"],
+        "total": broadcast["total"],
+        "enqueued": broadcast["enqueued"],
+        "sent": sent,
+        "failed": failed,
+        "pending": pending,
+        "messages_per_second": round(rate, 2),
+        "eta_seconds": eta,
+        "created_at": broadcast["created_at"],
+        "started_at": broadcast["started_at"],
+        "finished_at": broadcast["finished_at"],
+    }
+
+
+def get_progress(id):
+    broadcast = db.get_model(id, db.broadcasts)
+    if broadcast is None:
+        return None
+    return broadcast_progress(broadcast, db.broadcast_counts(id), utc_now())
+
+
+def broadcast_command(args, created_by):
+    # Reply to the admin /broadcast command: "/broadcast <texto>" starts a
+    # broadcast, a bare /broadcast shows the progress of the latest ones
+    text = (args or "").strip()
+    if len(text) > MAX_BROADCAST_LENGTH:
+        return f"❌ El mensaje no puede superar {MAX_BROADCAST_LENGTH} caracteres"
+
+    if text:
+        broadcast = db.create_broadcast(text, created_by)
+        logger.info(
+            "broadcast %s created for %d users", broadcast["id"], broadcast["total"]
+        )
+        return (
+            f"📣 Envío #{broadcast['id']} creado para "
+            f"{broadcast['total']} usuarios.\nConsulta el progreso con /broadcast"
+        )
+
+    now = utc_now()
+    progresses = []
+    for broadcast in db.get_broadcasts(RECENT_BROADCASTS):
+        running = broadcast["status"] == "running"
+        counts = db.broadcast_counts(broadcast["id"]) if running else {}
+        progresses.append(broadcast_progress(broadcast, counts, now))
+    return render_broadcasts(progresses)
+
+
+class BroadcastRunner:
+    # Enqueues running broadcasts into the outbox in keyset batches of active
+    # users, the senders deliver them through the dispatcher's global and
+    # per-chat limits. A token bucket paces the batches below the global rate
+    # and the cursor is committed with each batch, so another worker or a
+    # restart resumes after the last enqueued user.
+
+    def __init__(
+        self,
+        db=db,
+        worker_id: str = config.WORKER_ID,
+        rate: float = config.BROADCAST_RATE,
+        notify=None,
+    ):
+        self.db = db
+        self.worker_id = worker_id
+        self.notify = notify
+        self._bucket = TokenBucket(rate)
+        self._stopped = threading.Event()
+
+    def step(self) -> bool:
+        # Returns True when the next batch can be enqueued right away
+        now = utc_now()
+        lease = timedelta(seconds=config.CLAIM_LEASE_SECONDS)
+        broadcast = self.db.claim_broadcast(self.worker_id, now, lease)
+        if broadcast is None:
+            return False
+
+        id = broadcast["id"]
+        counts = self.db.broadcast_counts(id)
+        pending = counts.get("pending", 0)
+        if broadcast["enqueued_at"] is not None:
+            if not pending:
+                self.db.finish_broadcast(id, "completed", counts, now)
+                logger.info(
+                    "Broadcast %s completed: %d sent, %d failed",
+                    id,
+                    counts.get("sent", 0),
+                    counts.get("failed", 0),
+                )
+            return False
+
+        limit = min(config.BROADCAST_BATCH_SIZE, config.BROADCAST_WINDOW - pending)
+        if limit <= 0:
+            return False
+
+        user_ids = self.db.get_active_user_ids(broadcast["last_user_id"], limit)
+        wait = 0
+        for _ in user_ids:
+            wait = self._bucket.reserve()
+        if wait > 0 and self._stopped.wait(wait):
+            return False
+
+        now = utc_now()
+        messages = [
+            {
+                "idempotency_key": f"broadcast:{id}:{user_id}",
+                "kind": "broadcast",
+                "chat_id": user_id,
+                "text": broadcast["text"],
+                "reply_markup": None,
+                "fire_time": None,
+                "next_attempt_at": now,
+                "broadcast_id": id,
+            }
+            for user_id in user_ids
+        ]
+        done = len(user_ids) < limit
+        last_user_id = user_ids[-1] if user_ids else broadcast["last_user_id"]
+        if not self.db.enqueue_broadcast(id, messages, last_user_id, done, now):
+            return False
+
+        logger.debug("Broadcast %s: %d messages enqueued", id, len(messages))
+        if messages and self.notify:
+            self.notify()
+        return not done
+
+    def run_forever(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                more = self.step()
+            except Exception as exc:
+                logger.error("Error running broadcast: %s", exc)
+                more = False
+            if not more:
+                self._stopped.wait(config.BROADCAST_POLL_SECONDS)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.run_forever, name="broadcast", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+if __name__ == "__main__":
+    # Standalone runner, the outbox senders deliver what it enqueues
+    configure_logging()
+    db.connect()
+    logger.info("Broadcast runner %s started", config.WORKER_ID)
+    BroadcastRunner().run_forever()
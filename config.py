@@ -1,11 +1,17 @@
 import os
+import socket
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Another Bot API server, e.g. fake_telegram.py with
+# http://127.0.0.1:8081/bot{0}/{1}
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Defaults to DATABASE_URL with its asyncpg/aiosqlite driver
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 
 SERVER_TIMEZONE = (
     os.getenv("SERVER_TIMEZONE_PROD")
@@ -13,6 +19,109 @@ SERVER_TIMEZONE = (
     else os.getenv("SERVER_TIMEZONE_DEV")
 )
 
+# "dev" logs to the console at DEBUG, "prod" to the rotating JSON file at INFO
+LOG_PROFILE = os.getenv(
+    "LOG_PROFILE", "prod" if os.getenv("ENVIRONMENT") == "prod" else "dev"
+)
+LOG_LEVEL = os.getenv("LOG_LEVEL")
+LOG_FILE = os.getenv("LOG_FILE", "records.log")
+# Records per message template and minute, 0 disables the limit
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Users read by handlers are cached in-process, changes from other processes
+# become visible after the TTL
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Unfinished /start, /reminder, /timezone and /remindertime conversations
+# "database" keeps them across restarts and bot instances, "memory" doesn't
+STEP_STATE_STORE = os.getenv("STEP_STATE_STORE", "database")
+STEP_STATE_CACHE_SIZE = int(os.getenv("STEP_STATE_CACHE_SIZE", "10000"))
+STEP_STATE_TTL = int(os.getenv("STEP_STATE_TTL", "3600"))
+
+# "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_THREADS = int(os.getenv("WEBHOOK_THREADS", "8"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "10"))
+
+# Reminders further ahead than the window are loaded on the next window refresh
+SCHEDULER_WINDOW_MINUTES = int(os.getenv("SCHEDULER_WINDOW_MINUTES", "60"))
+SCHEDULER_SYNC_SECONDS = int(os.getenv("SCHEDULER_SYNC_SECONDS", "5"))
+
+# Telegram allows about 30 msg/s overall and 1 msg/s per chat
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "16"))
+DISPATCH_GLOBAL_RATE = float(os.getenv("DISPATCH_GLOBAL_RATE", "30"))
+DISPATCH_CHAT_RATE = float(os.getenv("DISPATCH_CHAT_RATE", "1"))
+DISPATCH_MAX_RETRIES = int(os.getenv("DISPATCH_MAX_RETRIES", "5"))
+
+# Several reminder workers can run at once, each claims batches of due rows
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+CLAIM_BATCH_SIZE = int(os.getenv("CLAIM_BATCH_SIZE", "500"))
+CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", "300"))
+
+# Reminder messages go through the outbox table. The scheduler process runs a
+# sender unless OUTBOX_SENDER=false, `python outbox.py` runs more of them.
+OUTBOX_SENDER = os.getenv("OUTBOX_SENDER", "true").lower() == "true"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_SECONDS = int(os.getenv("OUTBOX_RETRY_SECONDS", "30"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# Daily agenda of the users that set one with /agenda, checked by the
+# scheduler process every AGENDA_INTERVAL_SECONDS (0 disables it)
+AGENDA_INTERVAL_SECONDS = int(os.getenv("AGENDA_INTERVAL_SECONDS", "60"))
+AGENDA_BATCH_SIZE = int(os.getenv("AGENDA_BATCH_SIZE", "500"))
+AGENDA_MAX_ITEMS = int(os.getenv("AGENDA_MAX_ITEMS", "20"))
+
+# Broadcasts to every active user are enqueued into the outbox by the
+# scheduler process or the asyncio bot unless BROADCAST_RUNNER=false,
+# `python broadcast.py` runs one on its own. BROADCAST_RATE stays below
+# DISPATCH_GLOBAL_RATE so reminders keep flowing, BROADCAST_WINDOW caps the
+# messages waiting in the outbox.
+BROADCAST_RUNNER = os.getenv("BROADCAST_RUNNER", "true").lower() == "true"
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+BROADCAST_WINDOW = int(os.getenv("BROADCAST_WINDOW", "1000"))
+BROADCAST_POLL_SECONDS = float(os.getenv("BROADCAST_POLL_SECONDS", "10"))
+
+# Completed reminders older than ARCHIVE_AFTER_DAYS move to reminders_history,
+# ARCHIVE_PARTITIONS partitions it by month on Postgres (new databases only)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_PARTITIONS = os.getenv("ARCHIVE_PARTITIONS", "false").lower() == "true"
+# Unconfirmed one-message /reminder drafts are deleted after this
+DRAFT_TTL_HOURS = int(os.getenv("DRAFT_TTL_HOURS", "24"))
+
+# Telegram ids allowed to use admin commands such as /stats
+ADMIN_IDS = {int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()}
+
+# Entry points apply pending migrations at startup when set, otherwise run
+# `python migrations.py` on deploy
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+
+# Bearer token required by every REST API route but /metrics, the API
+# refuses those routes when unset
+API_TOKEN = os.getenv("API_TOKEN")
+
+# Serves /metrics from the scheduler process when set
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
 if __name__ == "__main__":
     print(TELEGRAM_TOKEN)
     print(DATABASE_URL)
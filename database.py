@@ -1,7 +1,14 @@
 import logging
-from typing import Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional
 
 import config
+from metrics import instrument_engine, track_cache, track_pool
 from sqlalchemy import (
     TIMESTAMP,
     BigInteger,
@@ -17,61 +24,362 @@ from sqlalchemy import (
     Numeric,
     Interval,
     DateTime,
+    Index,
+    and_,
+    bindparam,
     create_engine,
     delete,
     insert,
+    literal,
+    or_,
+    select,
+    text,
     update,
 )
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
 
 logger = logging.getLogger("app")
 
+# Keeps IN (...) lists and executemany batches below driver parameter limits
+BULK_CHUNK_SIZE = 500
+# SQLite only autoincrements an INTEGER PRIMARY KEY, BIGINT isn't a rowid alias
+ID = BigInteger().with_variant(Integer, "sqlite")
+
+
+def _utc_now() -> datetime:
+    # Stored times are UTC, SQLite drops the offset and returns them naive
+    return datetime.now(timezone.utc)
+
+
+def digest_windows(reminders: List[Dict]) -> Dict[int, List[int]]:
+    # Digest minutes -> ids of the digest users in a claimed batch
+    windows = {}
+    for reminder in reminders:
+        minutes = reminder["digest_minutes"]
+        if minutes and reminder["user_id"] not in windows.get(minutes, ()):
+            windows.setdefault(minutes, []).append(reminder["user_id"])
+    return windows
+
+
+def merge_digest_claims(claimed: List[Dict], digests: List[Dict]) -> List[Dict]:
+    # The digest claim read the whole batch of those users again
+    user_ids = {reminder["user_id"] for reminder in digests}
+    return [
+        reminder for reminder in claimed if reminder["user_id"] not in user_ids
+    ] + digests
+
+
+def _chunks(items: List, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class LRUCache:
+    # Bounded LRU with per-entry TTL, safe to share between handler threads
+    _MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return self._MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
 
 class DatabaseManager:
+    # Only describes the schema when built, the engine is created on first use
+    # and the tables by migrations.py
+
     def __init__(self, database_url: str):
         self.database_url = database_url
         self.metadata = MetaData()
-        self.engine = create_engine(database_url)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self._engine = None
+        self._session_factory = None
+        self._engine_lock = threading.Lock()
+        self.user_cache = LRUCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+        track_cache("users", self.user_cache)
+
+        self.users = Table(
+            "users",
+            self.metadata,
+            *self._get_user_columns(),
+            Index("ix_users_username", "username"),
+            Index("ix_users_agenda_next_at", "agenda_next_at"),
+        )
+        self.reminders = Table(
+            "reminders",
+            self.metadata,
+            *self._get_reminder_columns(),
+            *self._get_reminder_indexes(),
+        )
+        self.step_states = Table(
+            "step_states",
+            self.metadata,
+            *self._get_step_state_columns(),
+            Index("ix_step_states_expires_at", "expires_at"),
+        )
+        self.reminders_history = self._get_history_table()
+        self.outbox = Table(
+            "outbox",
+            self.metadata,
+            *self._get_outbox_columns(),
+            Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),
+            Index("ix_outbox_broadcast_status", "broadcast_id", "status"),
+        )
+        self.broadcasts = Table(
+            "broadcasts", self.metadata, *self._get_broadcast_columns()
+        )
+
+    def _create_engine(self) -> None:
+        with self._engine_lock:
+            if self._engine is not None:
+                return
+
+            engine = create_engine(self.database_url, **self._get_engine_options())
+            instrument_engine(engine)
+            track_pool("sync", self)
+            self._session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+            self._engine = engine
 
-        self.users = Table("users", self.metadata, *self._get_user_columns())
-        self.reminders = Table("reminders", self.metadata, *self._get_reminder_columns())
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._create_engine()
+        return self._engine
 
-        self.metadata.create_all(self.engine)
+    @property
+    def Session(self) -> sessionmaker:
+        if self._engine is None:
+            self._create_engine()
+        return self._session_factory
+
+    def _get_engine_options(self) -> Dict:
+        options = {
+            "pool_pre_ping": True,
+            "pool_recycle": config.DB_POOL_RECYCLE,
+        }
+        # SQLite uses its own pools that don't take sizing options
+        if not self.database_url.startswith("sqlite"):
+            options.update(
+                pool_size=config.DB_POOL_SIZE,
+                max_overflow=config.DB_MAX_OVERFLOW,
+                pool_timeout=config.DB_POOL_TIMEOUT,
+            )
+        return options
 
     def _get_user_columns(self):
         return [
-            Column("id", BigInteger, primary_key=True),
+            Column("id", ID, primary_key=True),
             Column("username", String(100)),
             Column("first_name", String(100), nullable=False),
             Column("last_name", String(100)),
             Column("time_zone", String(50)),
             Column("default_reminder_minutes", Integer, default=60),
-            Column("is_active", Boolean, nullable=False, default="true"),
+            Column("is_active", Boolean, nullable=False, default=True),
+            # Reminders due within this many minutes go out in one message,
+            # NULL sends one message per reminder
+            Column("digest_minutes", Integer),
+            # Local "HH:MM" of the daily agenda, agenda_next_at is the next one
+            # in UTC and NULL until the agenda job computes it
+            Column("agenda_time", String(5)),
+            Column("agenda_next_at", TIMESTAMP(timezone=True)),
         ]
 
     def _get_reminder_columns(self):
         return [
-            Column("id", BigInteger, primary_key=True),
+            Column("id", ID, primary_key=True),
             Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
             Column("title", String(255), nullable=False),
             Column("description", Text),
-            Column("date", TIMESTAMP()),
-            Column("reminder_time", TIMESTAMP(), nullable=False),
+            Column("date", TIMESTAMP(timezone=True)),
+            Column("reminder_time", TIMESTAMP(timezone=True), nullable=False),
             Column("status", String(100), default="pending"),
-            Column("created_at", TIMESTAMP(), default=func.now()),
-            Column("updated_at", TIMESTAMP()),
+            Column("created_at", TIMESTAMP(timezone=True), default=func.now()),
+            Column(
+                "updated_at",
+                TIMESTAMP(timezone=True),
+                default=_utc_now,
+                onupdate=_utc_now,
+            ),
+            # Scheduler worker lease, expired claims can be taken by any worker
+            Column("claimed_by", String(100)),
+            Column("claimed_until", TIMESTAMP(timezone=True)),
+            # Recurring series keep one row, `date` is the next occurrence and
+            # `occurrence` its index counted from series_start
+            Column("recurrence", String(255)),
+            Column("series_start", TIMESTAMP(timezone=True)),
+            Column("occurrence", Integer, nullable=False, default=0),
+        ]
+
+    def _get_reminder_indexes(self):
+        return [
+            Index("ix_reminders_status_reminder_time", "status", "reminder_time"),
+            Index("ix_reminders_status_date", "status", "date"),
+            Index("ix_reminders_updated_at", "updated_at"),
+            Index("ix_reminders_user_status_date", "user_id", "status", "date", "id"),
+        ]
+
+    def _history_partitioned(self) -> bool:
+        return config.ARCHIVE_PARTITIONS and self.database_url.startswith("postgresql")
+
+    def _get_history_table(self):
+        # Completed reminders moved out of the live table by archive_completed.
+        # On Postgres it can be range partitioned by month of `date`, the
+        # partition key has to be part of the primary key.
+        partitioned = self._history_partitioned()
+        columns = {column.name: column for column in self._get_reminder_columns()}
+        for name in ("user_id", "claimed_by", "claimed_until"):
+            columns.pop(name)
+
+        columns["id"] = Column("id", BigInteger, primary_key=True, autoincrement=False)
+        columns["date"] = Column(
+            "date", TIMESTAMP(timezone=True), primary_key=partitioned
+        )
+        options = {"postgresql_partition_by": "RANGE (date)"} if partitioned else {}
+        return Table(
+            "reminders_history",
+            self.metadata,
+            # No foreign key, history outlives deleted users
+            Column("user_id", BigInteger, nullable=False),
+            *columns.values(),
+            Column("archived_at", TIMESTAMP(timezone=True), nullable=False),
+            Index("ix_reminders_history_user_date", "user_id", "date"),
+            **options,
+        )
+
+    def _get_outbox_columns(self):
+        # Messages written together with the reminder status change that
+        # produced them, sent and marked by OutboxSender
+        return [
+            Column("id", ID, primary_key=True),
+            # Same key never enqueues twice, e.g. "<reminder id>:<status>:<fire ts>"
+            Column("idempotency_key", String(100), nullable=False, unique=True),
+            # What produced the message, e.g. the reminder status it announces
+            Column("kind", String(20), nullable=False),
+            Column("chat_id", BigInteger, nullable=False),
+            Column("text", Text, nullable=False),
+            # Serialized markup, passed to sendMessage as is
+            Column("reply_markup", Text),
+            Column("status", String(20), nullable=False, default="pending"),
+            Column("attempts", Integer, nullable=False, default=0),
+            Column("next_attempt_at", TIMESTAMP(timezone=True), nullable=False),
+            Column("fire_time", TIMESTAMP(timezone=True)),
+            Column("last_error", Text),
+            Column("claimed_by", String(100)),
+            Column("claimed_until", TIMESTAMP(timezone=True)),
+            Column("created_at", TIMESTAMP(timezone=True), default=_utc_now),
+            Column("sent_at", TIMESTAMP(timezone=True)),
+            # Set on the messages of a broadcast, its per-recipient progress
+            Column("broadcast_id", Integer),
+        ]
+
+    def _get_broadcast_columns(self):
+        # One message to every active user, enqueued into the outbox in
+        # batches by BroadcastRunner
+        return [
+            Column("id", ID, primary_key=True),
+            Column("text", Text, nullable=False),
+            # pending, running, completed or cancelled
+            Column("status", String(20), nullable=False, default="pending"),
+            Column("created_by", BigInteger),
+            # Active users when created, the enqueued count once all are
+            Column("total", Integer, nullable=False, default=0),
+            Column("enqueued", Integer, nullable=False, default=0),
+            # Keyset cursor, the broadcast resumes after this user
+            Column("last_user_id", BigInteger),
+            # Final counts, the outbox rows are purged after a while
+            Column("sent", Integer, nullable=False, default=0),
+            Column("failed", Integer, nullable=False, default=0),
+            Column("created_at", TIMESTAMP(timezone=True), default=_utc_now),
+            Column("started_at", TIMESTAMP(timezone=True)),
+            Column("enqueued_at", TIMESTAMP(timezone=True)),
+            Column("finished_at", TIMESTAMP(timezone=True)),
+            Column("claimed_by", String(100)),
+            Column("claimed_until", TIMESTAMP(timezone=True)),
+        ]
+
+    def _get_step_state_columns(self):
+        return [
+            Column("chat_id", BigInteger, primary_key=True),
+            Column("payload", Text, nullable=False),
+            Column("expires_at", TIMESTAMP(timezone=True), nullable=False),
         ]
 
     def connect(self):
-        self.session = self.Session()
-        logger.info("Connected to database")
+        with self.engine.connect():
+            logger.info("Connected to database")
 
     def disconnect(self):
-        if hasattr(self, "session"):
-            self.session.close()
-            logger.info("Disconnected from database")
+        if self._engine is None:
+            return
+
+        self._engine.dispose()
+        logger.info("Disconnected from database")
+
+    @contextmanager
+    def session_scope(self):
+        # One session per unit of work, committed on success
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def pool_stats(self) -> Dict:
+        return self._pool_stats(self.engine.pool)
+
+    def _pool_stats(self, pool) -> Dict:
+        stats = {"status": pool.status()}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            # SingletonThreadPool keeps size as a plain attribute
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name] = method()
+        return stats
 
     def __enter__(self):
         self.connect()
@@ -80,14 +388,22 @@ class DatabaseManager:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
+    def _invalidate_cache(self, table: Table, ids: List) -> None:
+        if table is self.users:
+            self.user_cache.invalidate(*ids)
+
+    def cache_stats(self) -> Dict:
+        return {"users": self.user_cache.stats()}
+
     # Generic CRUD
     def create_model(self, data: Dict, table: Table, debug_info: str = None) -> int:
         if debug_info:
             logger.debug(debug_info)
 
         query = insert(table).values(data)
-        result = self.session.execute(query)
-        self.session.commit()
+        with self.session_scope() as session:
+            result = session.execute(query)
+        self._invalidate_cache(table, [data.get("id")])
         return result.inserted_primary_key[0]
 
     def get_model(
@@ -96,9 +412,21 @@ class DatabaseManager:
         if debug_info:
             logger.debug(debug_info)
 
+        if table is self.users:
+            cached = self.user_cache.get(id)
+            if cached is not LRUCache._MISSING:
+                return dict(cached)
+
         query = table.select().where(table.c.id == id)
-        result = self.session.execute(query)
-        return result.fetchone()._asdict() if result.rowcount else None
+        with self.session_scope() as session:
+            row = session.execute(query).fetchone()
+        model = row._asdict() if row else None
+
+        # Misses are not cached, a user may register right after
+        if table is self.users and model is not None:
+            self.user_cache.set(id, model)
+            return dict(model)
+        return model
 
     def update_model(
         self, id: int, data: Dict, table: Table, debug_info: str = None
@@ -107,8 +435,9 @@ class DatabaseManager:
             logger.debug(debug_info)
 
         query = update(table).where(table.c.id == id).values(data)
-        result = self.session.execute(query)
-        self.session.commit()
+        with self.session_scope() as session:
+            result = session.execute(query)
+        self._invalidate_cache(table, [id])
         return result.rowcount > 0
 
     def delete_model(self, id: int, table: Table, debug_info: str = None) -> bool:
@@ -116,9 +445,912 @@ class DatabaseManager:
             logger.debug(debug_info)
 
         query = delete(table).where(table.c.id == id)
-        result = self.session.execute(query)
-        self.session.commit()
+        with self.session_scope() as session:
+            result = session.execute(query)
+        self._invalidate_cache(table, [id])
+        return result.rowcount > 0
+
+    def get_models_page(
+        self, table: Table, limit: int, after: Optional[int] = None
+    ) -> List[Dict]:
+        # Keyset pagination on the primary key, `after` is the last id seen
+        query = select(table).order_by(table.c.id.asc()).limit(limit)
+        if after is not None:
+            query = query.where(table.c.id > after)
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def get_user_by_username(self, username: str) -> Optional[Dict]:
+        query = self.users.select().where(self.users.c.username == username).limit(1)
+        with self.session_scope() as session:
+            row = session.execute(query).fetchone()
+        return row._asdict() if row else None
+
+    def reset_id_sequence(self, table: Table) -> None:
+        # Rows imported with explicit ids don't advance Postgres sequences
+        if self.engine.dialect.name != "postgresql":
+            return
+
+        with self.session_scope() as session:
+            session.execute(
+                select(
+                    func.setval(
+                        func.pg_get_serial_sequence(table.name, "id"),
+                        select(func.coalesce(func.max(table.c.id), 0) + 1)
+                        .scalar_subquery(),
+                        False,
+                    )
+                )
+            )
+
+    # Bulk CRUD, one transaction per call
+    def create_many(
+        self, rows: List[Dict], table: Table, debug_info: str = None
+    ) -> int:
+        if debug_info:
+            logger.debug(debug_info)
+
+        if not rows:
+            return 0
+
+        # An executemany needs the same keys in every row. Rows that leave out
+        # optional columns go in runs sharing their keys, in the given order,
+        # so the columns left out still get their defaults.
+        with self.session_scope() as session:
+            for _, run in groupby(rows, key=lambda row: row.keys()):
+                for chunk in _chunks(list(run)):
+                    session.execute(insert(table), chunk)
+        self._invalidate_cache(table, [row.get("id") for row in rows])
+        return len(rows)
+
+    def update_many(
+        self, ids: Iterable[int], data: Dict, table: Table, debug_info: str = None
+    ) -> int:
+        if debug_info:
+            logger.debug(debug_info)
+
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        updated = 0
+        with self.session_scope() as session:
+            for chunk in _chunks(ids):
+                query = update(table).where(table.c.id.in_(chunk)).values(data)
+                updated += session.execute(query).rowcount
+        self._invalidate_cache(table, ids)
+        return updated
+
+    def delete_many(
+        self, ids: Iterable[int], table: Table, debug_info: str = None
+    ) -> int:
+        if debug_info:
+            logger.debug(debug_info)
+
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        deleted = 0
+        with self.session_scope() as session:
+            for chunk in _chunks(ids):
+                query = delete(table).where(table.c.id.in_(chunk))
+                deleted += session.execute(query).rowcount
+        self._invalidate_cache(table, ids)
+        return deleted
+
+    # Reminders
+    def _fire_filter(self, until: datetime):
+        # Reminders whose reminder_time or date is reached at `until`
+        reminders = self.reminders
+        return or_(
+            and_(
+                reminders.c.status.in_(("pending", "incoming")),
+                reminders.c.date <= until,
+            ),
+            and_(
+                reminders.c.status == "pending",
+                reminders.c.reminder_time <= until,
+            ),
+        )
+
+    def _heads_up_filter(self, until: datetime):
+        # Reminders whose reminder_time is reached at `until`, date or not
+        reminders = self.reminders
+        return and_(
+            reminders.c.status == "pending", reminders.c.reminder_time <= until
+        )
+
+    # Query builders are shared with AsyncDatabaseManager
+    def _delivery_query(self):
+        reminders = self.reminders
+        return (
+            select(
+                reminders.c.id,
+                reminders.c.user_id,
+                reminders.c.title,
+                reminders.c.date,
+                reminders.c.reminder_time,
+                reminders.c.status,
+                reminders.c.recurrence,
+                reminders.c.series_start,
+                reminders.c.occurrence,
+                self.users.c.time_zone,
+                self.users.c.digest_minutes,
+            )
+            .join(self.users, self.users.c.id == reminders.c.user_id)
+            .order_by(reminders.c.date.asc())
+        )
+
+    def _claim_queries(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ):
+        # Returns (candidates, claim, claimed): ids to claim, the claim UPDATE
+        # without its id filter, and the query that reads the claimed rows
+        reminders = self.reminders
+        claimable = or_(
+            reminders.c.claimed_until.is_(None), reminders.c.claimed_until < now
+        )
+        candidates = (
+            select(reminders.c.id)
+            .join(self.users, self.users.c.id == reminders.c.user_id)
+            .where(self.users.c.is_active.is_(True))
+            .where(self._fire_filter(now))
+            .where(claimable)
+            .order_by(reminders.c.date.asc())
+            .limit(limit)
+        )
+        claimed_until = now + lease
+        claim = (
+            update(reminders)
+            .where(claimable)
+            .values(
+                claimed_by=worker_id,
+                claimed_until=claimed_until,
+                # A claim is not a change the scheduler has to resync
+                updated_at=reminders.c.updated_at,
+            )
+        )
+        claimed = (
+            self._delivery_query()
+            .where(reminders.c.claimed_by == worker_id)
+            .where(reminders.c.claimed_until == claimed_until)
+        )
+        return candidates, claim, claimed
+
+    def _digest_claim_queries(
+        self,
+        worker_id: str,
+        now: datetime,
+        lease: timedelta,
+        windows: Dict[int, List[int]],
+    ):
+        # Like _claim_queries for the rest of the reminders of digest users,
+        # windows maps digest minutes to user ids: the ones that fired and the
+        # heads-ups due within the window. Alarms are not taken early. The
+        # claimed rows include the ones of the first claim, both use the same
+        # claimed_until.
+        reminders = self.reminders
+        claimable = or_(
+            reminders.c.claimed_until.is_(None), reminders.c.claimed_until < now
+        )
+        candidates = (
+            select(reminders.c.id)
+            .where(
+                or_(
+                    *(
+                        and_(
+                            reminders.c.user_id.in_(user_ids),
+                            or_(
+                                self._fire_filter(now),
+                                self._heads_up_filter(
+                                    now + timedelta(minutes=minutes)
+                                ),
+                            ),
+                        )
+                        for minutes, user_ids in windows.items()
+                    )
+                )
+            )
+            .where(claimable)
+        )
+        claimed_until = now + lease
+        claim = (
+            update(reminders)
+            .where(claimable)
+            .values(
+                claimed_by=worker_id,
+                claimed_until=claimed_until,
+                updated_at=reminders.c.updated_at,
+            )
+        )
+        user_ids = [id for ids in windows.values() for id in ids]
+        claimed = (
+            self._delivery_query()
+            .where(reminders.c.claimed_by == worker_id)
+            .where(reminders.c.claimed_until == claimed_until)
+            .where(reminders.c.user_id.in_(user_ids))
+        )
+        return candidates, claim, claimed
+
+    def _schedule_query(self):
+        reminders = self.reminders
+        return select(
+            reminders.c.id,
+            reminders.c.date,
+            reminders.c.reminder_time,
+            reminders.c.status,
+        )
+
+    def _advance_query(self):
+        # Executed with one parameter set per reminder, see advance_reminder
+        reminders = self.reminders
+        return (
+            update(reminders)
+            .where(reminders.c.id == bindparam("_id"))
+            .values(
+                date=bindparam("date"),
+                reminder_time=bindparam("reminder_time"),
+                occurrence=bindparam("occurrence"),
+                status="pending",
+                claimed_by=None,
+                claimed_until=None,
+            )
+        )
+
+    def _reminders_page_query(
+        self,
+        user_id: int,
+        limit: int,
+        after: Optional[tuple] = None,
+        before: Optional[tuple] = None,
+        status: str = "pending",
+    ):
+        # Keyset pagination on (date, id), `after`/`before` are the keys of the
+        # last/first row of the current page
+        reminders = self.reminders
+        query = select(
+            reminders.c.id,
+            reminders.c.title,
+            reminders.c.description,
+            reminders.c.date,
+            reminders.c.reminder_time,
+            reminders.c.recurrence,
+        ).where((reminders.c.user_id == user_id) & (reminders.c.status == status))
+
+        if before:
+            date, id = before
+            query = query.where(
+                (reminders.c.date < date)
+                | ((reminders.c.date == date) & (reminders.c.id < id))
+            ).order_by(reminders.c.date.desc(), reminders.c.id.desc())
+        else:
+            if after:
+                date, id = after
+                query = query.where(
+                    (reminders.c.date > date)
+                    | ((reminders.c.date == date) & (reminders.c.id > id))
+                )
+            query = query.order_by(reminders.c.date.asc(), reminders.c.id.asc())
+
+        return query.limit(limit)
+
+    def get_due_reminders(self, now: datetime) -> List[Dict]:
+        # Only reminders of active users whose reminder_time or date was reached
+        query = (
+            self._delivery_query()
+            .where(self.users.c.is_active.is_(True))
+            .where(self._fire_filter(now))
+        )
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def claim_due_reminders(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ) -> List[Dict]:
+        # Users in digest mode also get their reminders due within the window
+        claimed = self._claim(*self._claim_queries(worker_id, now, lease, limit))
+        windows = digest_windows(claimed)
+        if not windows:
+            return claimed
+
+        digests = self._claim(
+            *self._digest_claim_queries(worker_id, now, lease, windows)
+        )
+        return merge_digest_claims(claimed, digests)
+
+    def _claim(self, candidates, claim, claimed) -> List[Dict]:
+        reminders = self.reminders
+        with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True, of=reminders)
+                ids = session.execute(candidates).scalars().all()
+                if ids:
+                    session.execute(claim.where(reminders.c.id.in_(ids)))
+            else:
+                # SQLite serialises writers, so claiming in one UPDATE is atomic
+                session.execute(claim.where(reminders.c.id.in_(candidates)))
+
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(claimed)]
+
+    def get_upcoming_reminders(self, until: datetime) -> List[Dict]:
+        query = self._schedule_query().where(self._fire_filter(until))
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def get_reminders_page(
+        self,
+        user_id: int,
+        limit: int,
+        after: Optional[tuple] = None,
+        before: Optional[tuple] = None,
+        status: str = "pending",
+    ) -> List[Dict]:
+        # Rows are returned in date order whatever the direction
+        query = self._reminders_page_query(user_id, limit, after, before, status)
+        with self.session_scope() as session:
+            rows = [row._asdict() for row in session.execute(query)]
+        return rows[::-1] if before else rows
+
+    def get_changed_reminders(self, since: datetime) -> List[Dict]:
+        query = self._schedule_query().where(self.reminders.c.updated_at >= since)
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    # Outbox, query builders are shared with AsyncDatabaseManager
+    def _outbox_insert(self):
+        # Rows whose idempotency_key is already there are skipped
+        if self.engine.dialect.name == "postgresql":
+            query = postgresql.insert(self.outbox)
+        else:
+            query = sqlite.insert(self.outbox)
+        return query.on_conflict_do_nothing(index_elements=["idempotency_key"])
+
+    def _outbox_claim_queries(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ):
+        # Same lease scheme as _claim_queries
+        outbox = self.outbox
+        claimable = or_(outbox.c.claimed_until.is_(None), outbox.c.claimed_until < now)
+        candidates = (
+            select(outbox.c.id)
+            .where(outbox.c.status == "pending")
+            .where(outbox.c.next_attempt_at <= now)
+            .where(claimable)
+            .order_by(outbox.c.id.asc())
+            .limit(limit)
+        )
+        claimed_until = now + lease
+        claim = (
+            update(outbox)
+            .where(claimable)
+            .values(claimed_by=worker_id, claimed_until=claimed_until)
+        )
+        claimed = (
+            select(outbox)
+            .where(outbox.c.claimed_by == worker_id)
+            .where(outbox.c.claimed_until == claimed_until)
+            .where(outbox.c.status == "pending")
+            .order_by(outbox.c.id.asc())
+        )
+        return candidates, claim, claimed
+
+    def _outbox_sent_query(self, ids: List[int], now: datetime):
+        outbox = self.outbox
+        return (
+            update(outbox)
+            .where(outbox.c.id.in_(ids))
+            .values(status="sent", sent_at=now, claimed_by=None, claimed_until=None)
+        )
+
+    def _outbox_failed_query(self):
+        # Executed with one parameter set per message, see OutboxSender
+        outbox = self.outbox
+        return (
+            update(outbox)
+            .where(outbox.c.id == bindparam("_id"))
+            .values(
+                status=bindparam("status"),
+                attempts=bindparam("attempts"),
+                next_attempt_at=bindparam("next_attempt_at"),
+                last_error=bindparam("last_error"),
+                claimed_by=None,
+                claimed_until=None,
+            )
+        )
+
+    def _transition_queries(self, transitions: Dict[str, List[int]]):
+        reminders = self.reminders
+        for status, ids in transitions.items():
+            for chunk in _chunks(ids):
+                yield (
+                    update(reminders)
+                    .where(reminders.c.id.in_(chunk))
+                    .values(status=status, claimed_by=None, claimed_until=None)
+                )
+
+    def _release_queries(self, worker_id: str, ids: List[int]):
+        # Drops this worker's claims so the rows can be claimed again at once
+        reminders = self.reminders
+        for chunk in _chunks(ids):
+            yield (
+                update(reminders)
+                .where(reminders.c.id.in_(chunk))
+                .where(reminders.c.claimed_by == worker_id)
+                .values(
+                    claimed_by=None,
+                    claimed_until=None,
+                    updated_at=reminders.c.updated_at,
+                )
+            )
+
+    def enqueue_deliveries(
+        self,
+        messages: List[Dict],
+        transitions: Dict[str, List[int]],
+        advances: List[Dict],
+    ) -> None:
+        # Outbound messages and the reminder changes that produced them are
+        # committed together, a crash leaves both undone and the claim expires
+        with self.session_scope() as session:
+            for chunk in _chunks(messages):
+                session.execute(self._outbox_insert(), chunk)
+            for query in self._transition_queries(transitions):
+                session.execute(query)
+            for chunk in _chunks(advances):
+                session.execute(self._advance_query(), chunk)
+
+    def release_claims(self, worker_id: str, ids: List[int]) -> None:
+        with self.session_scope() as session:
+            for query in self._release_queries(worker_id, ids):
+                session.execute(query)
+
+    def claim_outbox(
+        self, worker_id: str, now: datetime, lease: timedelta, limit: int
+    ) -> List[Dict]:
+        candidates, claim, claimed = self._outbox_claim_queries(
+            worker_id, now, lease, limit
+        )
+        outbox = self.outbox
+
+        with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True)
+                ids = session.execute(candidates).scalars().all()
+                if ids:
+                    session.execute(claim.where(outbox.c.id.in_(ids)))
+            else:
+                session.execute(claim.where(outbox.c.id.in_(candidates)))
+
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(claimed)]
+
+    def mark_outbox_sent(self, ids: List[int], now: datetime) -> None:
+        if not ids:
+            return
+
+        with self.session_scope() as session:
+            for chunk in _chunks(ids):
+                session.execute(self._outbox_sent_query(chunk, now))
+
+    def mark_outbox_failed(self, rows: List[Dict]) -> None:
+        if not rows:
+            return
+
+        with self.session_scope() as session:
+            for chunk in _chunks(rows):
+                session.execute(self._outbox_failed_query(), chunk)
+
+    def purge_outbox(self, before: datetime) -> int:
+        outbox = self.outbox
+        query = delete(outbox).where(
+            (outbox.c.status.in_(("sent", "failed", "cancelled")))
+            & (outbox.c.created_at < before)
+        )
+        with self.session_scope() as session:
+            return session.execute(query).rowcount
+
+    def _reminder_action_query(
+        self, id: int, user_id: int, values: Dict, now: datetime
+    ):
+        # One UPDATE for a button of a delivered reminder, see
+        # reminder_action_values. Series and claimed rows are left alone, a
+        # worker would overwrite the change.
+        reminders = self.reminders
+        return (
+            update(reminders)
+            .where(reminders.c.id == id)
+            .where(reminders.c.user_id == user_id)
+            .where(reminders.c.recurrence.is_(None))
+            .where(reminders.c.status.in_(("pending", "incoming", "completed")))
+            .where(
+                or_(
+                    reminders.c.claimed_until.is_(None),
+                    reminders.c.claimed_until < now,
+                )
+            )
+            .values(values)
+            .returning(*self._schedule_query().selected_columns)
+        )
+
+    def apply_reminder_action(
+        self, id: int, user_id: int, values: Dict, now: datetime
+    ) -> Optional[Dict]:
+        # Returns the schedule fields of the changed reminder, None if it
+        # can't be changed
+        query = self._reminder_action_query(id, user_id, values, now)
+        with self.session_scope() as session:
+            row = session.execute(query).fetchone()
+        return row._asdict() if row else None
+
+    # Daily agenda
+    def get_due_agendas(self, now: datetime, limit: int) -> List[Dict]:
+        # Active users whose agenda is due, or not scheduled yet
+        users = self.users
+        query = (
+            select(
+                users.c.id,
+                users.c.time_zone,
+                users.c.agenda_time,
+                users.c.agenda_next_at,
+            )
+            .where(users.c.is_active.is_(True))
+            .where(users.c.agenda_time.is_not(None))
+            .where(
+                or_(users.c.agenda_next_at.is_(None), users.c.agenda_next_at <= now)
+            )
+            .order_by(users.c.id.asc())
+            .limit(limit)
+        )
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def get_agenda_reminders(
+        self, user_ids: List[int], since: datetime, until: datetime
+    ) -> List[Dict]:
+        reminders = self.reminders
+        query = (
+            select(reminders.c.user_id, reminders.c.title, reminders.c.date)
+            .where(reminders.c.user_id.in_(user_ids))
+            .where(reminders.c.status.in_(("pending", "incoming")))
+            .where(reminders.c.date >= since)
+            .where(reminders.c.date < until)
+            .order_by(reminders.c.date.asc())
+        )
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def enqueue_agendas(self, messages: List[Dict], schedules: List[Dict]) -> None:
+        # Agenda messages and the next agenda of each user in one transaction
+        users = self.users
+        query = (
+            update(users)
+            .where(users.c.id == bindparam("_id"))
+            .values(agenda_next_at=bindparam("agenda_next_at"))
+        )
+        with self.session_scope() as session:
+            for chunk in _chunks(messages):
+                session.execute(self._outbox_insert(), chunk)
+            for chunk in _chunks(schedules):
+                session.execute(query, chunk)
+        self._invalidate_cache(users, [schedule["_id"] for schedule in schedules])
+
+    # Broadcasts
+    def create_broadcast(self, text: str, created_by: Optional[int]) -> Dict:
+        users = self.users
+        with self.session_scope() as session:
+            total = session.execute(
+                select(func.count())
+                .select_from(users)
+                .where(users.c.is_active.is_(True))
+            ).scalar()
+            result = session.execute(
+                insert(self.broadcasts).values(
+                    text=text, created_by=created_by, total=total
+                )
+            )
+        return self.get_model(result.inserted_primary_key[0], self.broadcasts)
+
+    def get_broadcasts(self, limit: int) -> List[Dict]:
+        broadcasts = self.broadcasts
+        query = select(broadcasts).order_by(broadcasts.c.id.desc()).limit(limit)
+        with self.session_scope() as session:
+            return [row._asdict() for row in session.execute(query)]
+
+    def claim_broadcast(
+        self, worker_id: str, now: datetime, lease: timedelta
+    ) -> Optional[Dict]:
+        # Same lease scheme as claim_outbox, one broadcast at a time. The
+        # worker holding the claim renews it on every call.
+        broadcasts = self.broadcasts
+        claimable = or_(
+            broadcasts.c.claimed_until.is_(None),
+            broadcasts.c.claimed_until < now,
+            broadcasts.c.claimed_by == worker_id,
+        )
+        candidates = (
+            select(broadcasts.c.id)
+            .where(broadcasts.c.status.in_(("pending", "running")))
+            .where(claimable)
+            .order_by(broadcasts.c.id.asc())
+            .limit(1)
+        )
+        claimed_until = now + lease
+        claim = (
+            update(broadcasts)
+            .where(claimable)
+            .values(
+                status="running",
+                started_at=func.coalesce(broadcasts.c.started_at, now),
+                claimed_by=worker_id,
+                claimed_until=claimed_until,
+            )
+        )
+        claimed = (
+            select(broadcasts)
+            .where(broadcasts.c.claimed_by == worker_id)
+            .where(broadcasts.c.claimed_until == claimed_until)
+            .where(broadcasts.c.status == "running")
+            .limit(1)
+        )
+
+        with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True)
+                id = session.execute(candidates).scalar()
+                if id is None:
+                    return None
+                session.execute(claim.where(broadcasts.c.id == id))
+            else:
+                session.execute(claim.where(broadcasts.c.id.in_(candidates)))
+            row = session.execute(claimed).fetchone()
+        return row._asdict() if row else None
+
+    def get_active_user_ids(self, after: Optional[int], limit: int) -> List[int]:
+        users = self.users
+        query = (
+            select(users.c.id)
+            .where(users.c.is_active.is_(True))
+            .order_by(users.c.id.asc())
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(users.c.id > after)
+        with self.session_scope() as session:
+            return session.execute(query).scalars().all()
+
+    def enqueue_broadcast(
+        self,
+        id: int,
+        messages: List[Dict],
+        last_user_id: Optional[int],
+        done: bool,
+        now: datetime,
+    ) -> bool:
+        # The batch and the cursor after it are committed together. Nothing
+        # is enqueued once the broadcast was cancelled.
+        broadcasts = self.broadcasts
+        values = {
+            "last_user_id": last_user_id,
+            "enqueued": broadcasts.c.enqueued + len(messages),
+        }
+        if done:
+            values["enqueued_at"] = now
+            values["total"] = broadcasts.c.enqueued + len(messages)
+        query = (
+            update(broadcasts)
+            .where((broadcasts.c.id == id) & (broadcasts.c.status == "running"))
+            .values(values)
+        )
+        with self.session_scope() as session:
+            if session.execute(query).rowcount == 0:
+                return False
+            for chunk in _chunks(messages):
+                session.execute(self._outbox_insert(), chunk)
+        return True
+
+    def _broadcast_counts_query(self, id: int):
+        outbox = self.outbox
+        return (
+            select(outbox.c.status, func.count())
+            .where(outbox.c.broadcast_id == id)
+            .group_by(outbox.c.status)
+        )
+
+    def broadcast_counts(self, id: int) -> Dict[str, int]:
+        # Outbox messages of the broadcast by status
+        with self.session_scope() as session:
+            return dict(session.execute(self._broadcast_counts_query(id)).all())
+
+    def finish_broadcast(
+        self, id: int, status: str, counts: Dict[str, int], now: datetime
+    ) -> bool:
+        broadcasts = self.broadcasts
+        query = (
+            update(broadcasts)
+            .where(broadcasts.c.id == id)
+            .where(broadcasts.c.status.in_(("pending", "running")))
+            .values(
+                status=status,
+                sent=counts.get("sent", 0),
+                failed=counts.get("failed", 0),
+                finished_at=now,
+                claimed_by=None,
+                claimed_until=None,
+            )
+        )
+        with self.session_scope() as session:
+            return session.execute(query).rowcount > 0
+
+    def cancel_broadcast(self, id: int, now: datetime) -> bool:
+        # Messages not claimed by a sender yet are dropped
+        outbox = self.outbox
+        if not self.finish_broadcast(id, "cancelled", self.broadcast_counts(id), now):
+            return False
+
+        query = (
+            update(outbox)
+            .where(outbox.c.broadcast_id == id)
+            .where(outbox.c.status == "pending")
+            .where(or_(outbox.c.claimed_until.is_(None), outbox.c.claimed_until < now))
+            .values(status="cancelled")
+        )
+        with self.session_scope() as session:
+            session.execute(query)
+        return True
+
+    # Drafts from the one-message /reminder, they never fire until confirmed
+    def _draft_filter(self, id: int, user_id: int):
+        reminders = self.reminders
+        return (
+            (reminders.c.id == id)
+            & (reminders.c.user_id == user_id)
+            & (reminders.c.status == "draft")
+        )
+
+    def confirm_draft(self, id: int, user_id: int) -> bool:
+        query = update(self.reminders).where(self._draft_filter(id, user_id))
+        with self.session_scope() as session:
+            result = session.execute(query.values(status="pending"))
+        return result.rowcount > 0
+
+    def discard_draft(self, id: int, user_id: int) -> bool:
+        query = delete(self.reminders).where(self._draft_filter(id, user_id))
+        with self.session_scope() as session:
+            result = session.execute(query)
         return result.rowcount > 0
 
+    # Conversation steps
+    def save_step_state(self, chat_id: int, payload: str, expires_at: datetime):
+        step_states = self.step_states
+        with self.session_scope() as session:
+            session.execute(delete(step_states).where(step_states.c.chat_id == chat_id))
+            session.execute(
+                insert(step_states).values(
+                    chat_id=chat_id, payload=payload, expires_at=expires_at
+                )
+            )
+
+    def pop_step_state(self, chat_id: int, now: datetime) -> Optional[str]:
+        step_states = self.step_states
+        # One DELETE ... RETURNING, two instances can't both take the step.
+        # Expired rows are left to purge_step_states.
+        query = (
+            delete(step_states)
+            .where(step_states.c.chat_id == chat_id)
+            .where(step_states.c.expires_at > now)
+            .returning(step_states.c.payload)
+        )
+        with self.session_scope() as session:
+            return session.execute(query).scalar()
+
+    def delete_step_state(self, chat_id: int) -> None:
+        step_states = self.step_states
+        with self.session_scope() as session:
+            session.execute(delete(step_states).where(step_states.c.chat_id == chat_id))
+
+    def purge_step_states(self, now: datetime) -> int:
+        step_states = self.step_states
+        with self.session_scope() as session:
+            query = delete(step_states).where(step_states.c.expires_at <= now)
+            return session.execute(query).rowcount
+
+    # Retention
+    def _ensure_history_partitions(self, session, dates: Iterable[datetime]) -> None:
+        months = {(date.year, date.month) for date in dates}
+        for year, month in sorted(months):
+            start = datetime(year, month, 1, tzinfo=timezone.utc)
+            end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+            # Built from integers and datetimes, safe to inline in DDL
+            session.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS reminders_history_{year}{month:02d} "
+                    f"PARTITION OF reminders_history "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            )
+
+    def archive_completed(self, before: datetime, limit: int) -> int:
+        # Moves one batch of completed reminders dated before `before` into
+        # reminders_history, returns how many were moved
+        reminders = self.reminders
+        history = self.reminders_history
+        candidates = (
+            select(reminders.c.id, reminders.c.date)
+            .where(reminders.c.status == "completed")
+            .where(reminders.c.date < before)
+            .order_by(reminders.c.date.asc())
+            .limit(limit)
+        )
+        columns = [
+            column.name for column in history.columns if column.name != "archived_at"
+        ]
+
+        with self.session_scope() as session:
+            if self.engine.dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True)
+            rows = session.execute(candidates).fetchall()
+            if not rows:
+                return 0
+
+            ids = [row.id for row in rows]
+            if self._history_partitioned():
+                self._ensure_history_partitions(session, [row.date for row in rows])
+
+            session.execute(
+                insert(history).from_select(
+                    [*columns, "archived_at"],
+                    select(
+                        *[reminders.c[name] for name in columns],
+                        literal(_utc_now(), TIMESTAMP(timezone=True)),
+                    ).where(reminders.c.id.in_(ids)),
+                )
+            )
+            session.execute(delete(reminders).where(reminders.c.id.in_(ids)))
+        return len(ids)
+
+    def purge_drafts(self, before: datetime) -> int:
+        # One-message /reminder drafts that were never confirmed
+        reminders = self.reminders
+        query = delete(reminders).where(
+            (reminders.c.status == "draft") & (reminders.c.created_at < before)
+        )
+        with self.session_scope() as session:
+            return session.execute(query).rowcount
+
+    def table_stats(self) -> Dict:
+        # Postgres reports planner row estimates and on-disk size including
+        # indexes and partitions, SQLite exact counts and no size
+        tables = (
+            self.users,
+            self.reminders,
+            self.reminders_history,
+            self.outbox,
+            self.step_states,
+            self.broadcasts,
+        )
+        stats = {}
+        with self.session_scope() as session:
+            for table in tables:
+                if self.engine.dialect.name == "postgresql":
+                    row = session.execute(
+                        text(
+                            "SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint, "
+                            "coalesce(sum(pg_total_relation_size(c.oid)), 0)::bigint "
+                            "FROM pg_class c WHERE c.oid = CAST(:name AS regclass) "
+                            "OR c.oid IN (SELECT inhrelid FROM pg_inherits "
+                            "WHERE inhparent = CAST(:name AS regclass))"
+                        ),
+                        {"name": table.name},
+                    ).fetchone()
+                    stats[table.name] = {"rows": row[0], "bytes": row[1]}
+                else:
+                    rows = session.execute(
+                        select(func.count()).select_from(table)
+                    ).scalar()
+                    stats[table.name] = {"rows": rows, "bytes": None}
+        return stats
+
 
 db = DatabaseManager(config.DATABASE_URL)
@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import config
+import requests
+from metrics import TELEGRAM_SEND_ERRORS, TELEGRAM_SEND_SECONDS
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger("app")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Takes a token (possibly borrowed) and returns how long to wait for it
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class _RateLimits:
+    # Token buckets and retry policy shared by the sync and async dispatchers
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        max_retries: int,
+        max_chat_buckets: int,
+    ):
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = OrderedDict()
+        self._chat_lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, 1)
+                self._chat_buckets[chat_id] = bucket
+                if len(self._chat_buckets) > self.max_chat_buckets:
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def _slot_delays(self, chat_id):
+        yield self._paused_until - time.monotonic()
+        yield self._chat_bucket(chat_id).reserve()
+        yield self._global_bucket.reserve()
+
+    def _backoff(self, attempt: int) -> float:
+        return min(2**attempt, 30) + random.uniform(0, 1)
+
+    def _retry_delay(self, chat_id, exc, attempt: int) -> Optional[float]:
+        # None when the error is permanent or retries are exhausted
+        error_code = getattr(exc, "error_code", None)
+        TELEGRAM_SEND_ERRORS.labels(str(error_code or "network")).inc()
+        if attempt >= self.max_retries:
+            return None
+
+        if error_code == 429:
+            parameters = (exc.result_json or {}).get("parameters") or {}
+            delay = parameters.get("retry_after", 1)
+            # Flood control applies to the whole bot, hold every sender
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        elif error_code is None or error_code >= 500:
+            delay = self._backoff(attempt)
+        else:
+            return None
+
+        logger.warning(
+            "Retrying message to %s in %.1fs (attempt %d)", chat_id, delay, attempt + 1
+        )
+        return delay
+
+
+class _Send:
+    # A message waiting in the dispatcher, its future resolves with the result
+    def __init__(self, chat_id, text, typing, kwargs):
+        self.chat_id = chat_id
+        self.text = text
+        self.typing = typing
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.chat_reserved = False
+        self.global_reserved = False
+        self.future = Future()
+
+
+class MessageDispatcher(_RateLimits):
+    # Sends messages from a thread pool within Telegram's flood limits
+    # (global and per chat), retrying 429s and transient errors. Throttled
+    # and retried messages wait in a delay heap, not in a worker, so a few
+    # slow chats don't hold up the others.
+
+    def __init__(
+        self,
+        bot,
+        workers: int = config.DISPATCH_WORKERS,
+        global_rate: float = config.DISPATCH_GLOBAL_RATE,
+        chat_rate: float = config.DISPATCH_CHAT_RATE,
+        max_retries: int = config.DISPATCH_MAX_RETRIES,
+        max_chat_buckets: int = 10000,
+    ):
+        super().__init__(global_rate, chat_rate, max_retries, max_chat_buckets)
+        self.bot = bot
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="dispatcher")
+        # (ready at, sequence, send), the sequence keeps a chat's order
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._closed = False
+        self._ready = threading.Condition()
+        self._timer = threading.Thread(
+            target=self._run_timer, name="dispatcher-timer", daemon=True
+        )
+        self._timer.start()
+
+    def _schedule(self, send: _Send, ready_at: float) -> None:
+        with self._ready:
+            heapq.heappush(self._delayed, (ready_at, next(self._sequence), send))
+            self._ready.notify()
+
+    def _run_timer(self) -> None:
+        while True:
+            with self._ready:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    if self._delayed and self._delayed[0][0] <= now:
+                        break
+                    timeout = self._delayed[0][0] - now if self._delayed else None
+                    self._ready.wait(timeout)
+                _, _, send = heapq.heappop(self._delayed)
+            self._dispatch(send)
+
+    def _dispatch(self, send: _Send) -> None:
+        # Hands the message to a worker once flood control and its rate
+        # limit slots allow it, otherwise puts it back in the heap. The global
+        # token is only taken when the chat slot is due, a backlog for one
+        # chat doesn't use up the capacity of the others.
+        now = time.monotonic()
+        if self._paused_until > now:
+            self._schedule(send, self._paused_until)
+            return
+        if not send.chat_reserved:
+            send.chat_reserved = True
+            wait = self._chat_bucket(send.chat_id).reserve()
+            if wait > 0:
+                self._schedule(send, now + wait)
+                return
+        if not send.global_reserved:
+            send.global_reserved = True
+            wait = self._global_bucket.reserve()
+            if wait > 0:
+                self._schedule(send, now + wait)
+                return
+        try:
+            self._executor.submit(self._send, send)
+        except RuntimeError as exc:
+            # Shut down without waiting
+            self._resolve(send, exception=exc)
+
+    def _send(self, send: _Send) -> None:
+        try:
+            with TELEGRAM_SEND_SECONDS.time():
+                result = self.bot.send_message(
+                    send.chat_id, send.text, typing=send.typing, **send.kwargs
+                )
+        except (
+            ApiTelegramException,
+            requests.ConnectionError,
+            requests.Timeout,
+        ) as exc:
+            delay = self._retry_delay(send.chat_id, exc, send.attempt)
+            if delay is None:
+                self._resolve(send, exception=exc)
+                return
+            send.attempt += 1
+            send.chat_reserved = send.global_reserved = False
+            self._schedule(send, time.monotonic() + delay)
+            return
+        except Exception as exc:
+            self._resolve(send, exception=exc)
+            return
+        self._resolve(send, result=result)
+
+    def _resolve(self, send: _Send, result=None, exception=None) -> None:
+        if exception is None:
+            send.future.set_result(result)
+        else:
+            send.future.set_exception(exception)
+        with self._ready:
+            self._pending -= 1
+            self._ready.notify()
+
+    def submit(self, chat_id, text, typing: bool = False, **kwargs) -> Future:
+        send = _Send(chat_id, text, typing, kwargs)
+        send.future.set_running_or_notify_cancel()
+        with self._ready:
+            self._pending += 1
+        self._schedule(send, time.monotonic())
+        return send.future
+
+    def shutdown(self, wait: bool = True) -> None:
+        # Waiting also lets the delayed messages and their retries finish
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        if wait:
+            self._timer.join()
+        self._executor.shutdown(wait=wait)
+
+
+class AsyncMessageDispatcher(_RateLimits):
+    # asyncio counterpart of MessageDispatcher for AsyncTeleBot
+
+    def __init__(
+        self,
+        bot,
+        concurrency: int = config.DISPATCH_WORKERS,
+        global_rate: float = config.DISPATCH_GLOBAL_RATE,
+        chat_rate: float = config.DISPATCH_CHAT_RATE,
+        max_retries: int = config.DISPATCH_MAX_RETRIES,
+        max_chat_buckets: int = 10000,
+    ):
+        # aiohttp is only needed by the async runtime
+        import aiohttp
+        from telebot import asyncio_helper
+
+        super().__init__(global_rate, chat_rate, max_retries, max_chat_buckets)
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._retryable = (
+            asyncio_helper.ApiTelegramException,
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+        )
+
+    async def send(self, chat_id, text, typing: bool = False, **kwargs):
+        # The semaphore only bounds the requests in flight, waits for a rate
+        # limit slot or a retry happen outside it
+        attempt = 0
+        while True:
+            for delay in self._slot_delays(chat_id):
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                async with self._semaphore:
+                    with TELEGRAM_SEND_SECONDS.time():
+                        if typing:
+                            await self.bot.send_chat_action(chat_id, "typing")
+                        return await self.bot.send_message(chat_id, text, **kwargs)
+            except self._retryable as exc:
+                delay = self._retry_delay(chat_id, exc, attempt)
+                if delay is None:
+                    raise
+
+            attempt += 1
+            await asyncio.sleep(delay)
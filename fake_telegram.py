@@ -0,0 +1,402 @@
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger("app")
+
+# Bot API methods the bot uses, anything else answers 404
+METHODS = (
+    "getMe",
+    "getUpdates",
+    "sendMessage",
+    "sendChatAction",
+    "editMessageText",
+    "answerCallbackQuery",
+    "setWebhook",
+    "deleteWebhook",
+)
+# Methods that get the injected 429s and 5xx errors
+FAULT_METHODS = ("sendMessage", "editMessageText")
+MAX_POLL_SECONDS = 10
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Soak", "username": "soak_bot"}
+TITLE = re.compile(r"Soak \d+")
+# Deliveries from the outbox, answers to updates don't start with it
+ALARM_PREFIX = "⏰ Recordatorio:"
+
+
+def percentile(values, p):
+    # Nearest rank, None without samples
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class FakeTelegram:
+    # In-memory stand-in for the Bot API. Faults are drawn per call, updates
+    # are queued by SyntheticUsers and handed out by getUpdates.
+
+    def __init__(
+        self,
+        latency: float = 0,
+        flood_ratio: float = 0,
+        retry_after: int = 1,
+        error_ratio: float = 0,
+    ):
+        self.latency = latency
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self.error_ratio = error_ratio
+        self.listeners = []
+
+        self.calls = {}
+        self.faults = {"429": 0, "5xx": 0}
+        self.sent = 0
+        self.response_seconds = []
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        # chat id -> when its last update was handed to the bot
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._new_update = threading.Condition(self._lock)
+
+    def push_update(self, update: dict) -> None:
+        with self._new_update:
+            self._update_id += 1
+            update["update_id"] = self._update_id
+            self._updates.append(update)
+            self._new_update.notify_all()
+
+    def handle(self, method: str, params: dict):
+        # Returns (HTTP status, JSON body)
+        if method not in METHODS:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+
+        if self.latency:
+            time.sleep(random.uniform(0, 2 * self.latency))
+        if method in FAULT_METHODS:
+            roll = random.random()
+            if roll < self.flood_ratio:
+                with self._lock:
+                    self.faults["429"] += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            if roll < self.flood_ratio + self.error_ratio:
+                with self._lock:
+                    self.faults["5xx"] += 1
+                return 502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method in ("sendMessage", "editMessageText"):
+            return 200, {"ok": True, "result": self._message(method, params)}
+        return 200, {"ok": True, "result": True}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + min(
+            float(params.get("timeout") or 0), MAX_POLL_SECONDS
+        )
+        with self._new_update:
+            # Updates before the offset are confirmed, Telegram forgets them
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._new_update.wait(remaining)
+
+            updates = self._updates[:limit]
+            now = time.monotonic()
+            for update in updates:
+                self._waiting[update["_chat_id"]] = now
+        return [
+            {key: value for key, value in update.items() if key != "_chat_id"}
+            for update in updates
+        ]
+
+    def _message(self, method, params):
+        chat_id = int(params["chat_id"])
+        text = params.get("text", "")
+        markup = json.loads(params.get("reply_markup") or "{}")
+        with self._lock:
+            if method == "sendMessage":
+                self._message_id += 1
+                self.sent += 1
+            message_id = int(params.get("message_id") or self._message_id)
+            # Time from the update to the bot's answer, deliveries excluded
+            waiting = None
+            if not text.startswith(ALARM_PREFIX):
+                waiting = self._waiting.pop(chat_id, None)
+            if waiting is not None:
+                self.response_seconds.append(time.monotonic() - waiting)
+
+        for listener in self.listeners:
+            listener(method, chat_id, message_id, text, markup)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "faults": dict(self.faults),
+                "messages_sent": self.sent,
+                "response_p50_seconds": percentile(self.response_seconds, 50),
+                "response_p99_seconds": percentile(self.response_seconds, 99),
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # /bot<token>/<method>, parameters in the query string or a form body
+    fake: FakeTelegram = None
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update(parse_qsl(body))
+
+        status, body = self.fake.handle(method, params)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fake: FakeTelegram, host: str = "127.0.0.1", port: int = 0):
+    # Serves in a daemon thread, port 0 picks a free one
+    handler = type("Handler", (_Handler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-telegram", daemon=True).start()
+    return server
+
+
+class SyntheticUsers:
+    # Chats that register with /start, create one-message reminders due in
+    # `delay_minutes` and confirm them, and press "Hecho" on a share of the
+    # alarms. Tracks which confirmed reminders fired, how late and how often.
+
+    def __init__(
+        self,
+        fake: FakeTelegram,
+        users: int,
+        rate: float,
+        delay_minutes: int = 1,
+        done_ratio: float = 0.5,
+        first_chat_id: int = 10**9,
+    ):
+        self.fake = fake
+        self.rate = rate
+        self.delay_minutes = delay_minutes
+        self.done_ratio = done_ratio
+        self.chat_ids = list(range(first_chat_id, first_chat_id + users))
+        self.started = set()
+        self.registered = []
+        self.expected = {}
+        self.deliveries = {}
+        self.lateness_seconds = []
+        self.updates = 0
+        self._sequence = 0
+        self._created = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        fake.listeners.append(self._on_bot_message)
+
+    def _user(self, chat_id):
+        return {
+            "id": chat_id,
+            "is_bot": False,
+            "first_name": f"user{chat_id}",
+            "username": f"user{chat_id}",
+        }
+
+    def _next_update(self):
+        # Listeners run on the server's request threads
+        with self._lock:
+            self.updates += 1
+            return self.updates
+
+    def send_text(self, chat_id, text):
+        self.fake.push_update(
+            {
+                "_chat_id": chat_id,
+                "message": {
+                    "message_id": self._next_update(),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": self._user(chat_id),
+                    "text": text,
+                },
+            }
+        )
+
+    def press(self, chat_id, message_id, text, data):
+        self.fake.push_update(
+            {
+                "_chat_id": chat_id,
+                "callback_query": {
+                    "id": str(self._next_update()),
+                    "from": self._user(chat_id),
+                    "chat_instance": str(chat_id),
+                    "data": data,
+                    "message": {
+                        "message_id": message_id,
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": BOT_USER,
+                        "text": text,
+                    },
+                },
+            }
+        )
+
+    def _on_bot_message(self, method, chat_id, message_id, text, markup):
+        buttons = [
+            button["callback_data"]
+            for row in markup.get("inline_keyboard", [])
+            for button in row
+            if "callback_data" in button
+        ]
+        title = TITLE.search(text)
+        if "Seleccione su zona horaria" in text:
+            self.send_text(chat_id, "UTC")
+        elif "Bienvenido" in text:
+            with self._lock:
+                self.registered.append(chat_id)
+        elif "creado exitosamente" in text and title:
+            with self._lock:
+                created = self._created.pop(title.group(), None)
+                if created is not None:
+                    self.expected[title.group()] = created
+        elif method == "sendMessage" and text.startswith(ALARM_PREFIX) and title:
+            # The heads-up before the date has no 🔔, only the alarm counts
+            if "🔔" not in text:
+                return
+            self._on_alarm(title.group())
+            if random.random() < self.done_ratio:
+                done = [data for data in buttons if data.startswith("d:")]
+                if done:
+                    self.press(chat_id, message_id, text, done[0])
+        elif title:
+            confirm = [data for data in buttons if data.startswith("c:")]
+            if confirm:
+                self.press(chat_id, message_id, text, confirm[0])
+
+    def _on_alarm(self, title):
+        with self._lock:
+            self.deliveries[title] = self.deliveries.get(title, 0) + 1
+            expected = self.expected.get(title)
+        if expected is not None and self.deliveries[title] == 1:
+            self.lateness_seconds.append(time.time() - expected)
+
+    def tick(self) -> None:
+        # One action: register the next user, or a new reminder
+        pending = [chat_id for chat_id in self.chat_ids if chat_id not in self.started]
+        if pending:
+            self.started.add(pending[0])
+            self.send_text(pending[0], "/start")
+            return
+
+        with self._lock:
+            if not self.registered:
+                return
+            chat_id = random.choice(self.registered)
+            self._sequence += 1
+            title = f"Soak {self._sequence}"
+            self._created[title] = time.time() + self.delay_minutes * 60
+        self.send_text(chat_id, f"/reminder en {self.delay_minutes} minutos {title}")
+
+    def run(self, duration: float) -> None:
+        end = time.monotonic() + duration
+        while not self._stopped.is_set() and time.monotonic() < end:
+            self.tick()
+            self._stopped.wait(1 / self.rate)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def report(self, deadline: float) -> dict:
+        # Reminders due before `deadline` that never fired count as missed
+        with self._lock:
+            missed = [
+                title
+                for title, expected in self.expected.items()
+                if expected < deadline and title not in self.deliveries
+            ]
+            duplicates = [title for title, count in self.deliveries.items() if count > 1]
+            return {
+                "updates": self.updates,
+                "registered_users": len(self.registered),
+                "reminders_confirmed": len(self.expected),
+                "reminders_delivered": len(self.deliveries),
+                "missed": len(missed),
+                "duplicates": len(duplicates),
+                "lateness_p50_seconds": percentile(self.lateness_seconds, 50),
+                "lateness_p99_seconds": percentile(self.lateness_seconds, 99),
+            }
+
+
+if __name__ == "__main__":
+    # Standalone server for a separately started bot, e.g.
+    #   TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} python main.py
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=5, help="user actions/s")
+    parser.add_argument("--duration", type=float, default=3600)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds")
+    parser.add_argument("--flood-ratio", type=float, default=0.01)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--error-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.latency, args.flood_ratio, args.retry_after, args.error_ratio)
+    users = SyntheticUsers(fake, args.users, args.rate)
+    serve(fake, port=args.port)
+    print(f"Fake Bot API on http://127.0.0.1:{args.port}/bot{{0}}/{{1}}")
+    threading.Thread(target=users.run, args=(args.duration,), daemon=True).start()
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps({**fake.stats(), **users.report(time.time() - 120)}))
+    except KeyboardInterrupt:
+        pass
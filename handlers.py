@@ -0,0 +1,737 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from functools import wraps
+
+import pytz
+from telebot.types import (KeyboardButton, ReplyKeyboardMarkup,
+                           ReplyKeyboardRemove)
+
+import config
+from bot import HandlerRegistry
+from broadcast import broadcast_command
+from metrics import timed_handler
+from recurrence import describe_rule, format_rule, parse_rule
+from reminder_parser import QUICK_REMINDER_HELP, parse_reminder
+from step_state import step_handler
+from utils import (AGENDA_OPTIONS, DIGEST_OPTIONS, draft_markup,
+                   draft_summary, get_tz, is_reminder_action, local_to_utc,
+                   options_markup, parse_agenda_time, parse_digest_minutes,
+                   parse_page_key, reminder_action_response,
+                   reminder_action_values, render_reminders_page,
+                   render_table_stats, time_zone_markup, utc_now,
+                   utc_to_local)
+
+logger = logging.getLogger("app")
+
+# Bot handlers shared by the sync bot (main.py) and the asyncio bot
+# (async_main.py). They are coroutines that reach the bot and the database
+# through the globals set by setup(): AsyncMyBot and AsyncDatabaseManager, or
+# TeleBot and DatabaseManager wrapped in AwaitableCalls. The sync bot runs
+# them with sync_handler.
+registry = HandlerRegistry()
+
+
+async def _call(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+bot = None
+db = None
+# Blocking work without an async version, asyncio.to_thread in the asyncio bot
+run_blocking = _call
+# Called with the schedule fields of a reminder a handler changed
+reminder_changed = None
+
+
+def setup(runtime_bot, runtime_db, blocking=_call, on_reminder_changed=None):
+    global bot, db, run_blocking, reminder_changed
+    bot = runtime_bot
+    db = runtime_db
+    run_blocking = blocking
+    reminder_changed = on_reminder_changed
+
+
+class AwaitableCalls:
+    # Exposes the methods of a sync object as coroutines that call them right
+    # away, attributes are passed through
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return attr(*args, **kwargs)
+
+        return call
+
+
+def run_sync(coro):
+    # A handler of the sync bot only awaits AwaitableCalls, which never
+    # suspend, so it runs to the end on its first step without an event loop
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("A sync bot handler awaited a suspending call")
+
+
+def sync_handler(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_sync(func(*args, **kwargs))
+
+    return wrapper
+
+
+@registry.message_handler(commands=["start"])
+@timed_handler("start")
+async def cmd_start(msg):
+    logger.info("/start")
+    user = await db.get_model(
+        msg.chat.id, db.users, f"get user {msg.from_user.username}"
+    )
+    if not user:
+        user_data = {
+            "id": msg.chat.id,
+            "username": msg.from_user.username,
+            "first_name": msg.from_user.first_name,
+            "last_name": msg.from_user.last_name,
+        }
+
+        sent_msg = await bot.send_message(
+            msg.chat.id, "Seleccione su zona horaria", reply_markup=time_zone_markup()
+        )
+        await bot.register_next_step_handler(sent_msg, get_timezone, user_data)
+        return
+
+    ans = (
+        f"Hola {msg.from_user.first_name} 👋\n\n"
+        "Puedes crear un nuevo recordatorio con /reminder\n"
+        "Ver tus recordatorios con /list\n"
+        "Cambiar tu zona horaria con /timezone\n"
+        "Cambiar tiempo de recordatorios con /remindertime\n"
+        "Agrupar recordatorios con /digest\n"
+        "Recibir una agenda diaria con /agenda\n"
+        "Desactivar/Activar recordatorios con /activate"
+    )
+    await bot.send_message(msg.chat.id, ans, reply_markup=ReplyKeyboardRemove())
+
+
+@step_handler
+async def get_timezone(msg, user_data):
+    try:
+        # Verificar si la zona horaria es válida
+        user_data["time_zone"] = get_tz(msg.text).zone
+        await db.create_model(
+            user_data, db.users, f"create user {user_data['username']}"
+        )
+
+        ans = (
+            f"¡Bienvenido {msg.from_user.first_name}! 👋\n\n"
+            f"Tu zona horaria se ha configurado como: {user_data['time_zone']}\n\n"
+            "Ahora puedes:\n"
+            "- Crear recordatorios con /reminder\n"
+            "- Ver tus recordatorios con /list\n"
+            "- Cambiar tu zona horaria con /timezone\n"
+            "- Ajustar el tiempo de recordatorios con /remindertime\n"
+            "- Agrupar recordatorios con /digest\n"
+            "- Recibir una agenda diaria con /agenda\n"
+            "- Activar/desactivar notificaciones con /activate"
+        )
+        await bot.send_message(msg.chat.id, ans, reply_markup=ReplyKeyboardRemove())
+
+    except pytz.exceptions.UnknownTimeZoneError:
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Zona horaria no válida. Por favor selecciona una de las opciones:",
+            reply_markup=time_zone_markup(),
+        )
+        await bot.register_next_step_handler(sent_msg, get_timezone, user_data)
+
+
+@registry.message_handler(commands=["reminder"])
+@timed_handler("reminder")
+async def create_reminder(msg):
+    logger.info("/reminder")
+    user = await db.get_model(
+        msg.chat.id, db.users, f"get user {msg.from_user.username}"
+    )
+    if not user:
+        await bot.send_message(msg.chat.id, "No estás registrado. Usa /start primero.")
+        return
+
+    args = msg.text.split(maxsplit=1)
+    if len(args) > 1:
+        await create_quick_reminder(msg, user, args[1])
+        return
+
+    sent_msg = await bot.send_message(
+        msg.chat.id, "Vamos a crear un nuevo recordatorio. Primero dime el título:"
+    )
+    await bot.register_next_step_handler(sent_msg, process_reminder_title)
+
+
+async def create_quick_reminder(msg, user, text):
+    # One parse, one insert and one reply, confirmed from the inline button
+    time_zone = user["time_zone"] or "UTC"
+    now = utc_now()
+    try:
+        date, title, description = parse_reminder(text, time_zone, now)
+    except ValueError:
+        await bot.send_message(msg.chat.id, QUICK_REMINDER_HELP, typing=False)
+        return
+
+    if now > date:
+        local_now = utc_to_local(now, time_zone).strftime("%d/%m/%Y %H:%M")
+        await bot.send_message(
+            msg.chat.id,
+            f"La fecha no puede pertenecer al pasado. Son las {local_now}",
+            typing=False,
+        )
+        return
+
+    data = {
+        "user_id": msg.chat.id,
+        "title": title,
+        "description": description,
+        "date": date,
+        "reminder_time": date - timedelta(minutes=user["default_reminder_minutes"]),
+        "series_start": date,
+        "status": "draft",
+    }
+    reminder_id = await db.create_model(data, db.reminders, f"create draft {title}")
+    summary = draft_summary(title, description, utc_to_local(date, time_zone))
+    await bot.send_message(
+        msg.chat.id, summary, reply_markup=draft_markup(reminder_id), typing=False
+    )
+
+
+@registry.callback_query_handler(func=lambda call: call.data[:2] in ("c:", "x:"))
+async def confirm_quick_reminder(call):
+    action, reminder_id = call.data.split(":")
+    chat_id = call.message.chat.id
+    if action == "c" and await db.confirm_draft(int(reminder_id), chat_id):
+        response = "✅ Recordatorio creado exitosamente!"
+    elif action == "x" and await db.discard_draft(int(reminder_id), chat_id):
+        response = "Recordatorio cancelado"
+    else:
+        await bot.answer_callback_query(
+            call.id, "Este recordatorio ya no está pendiente"
+        )
+        return
+
+    await bot.edit_message_text(
+        f"{call.message.text}\n\n{response}", chat_id, call.message.message_id
+    )
+    await bot.answer_callback_query(call.id)
+
+
+@registry.callback_query_handler(func=lambda call: is_reminder_action(call.data))
+async def reminder_action(call):
+    # Buttons of a delivered reminder. A scheduler process picks up the change
+    # through updated_at, the asyncio bot's scheduler gets it right away.
+    action, reminder_id = call.data.split(":")
+    chat_id = call.message.chat.id
+    user = await db.get_model(chat_id, db.users, f"get user for action {action}")
+    time_zone = user["time_zone"] if user else None
+    now = utc_now()
+    values = reminder_action_values(action, now, time_zone)
+    reminder = await db.apply_reminder_action(int(reminder_id), chat_id, values, now)
+    if not reminder:
+        await bot.answer_callback_query(
+            call.id, "Este recordatorio ya no se puede cambiar"
+        )
+        return
+
+    if reminder_changed:
+        reminder_changed(reminder)
+    response = reminder_action_response(values, time_zone)
+    await bot.edit_message_text(
+        f"{call.message.text}\n\n{response}", chat_id, call.message.message_id
+    )
+    await bot.answer_callback_query(call.id)
+
+
+@step_handler
+async def process_reminder_title(msg):
+    try:
+        reminder_data = {"title": msg.text}
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "Genial. Ahora, por favor, describe el recordatorio (o escribe 'saltar' si no quieres añadir una descripción):",
+        )
+        await bot.register_next_step_handler(
+            sent_msg, process_reminder_description, reminder_data
+        )
+    except Exception as exc:
+        logger.error("Error en process_reminder_title: %s", exc)
+        await bot.send_message(
+            msg.chat.id, "Ocurrió un error. Por favor intenta nuevamente con /reminder"
+        )
+
+
+@step_handler
+async def process_reminder_description(msg, reminder_data):
+    try:
+        if msg.text.lower() != "saltar":
+            reminder_data["description"] = msg.text
+        else:
+            reminder_data["description"] = None
+
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "Ahora, ingresa la fecha y hora del recordatorio (formato: DD/MM/AAAA HH:MM)\nEjemplo: 25/12/2023 15:30",
+        )
+        await bot.register_next_step_handler(
+            sent_msg, process_reminder_date, reminder_data
+        )
+    except Exception as e:
+        logger.error("Error en process_reminder_description: %s", e)
+        await bot.send_message(
+            msg.chat.id, "Ocurrió un error. Por favor intenta nuevamente con /reminder"
+        )
+
+
+@step_handler
+async def process_reminder_date(msg, reminder_data):
+    try:
+        date_str = re.sub(r"[^\d/ :]", "", msg.text)
+        date = datetime.strptime(date_str, "%d/%m/%Y %H:%M")
+
+        user = await db.get_model(
+            msg.chat.id, db.users, f"get timezone from user {msg.from_user.username}"
+        )
+        user_time_zone = user.get("time_zone") or "UTC"
+        local_date = date
+        date = local_to_utc(local_date, user_time_zone)
+
+        now = utc_now()
+        if now > date:
+            local_now = utc_to_local(now, user_time_zone).strftime("%d/%m/%Y %H:%M")
+            await bot.send_message(
+                msg.chat.id,
+                f"La fecha no puede pertenecer al pasado. Son las {local_now}",
+            )
+            return
+
+        reminder_data["date"] = date
+
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "¿Se repite? Elige una opción o escribe una regla (ej: semanal;BYDAY=MO,TH;COUNT=10)",
+            reply_markup=recurrence_markup(),
+        )
+        await bot.register_next_step_handler(
+            sent_msg, process_reminder_recurrence, reminder_data
+        )
+
+    except ValueError:
+        await bot.send_message(
+            msg.chat.id,
+            "Formato incorrecto. Por favor ingresa la fecha y hora en formato DD/MM/AAAA HH:MM\nEjemplo: 25/12/2023 15:30",
+        )
+    except Exception as exc:
+        logger.error("Error en process_reminder_date: %s", exc)
+        await bot.send_message(
+            msg.chat.id, "Ocurrió un error. Por favor intenta nuevamente con /reminder"
+        )
+
+
+def recurrence_markup():
+    markup = ReplyKeyboardMarkup(one_time_keyboard=True)
+    markup.add(
+        KeyboardButton("No"),
+        KeyboardButton("Diario"),
+        KeyboardButton("Semanal"),
+        KeyboardButton("Mensual"),
+    )
+    return markup
+
+
+@step_handler
+async def process_reminder_recurrence(msg, reminder_data):
+    try:
+        if msg.text.lower() == "no":
+            reminder_data["recurrence"] = None
+        else:
+            reminder_data["recurrence"] = format_rule(parse_rule(msg.text))
+
+        user = await db.get_model(
+            msg.chat.id, db.users, f"get timezone from user {msg.from_user.username}"
+        )
+        local_date = utc_to_local(reminder_data["date"], user.get("time_zone") or "UTC")
+        recurrence = reminder_data["recurrence"]
+        summary = (
+            f"📌 Resumen del recordatorio:\n\n"
+            f"🏷 Título: {reminder_data['title']}\n"
+            f"📝 Descripción: {reminder_data.get('description', 'Ninguna')}\n"
+            f"📅 Fecha y hora: {local_date.strftime('%d/%m/%Y %H:%M')}\n"
+            f"🔁 Repetición: {describe_rule(recurrence) if recurrence else 'No'}\n\n"
+            f"¿Todo correcto? (sí/no)"
+        )
+
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True)
+        markup.add(KeyboardButton("Sí"), KeyboardButton("No"))
+
+        sent_msg = await bot.send_message(msg.chat.id, summary, reply_markup=markup)
+        await bot.register_next_step_handler(
+            sent_msg, process_reminder_confirmation, reminder_data
+        )
+
+    except ValueError:
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Regla no válida. Usa Diario, Semanal, Mensual o una regla como FREQ=WEEKLY;BYDAY=MO,TH;UNTIL=20261231",
+            reply_markup=recurrence_markup(),
+        )
+        await bot.register_next_step_handler(
+            sent_msg, process_reminder_recurrence, reminder_data
+        )
+    except Exception as exc:
+        logger.error("Error en process_reminder_recurrence: %s", exc)
+        await bot.send_message(
+            msg.chat.id, "Ocurrió un error. Por favor intenta nuevamente con /reminder"
+        )
+
+
+@step_handler
+async def process_reminder_confirmation(msg, reminder_data):
+    try:
+        if msg.text.lower() in ["sí", "si", "s"]:
+            user = await db.get_model(
+                msg.chat.id, db.users, f"get user {msg.from_user.username}"
+            )
+            reminder_time = reminder_data["date"] - timedelta(
+                minutes=user["default_reminder_minutes"]
+            )
+            data = {
+                "user_id": msg.chat.id,
+                "title": reminder_data["title"],
+                "description": reminder_data["description"],
+                "date": reminder_data["date"],
+                "reminder_time": reminder_time,
+                "recurrence": reminder_data.get("recurrence"),
+                "series_start": reminder_data["date"],
+            }
+            await db.create_model(
+                data, db.reminders, f"create reminder {data['title']}"
+            )
+            await bot.send_message(
+                msg.chat.id,
+                "✅ Recordatorio creado exitosamente!",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+        else:
+            await bot.send_message(
+                msg.chat.id,
+                "Recordatorio cancelado. Puedes empezar de nuevo con /reminder",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+    except Exception as e:
+        logger.error("Error en process_reminder_confirmation: %s", e)
+        await bot.send_message(
+            msg.chat.id,
+            "Ocurrió un error al crear el recordatorio. Por favor intenta nuevamente.",
+        )
+
+
+@registry.message_handler(commands=["list"])
+@timed_handler("list")
+async def list_reminders(msg):
+    logger.info("/list")
+    user = await db.get_model(
+        msg.chat.id, db.users, f"get user {msg.from_user.username}"
+    )
+    if not user:
+        await bot.send_message(msg.chat.id, "No estás registrado. Usa /start primero")
+        return
+
+    page = await db.get_reminders_page(msg.chat.id, config.LIST_PAGE_SIZE + 1)
+    if not page:
+        await bot.send_message(msg.chat.id, "No tienes recordatorios pendientes")
+        return
+
+    has_next = len(page) > config.LIST_PAGE_SIZE
+    response, markup = render_reminders_page(
+        page[: config.LIST_PAGE_SIZE], user["time_zone"], False, has_next
+    )
+    await bot.send_message(msg.chat.id, response, reply_markup=markup)
+
+
+@registry.callback_query_handler(func=lambda call: call.data.startswith("l:"))
+async def list_reminders_page(call):
+    # callback_data is "l:<n|p>:<date in epoch microseconds>:<id>"
+    _, direction, date, reminder_id = call.data.split(":")
+    key = parse_page_key(date, reminder_id)
+    user = await db.get_model(call.message.chat.id, db.users, "get user for /list page")
+    if not user:
+        await bot.answer_callback_query(
+            call.id, "No estás registrado. Usa /start primero"
+        )
+        return
+
+    limit = config.LIST_PAGE_SIZE + 1
+    if direction == "n":
+        page = await db.get_reminders_page(call.message.chat.id, limit, after=key)
+        has_prev, has_next = True, len(page) > config.LIST_PAGE_SIZE
+        page = page[: config.LIST_PAGE_SIZE]
+    else:
+        page = await db.get_reminders_page(call.message.chat.id, limit, before=key)
+        has_prev, has_next = len(page) > config.LIST_PAGE_SIZE, True
+        page = page[-config.LIST_PAGE_SIZE :]
+
+    if page:
+        response, markup = render_reminders_page(
+            page, user["time_zone"], has_prev, has_next
+        )
+    else:
+        response, markup = "No tienes recordatorios pendientes", None
+
+    await bot.edit_message_text(
+        response, call.message.chat.id, call.message.message_id, reply_markup=markup
+    )
+    await bot.answer_callback_query(call.id)
+
+
+@registry.message_handler(commands=["activate"])
+@timed_handler("activate")
+async def activate_reminders(msg):
+    logger.info("/activate")
+    user = await db.get_model(
+        msg.chat.id, db.users, f"get user {msg.from_user.username}"
+    )
+    if not user:
+        await bot.send_message(msg.chat.id, "No estás registrado. Usa /start primero.")
+        return
+
+    if user["is_active"]:
+        await db.update_model(
+            msg.chat.id,
+            {"is_active": False},
+            db.users,
+            f"reminders from user {msg.from_user.username} disabled",
+        )
+        await bot.send_message(
+            msg.chat.id,
+            "🔕 Recordatorios desactivados. No recibirás más notificaciones",
+        )
+    else:
+        await db.update_model(
+            msg.chat.id,
+            {"is_active": True},
+            db.users,
+            f"reminders from user {msg.from_user.username} enabled",
+        )
+        await bot.send_message(
+            msg.chat.id, "🔔 Recordatorios activados. Recibirás las notificaciones"
+        )
+
+
+@registry.message_handler(commands=["timezone"])
+@timed_handler("timezone")
+async def set_timezone(msg):
+    logger.info("/timezone")
+    user = await db.get_model(
+        msg.chat.id, db.users, f"get user {msg.from_user.username}"
+    )
+    if not user:
+        await bot.send_message(msg.chat.id, "No estás registrado. Usa /start primero")
+        return
+
+    sent_msg = await bot.send_message(
+        msg.chat.id,
+        "Por favor, ingresa tu zona horaria (ej: America/Havana) o selecciona una de las opciones:",
+        reply_markup=time_zone_markup(),
+    )
+    await bot.register_next_step_handler(sent_msg, handle_timezone)
+
+
+@step_handler
+async def handle_timezone(msg):
+    try:
+        # Verificar si la zona horaria es válida
+        time_zone = get_tz(msg.text).zone
+
+        await db.update_model(
+            msg.chat.id,
+            # The agenda job schedules the next agenda in the new timezone
+            {"time_zone": time_zone, "agenda_next_at": None},
+            db.users,
+            f"update timezone for user {msg.from_user.username}",
+        )
+
+        await bot.send_message(
+            msg.chat.id, f"✅ Zona horaria actualizada a: {time_zone}"
+        )
+
+    except pytz.exceptions.UnknownTimeZoneError:
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Zona horaria no válida. Por favor selecciona una de las opciones:",
+            reply_markup=time_zone_markup(),
+        )
+        await bot.register_next_step_handler(sent_msg, handle_timezone)
+
+
+@registry.message_handler(commands=["remindertime"])
+@timed_handler("remindertime")
+async def set_reminder_time(msg):
+    logger.info("/remindertime")
+    markup = ReplyKeyboardMarkup(one_time_keyboard=True)
+    markup.add(
+        KeyboardButton("15"),
+        KeyboardButton("30"),
+        KeyboardButton("60"),
+        KeyboardButton("120"),
+    )
+
+    sent_msg = await bot.send_message(
+        msg.chat.id,
+        "¿Cuántos minutos antes del recordatorio quieres recibir el recordatorio? (ej: 30 para 30 minutos antes)",
+        reply_markup=markup,
+    )
+    await bot.register_next_step_handler(sent_msg, handle_reminder_time)
+
+
+@step_handler
+async def handle_reminder_time(msg):
+    try:
+        if not msg.text.isdigit():
+            raise ValueError
+        minutes = int(msg.text)
+        if minutes <= 0:
+            raise ValueError
+
+        await db.update_model(
+            msg.chat.id,
+            {"default_reminder_minutes": minutes},
+            db.users,
+            f"update reminder time for user {msg.from_user.username}",
+        )
+
+        await bot.send_message(
+            msg.chat.id,
+            f"✅ Recordatorio configurado para {minutes} minutos antes de la hora",
+        )
+
+    except ValueError:
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True)
+        markup.add(
+            KeyboardButton("15"),
+            KeyboardButton("30"),
+            KeyboardButton("60"),
+            KeyboardButton("120"),
+        )
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Por favor ingresa un número válido de minutos (ej: 30)",
+            reply_markup=markup,
+        )
+        await bot.register_next_step_handler(sent_msg, handle_reminder_time)
+
+
+@registry.message_handler(commands=["digest"])
+@timed_handler("digest")
+async def set_digest(msg):
+    logger.info("/digest")
+    sent_msg = await bot.send_message(
+        msg.chat.id,
+        "¿Agrupar en un solo mensaje los recordatorios que vencen dentro de cuántos minutos? "
+        "Los avisos previos agrupados pueden llegar antes, las alarmas llegan a su hora "
+        "(No para desactivar)",
+        reply_markup=options_markup(*DIGEST_OPTIONS),
+    )
+    await bot.register_next_step_handler(sent_msg, handle_digest)
+
+
+@step_handler
+async def handle_digest(msg):
+    try:
+        minutes = parse_digest_minutes(msg.text)
+    except ValueError:
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Por favor ingresa un número válido de minutos (ej: 30) o No",
+            reply_markup=options_markup(*DIGEST_OPTIONS),
+        )
+        await bot.register_next_step_handler(sent_msg, handle_digest)
+        return
+
+    await db.update_model(
+        msg.chat.id,
+        {"digest_minutes": minutes},
+        db.users,
+        f"update digest for user {msg.from_user.username}",
+    )
+    if minutes:
+        ans = f"✅ Recibirás juntos los recordatorios de cada {minutes} minutos"
+    else:
+        ans = "✅ Recibirás un mensaje por recordatorio"
+    await bot.send_message(msg.chat.id, ans, reply_markup=ReplyKeyboardRemove())
+
+
+@registry.message_handler(commands=["agenda"])
+@timed_handler("agenda")
+async def set_agenda(msg):
+    logger.info("/agenda")
+    sent_msg = await bot.send_message(
+        msg.chat.id,
+        "¿A qué hora quieres recibir cada día tu agenda? (ej: 08:00, No para desactivar)",
+        reply_markup=options_markup(*AGENDA_OPTIONS),
+    )
+    await bot.register_next_step_handler(sent_msg, handle_agenda)
+
+
+@step_handler
+async def handle_agenda(msg):
+    try:
+        agenda_time = parse_agenda_time(msg.text)
+    except ValueError:
+        sent_msg = await bot.send_message(
+            msg.chat.id,
+            "❌ Por favor ingresa una hora válida (ej: 08:00) o No",
+            reply_markup=options_markup(*AGENDA_OPTIONS),
+        )
+        await bot.register_next_step_handler(sent_msg, handle_agenda)
+        return
+
+    await db.update_model(
+        msg.chat.id,
+        # The agenda job schedules the next one
+        {"agenda_time": agenda_time, "agenda_next_at": None},
+        db.users,
+        f"update agenda for user {msg.from_user.username}",
+    )
+    if agenda_time:
+        ans = f"✅ Recibirás tu agenda cada día a las {agenda_time}"
+    else:
+        ans = "✅ Agenda diaria desactivada"
+    await bot.send_message(msg.chat.id, ans, reply_markup=ReplyKeyboardRemove())
+
+
+@registry.message_handler(
+    commands=["stats"], func=lambda msg: msg.chat.id in config.ADMIN_IDS
+)
+@timed_handler("stats")
+async def show_stats(msg):
+    logger.info("/stats")
+    await bot.send_message(msg.chat.id, render_table_stats(await db.table_stats()))
+
+
+@registry.message_handler(
+    commands=["broadcast"], func=lambda msg: msg.chat.id in config.ADMIN_IDS
+)
+@timed_handler("broadcast")
+async def broadcast(msg):
+    logger.info("/broadcast")
+    args = msg.text.split(maxsplit=1)
+    reply = await run_blocking(
+        broadcast_command, args[1] if len(args) > 1 else None, msg.chat.id
+    )
+    await bot.send_message(msg.chat.id, reply)
@@ -1,68 +1,157 @@
+import atexit
+import logging
+import threading
+import time
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
+from asgi_correlation_id import CorrelationIdFilter
 
-def configure_logging() -> None:
-    dictConfig(
-        {
-            "version": 1,
-            "disable_existing_loggers": False,
-            "filters": {
-                "correlation_id": {
-                    "()": "asgi_correlation_id.CorrelationIdFilter",
-                    "uuid_length": 8,
-                    "default_value": "-",
-                }
+import config
+
+# Loggers whose records go through the queue, handlers run on the listener
+# thread so console and file I/O stay off the request and scheduler paths
+QUEUED_LOGGERS = ("app", "waitress", "gunicorn", "sqlalchemy")
+
+# Templates tracked by RateLimitFilter before expired ones are dropped
+MAX_RATE_LIMIT_KEYS = 10000
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    # Lets `burst` records per message template through every `period`
+    # seconds. Keyed on the unformatted message, so it relies on lazy
+    # %-style arguments; the first record after a suppressed run reports
+    # how many were dropped.
+
+    def __init__(self, burst: int, period: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+
+        msg = record.msg
+        if not isinstance(msg, str):
+            msg = type(msg).__name__
+        key = (record.name, record.levelno, msg)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._windows) > MAX_RATE_LIMIT_KEYS:
+                self._prune(now)
+
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                started, count = now, 0
+
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+
+            self._windows[key] = (started, count + 1, 0)
+
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+    def _prune(self, now: float) -> None:
+        # Messages built with f-strings get a key each, drop expired windows
+        self._windows = {
+            key: window
+            for key, window in self._windows.items()
+            if now - window[0] < self.period
+        }
+
+
+def _logging_config(profile: str, level: str) -> dict:
+    handler = "rotating_file" if profile == "prod" else "default"
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {
+            "console": {
+                "class": "logging.Formatter",
+                "datefmt": "%Y-%m-%dT%H:%M:%S",
+                "format": "(%(correlation_id)s) %(name)s:%(lineno)d - %(message)s",
             },
-            "formatters": {
-                "console": {
-                    "class": "logging.Formatter",
-                    "dateftm": "%Y-%m-%dT%H:%M:%S",
-                    "format": "(%(correlation_id)s) %(name)s:%(lineno)d - %(message)s",
-                },
-                "file": {
-                    "class": "logging.Formatter",
-                    "dateftm": "%Y-%m-%dT%H:%M:%S",
-                    "format": "%(asctime)s.%(msecs)03dZ | %(levelname)-8s | [%(correlation_id)s] %(name)s:%(lineno)d - %(message)s",
-                },
-                "file_json": {
-                    "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
-                    "dateftm": "%Y-%m-%dT%H:%M:%S",
-                    "format": "%(asctime)s %(msecs)03d %(levelname)-8s %(correlation_id)s %(name)s %(lineno)d %(message)s",
-                },
+            "file": {
+                "class": "logging.Formatter",
+                "datefmt": "%Y-%m-%dT%H:%M:%S",
+                "format": "%(asctime)s.%(msecs)03dZ | %(levelname)-8s | [%(correlation_id)s] %(name)s:%(lineno)d - %(message)s",
             },
-            "handlers": {
-                "default": {
-                    "class": "rich.logging.RichHandler",
-                    "level": "DEBUG",
-                    "formatter": "console",
-                    "filters": ["correlation_id"],
-                },
-                "rotating_file": {
-                    "class": "logging.handlers.RotatingFileHandler",
-                    "level": "DEBUG",
-                    "formatter": "file_json",
-                    "filename": "records.log",
-                    "maxBytes": 1024 * 1024,  # 1MB
-                    "backupCount": 5,
-                    "encoding": "utf8",
-                    "filters": ["correlation_id"],
-                },
+            "file_json": {
+                "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
+                "datefmt": "%Y-%m-%dT%H:%M:%S",
+                "format": "%(asctime)s %(msecs)03d %(levelname)-8s %(correlation_id)s %(name)s %(lineno)d %(message)s",
             },
-            "loggers": {
-                "waitress": {"handlers": ["default"], "level": "INFO"},
-                "gunicorn": {
-                    "handlers": ["default"],
-                    "level": "WARNING",
-                },
-                "sqlalchemy": {
-                    "handlers": ["default"],
-                    "level": "WARNING",
-                },
-                "app": {
-                    "handlers": ["default"],
-                    "level": "DEBUG",
-                    "propagate": False,
-                },
+        },
+        "handlers": {
+            "default": {
+                "class": "rich.logging.RichHandler",
+                "level": "DEBUG",
+                "formatter": "console",
             },
-        }
-    )
\ No newline at end of file
+            "rotating_file": {
+                "class": "logging.handlers.RotatingFileHandler",
+                "level": "DEBUG",
+                "formatter": "file_json",
+                "filename": config.LOG_FILE,
+                "maxBytes": 1024 * 1024,  # 1MB
+                "backupCount": 5,
+                "encoding": "utf8",
+            },
+        },
+        "loggers": {
+            "waitress": {"handlers": [handler], "level": "INFO"},
+            "gunicorn": {
+                "handlers": [handler],
+                "level": "WARNING",
+            },
+            "sqlalchemy": {
+                "handlers": [handler],
+                "level": "WARNING",
+            },
+            "app": {
+                "handlers": [handler],
+                "level": level,
+                "propagate": False,
+            },
+        },
+    }
+
+
+def configure_logging() -> None:
+    # Safe to call from every module, only the first call configures
+    global _listener
+    if _listener is not None:
+        return
+
+    profile = config.LOG_PROFILE
+    level = config.LOG_LEVEL or ("INFO" if profile == "prod" else "DEBUG")
+    dictConfig(_logging_config(profile, level))
+
+    # Filters run in the caller's thread: the correlation id lives in a
+    # context variable and rate-limited records never reach the queue
+    queue = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(CorrelationIdFilter(uuid_length=8, default_value="-"))
+    queue_handler.addFilter(RateLimitFilter(config.LOG_RATE_LIMIT))
+
+    handlers = []
+    for name in QUEUED_LOGGERS:
+        logger = logging.getLogger(name)
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+            if handler not in handlers:
+                handlers.append(handler)
+        logger.addHandler(queue_handler)
+
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,162 @@
+import inspect
+import time
+from functools import wraps
+from weakref import WeakKeyDictionary
+
+from prometheus_client import (CONTENT_TYPE_LATEST, Counter, Histogram,
+                               generate_latest)
+from prometheus_client.core import (REGISTRY, CounterMetricFamily,
+                                    GaugeMetricFamily)
+from sqlalchemy import event
+
+LATENESS_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds", "Database statement duration", ["statement"]
+)
+SCHEDULER_TICK_SECONDS = Histogram(
+    "scheduler_tick_seconds", "Duration of a scheduler tick"
+)
+REMINDERS_DUE = Counter(
+    "scheduler_reminders_due_total", "Reminders claimed for delivery"
+)
+DELIVERY_LATENESS_SECONDS = Histogram(
+    "reminder_delivery_lateness_seconds",
+    "Delivery time minus reminder_time/date",
+    # Outbox message kind: incoming, completed, digest or agenda
+    ["kind"],
+    buckets=LATENESS_BUCKETS,
+)
+TELEGRAM_SEND_SECONDS = Histogram(
+    "telegram_send_seconds", "Duration of a sendMessage call"
+)
+TELEGRAM_SEND_ERRORS = Counter(
+    "telegram_send_errors_total", "Failed sendMessage calls", ["code"]
+)
+OUTBOX_MESSAGES = Counter(
+    "outbox_messages_total", "Outbox send results", ["result"]
+)
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Duration of bot command handlers", ["command"]
+)
+
+
+# The start time lives on the execution context, a statement that fails
+# leaves nothing behind on the pooled connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    statement_type = statement.lstrip().split(None, 1)[0].upper()
+    DB_QUERY_SECONDS.labels(statement_type).observe(elapsed)
+
+
+def instrument_engine(engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# Caches by name, read on every scrape. Weak references so a dropped
+# database manager takes its cache with it.
+_caches = WeakKeyDictionary()
+
+
+def track_cache(name: str, cache) -> None:
+    _caches[cache] = name
+
+
+class _CacheCollector:
+    # Sums the stats() of the live caches of each name at scrape time
+    def collect(self):
+        hits = CounterMetricFamily(
+            "cache_hits", "Lookups served from the cache", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "cache_misses", "Lookups that went to the database", labels=["cache"]
+        )
+        entries = GaugeMetricFamily(
+            "cache_entries", "Entries held in the cache", labels=["cache"]
+        )
+        totals = {}
+        for cache, name in list(_caches.items()):
+            stats = cache.stats()
+            total = totals.setdefault(name, [0, 0, 0])
+            total[0] += stats["hits"]
+            total[1] += stats["misses"]
+            total[2] += stats["size"]
+
+        for name, (hit_count, miss_count, size) in totals.items():
+            hits.add_metric([name], hit_count)
+            misses.add_metric([name], miss_count)
+            entries.add_metric([name], size)
+        yield hits
+        yield misses
+        yield entries
+
+
+REGISTRY.register(_CacheCollector())
+
+# Database managers by engine name, their pool_stats() is read on every
+# scrape. Tracked once their engine exists.
+_pools = WeakKeyDictionary()
+POOL_STATES = ("size", "checkedin", "checkedout", "overflow")
+
+
+def track_pool(name: str, database) -> None:
+    _pools[database] = name
+
+
+class _PoolCollector:
+    # Sums the connection counts of the live pools of each engine name
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "db_pool_connections",
+            "Connection pool counts by state",
+            labels=["engine", "state"],
+        )
+        totals = {}
+        for database, name in list(_pools.items()):
+            stats = database.pool_stats()
+            # SQLite in-memory and NullPool pools don't keep these counts
+            for state in POOL_STATES:
+                if state in stats:
+                    key = (name, state)
+                    totals[key] = totals.get(key, 0) + stats[state]
+
+        for labels, value in totals.items():
+            connections.add_metric(list(labels), value)
+        yield connections
+
+
+REGISTRY.register(_PoolCollector())
+
+
+def timed_handler(command: str):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with HANDLER_SECONDS.labels(command).time():
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with HANDLER_SECONDS.labels(command).time():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,190 @@
+import logging
+
+import config
+from database import DatabaseManager, db
+from logging_conf import configure_logging
+from sqlalchemy import (TIMESTAMP, Column, MetaData, String, Table, bindparam,
+                        insert, inspect, select, text, update)
+from utils import get_tz, local_to_utc, utc_now
+
+logger = logging.getLogger("app")
+
+BATCH_SIZE = 1000
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("name", String(100), primary_key=True),
+    Column("applied_at", TIMESTAMP(timezone=True), nullable=False),
+)
+
+
+def server_timezone() -> str:
+    # Only needed to convert rows stored before timestamps were UTC
+    if not config.SERVER_TIMEZONE:
+        raise RuntimeError(
+            "SERVER_TIMEZONE_PROD/SERVER_TIMEZONE_DEV is required to convert "
+            "existing reminders to UTC"
+        )
+    return get_tz(config.SERVER_TIMEZONE).zone
+
+
+def reminders_to_utc(db: DatabaseManager, connection) -> None:
+    # Reminder times used to be naive timestamps in SERVER_TIMEZONE. Columns
+    # that later steps add hold no old values and are left out.
+    reminders = db.reminders
+    existing = {
+        column["name"] for column in inspect(connection).get_columns("reminders")
+    }
+    has_rows = connection.execute(select(reminders.c.id).limit(1)).first() is not None
+    # An empty table has nothing to convert, any zone does for the DDL
+    time_zone = server_timezone() if has_rows else "UTC"
+
+    if connection.dialect.name == "postgresql":
+        columns = ("date", "reminder_time", "created_at", "updated_at", "claimed_until")
+        for column in columns:
+            if column not in existing:
+                continue
+            data_type = connection.execute(
+                text(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_name = 'reminders' AND column_name = :column"
+                ),
+                {"column": column},
+            ).scalar()
+            if data_type != "timestamp without time zone":
+                continue
+
+            # time_zone is a validated pytz name, safe to inline in DDL
+            connection.execute(
+                text(
+                    f"ALTER TABLE reminders ALTER COLUMN {column} TYPE TIMESTAMPTZ "
+                    f"USING {column} AT TIME ZONE '{time_zone}'"
+                )
+            )
+        return
+
+    if not has_rows:
+        return
+
+    # SQLite has no timestamp types, rewrite the values in batches.
+    # created_at comes from CURRENT_TIMESTAMP, which is already UTC.
+    columns = [
+        column
+        for column in ("date", "reminder_time", "updated_at", "claimed_until")
+        if column in existing
+    ]
+    query = update(reminders).where(reminders.c.id == bindparam("_id"))
+    query = query.values({column: bindparam(column) for column in columns})
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(reminders.c.id, *[reminders.c[column] for column in columns])
+            .where(reminders.c.id > last_id)
+            .order_by(reminders.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            values = {"_id": row.id}
+            for column in columns:
+                value = getattr(row, column)
+                values[column] = local_to_utc(value, time_zone) if value else None
+            params.append(values)
+
+        connection.execute(query, params)
+        last_id = rows[-1].id
+        logger.info("Reminders converted to UTC up to id %s", last_id)
+
+
+def create_schema(db: DatabaseManager, connection) -> None:
+    # Creates missing tables with their indexes. Indexes of tables that
+    # already existed are created separately, create_all skips them, unless
+    # they use a column that a later step adds.
+    db.metadata.create_all(connection)
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+def add_columns(connection, table: Table, names) -> None:
+    # create_all doesn't add columns to an existing table
+    columns = inspect(connection).get_columns(table.name)
+    existing = {column["name"] for column in columns}
+    for name in names:
+        if name in existing:
+            continue
+
+        column = table.c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        default = ""
+        if not column.nullable and column.default is not None:
+            default = f" NOT NULL DEFAULT {column.default.arg}"
+        connection.execute(
+            text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}{default}")
+        )
+
+
+def reminders_recurrence(db: DatabaseManager, connection) -> None:
+    add_columns(connection, db.reminders, ("recurrence", "series_start", "occurrence"))
+
+
+def reminders_claims(db: DatabaseManager, connection) -> None:
+    # Worker leases, added to the schema before it was versioned
+    add_columns(connection, db.reminders, ("claimed_by", "claimed_until"))
+
+
+def broadcasts(db: DatabaseManager, connection) -> None:
+    # The broadcasts table and the outbox index come from create_schema
+    add_columns(connection, db.outbox, ("broadcast_id",))
+    create_schema(db, connection)
+
+
+def users_digest(db: DatabaseManager, connection) -> None:
+    # ix_users_agenda_next_at comes from create_schema
+    add_columns(
+        connection, db.users, ("digest_minutes", "agenda_time", "agenda_next_at")
+    )
+    create_schema(db, connection)
+
+
+# Applied in this order, each one once. A new database gets the current
+# schema from create_schema and the later steps find nothing to do.
+MIGRATIONS = [
+    ("0000_create_schema", create_schema),
+    ("0001_reminders_utc", reminders_to_utc),
+    ("0002_reminders_recurrence", reminders_recurrence),
+    ("0003_reminders_claims", reminders_claims),
+    ("0004_broadcasts", broadcasts),
+    ("0005_users_digest", users_digest),
+]
+
+
+def migrate(db: DatabaseManager) -> None:
+    metadata.create_all(db.engine)
+    with db.engine.connect() as connection:
+        applied = set(connection.execute(select(schema_migrations.c.name)).scalars())
+
+    for name, step in MIGRATIONS:
+        if name in applied:
+            continue
+
+        with db.engine.begin() as connection:
+            step(db, connection)
+            connection.execute(
+                insert(schema_migrations).values(name=name, applied_at=utc_now())
+            )
+        logger.info("Migration %s applied", name)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    migrate(db)
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import wait
+from datetime import timedelta
+
+import config
+from database import db
+from logging_conf import configure_logging
+from metrics import DELIVERY_LATENESS_SECONDS, OUTBOX_MESSAGES
+from recurrence import advance_reminder
+from telebot.apihelper import ApiTelegramException
+from utils import (as_utc, build_digest_message, build_reminder_message,
+                   reminder_actions_markup, utc_now)
+
+logger = logging.getLogger("app")
+
+# Telegram answers these when the chat or the message can never be delivered
+PERMANENT_ERROR_CODES = (400, 403)
+
+
+def plan_deliveries(reminders, now):
+    # Returns (messages, transitions, advances) for a claimed batch, ready for
+    # enqueue_deliveries. The key makes a re-claimed reminder enqueue once.
+    # Reminders of digest users go out in one message per user, with the
+    # heads-ups due within their window. Alarms only go at their date.
+    messages = []
+    transitions = {"completed": [], "incoming": []}
+    advances = []
+    digests = {}
+    for reminder in reminders:
+        window = reminder["digest_minutes"]
+        heads_up_until = now + timedelta(minutes=window) if window else None
+        built = build_reminder_message(reminder, now, heads_up_until)
+        if built is None:
+            continue
+
+        status, fire_time, text = built
+        # Recurring reminders get their next occurrence instead of closing
+        advance = advance_reminder(reminder, now) if status == "completed" else None
+        if advance:
+            advances.append(advance)
+        else:
+            transitions[status].append(reminder["id"])
+
+        if window:
+            digests.setdefault(reminder["user_id"], []).append(
+                (status, fire_time, reminder)
+            )
+            continue
+
+        # Done/snooze buttons on the alarm of one-shot reminders
+        markup = None
+        if status == "completed" and not reminder["recurrence"]:
+            markup = reminder_actions_markup(reminder["id"]).to_json()
+        key = f"{reminder['id']}:{status}:{int(fire_time.timestamp())}"
+        messages.append(
+            outbox_message(
+                key, status, reminder["user_id"], text, fire_time, now, markup
+            )
+        )
+
+    for user_id, items in digests.items():
+        status, fire_time, reminder = min(items, key=lambda item: item[1])
+        key = f"digest:{reminder['id']}:{status}:{int(fire_time.timestamp())}"
+        text = build_digest_message(items, reminder["time_zone"])
+        messages.append(outbox_message(key, "digest", user_id, text, fire_time, now))
+
+    return messages, transitions, advances
+
+
+def outbox_message(key, kind, chat_id, text, fire_time, now, reply_markup=None):
+    return {
+        "idempotency_key": key,
+        "kind": kind,
+        "chat_id": chat_id,
+        "text": text,
+        "reply_markup": reply_markup,
+        "fire_time": fire_time,
+        "next_attempt_at": now,
+    }
+
+
+def failure_update(message, exc, now):
+    # Transient errors were already retried by the dispatcher, the outbox
+    # retries again later with a longer backoff
+    attempts = message["attempts"] + 1
+    permanent = (
+        isinstance(exc, ApiTelegramException)
+        and exc.error_code in PERMANENT_ERROR_CODES
+    )
+    gave_up = permanent or attempts >= config.OUTBOX_MAX_ATTEMPTS
+    delay = min(config.OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1), 3600)
+    return {
+        "_id": message["id"],
+        "status": "failed" if gave_up else "pending",
+        "attempts": attempts,
+        "next_attempt_at": now + timedelta(seconds=delay),
+        "last_error": str(exc)[:1000],
+    }
+
+
+def send_kwargs(message):
+    if message["reply_markup"]:
+        return {"reply_markup": message["reply_markup"]}
+    return {}
+
+
+def observe_sent(message):
+    OUTBOX_MESSAGES.labels("sent").inc()
+    if message["fire_time"]:
+        lateness = (utc_now() - as_utc(message["fire_time"])).total_seconds()
+        DELIVERY_LATENESS_SECONDS.labels(message["kind"]).observe(lateness)
+
+
+class OutboxSender:
+    # Drains the outbox in claimed batches through a MessageDispatcher. Each
+    # message is marked sent as soon as Telegram accepts it, so a crash can
+    # repeat at most the messages in flight.
+
+    def __init__(self, dispatcher, db=db, worker_id: str = config.WORKER_ID):
+        self.dispatcher = dispatcher
+        self.db = db
+        self.worker_id = worker_id
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def _on_done(self, message, future) -> None:
+        now = utc_now()
+        exc = future.exception()
+        if exc is None:
+            self.db.mark_outbox_sent([message["id"]], now)
+            observe_sent(message)
+            return
+
+        update = failure_update(message, exc, now)
+        logger.error("Error sending outbox message %s: %s", message["id"], exc)
+        OUTBOX_MESSAGES.labels(update["status"]).inc()
+        self.db.mark_outbox_failed([update])
+
+    def drain(self) -> int:
+        lease = timedelta(seconds=config.CLAIM_LEASE_SECONDS)
+        drained = 0
+        while not self._stopped.is_set():
+            messages = self.db.claim_outbox(
+                self.worker_id, utc_now(), lease, config.OUTBOX_BATCH_SIZE
+            )
+            futures = []
+            for message in messages:
+                future = self.dispatcher.submit(
+                    message["chat_id"], message["text"], **send_kwargs(message)
+                )
+                future.add_done_callback(
+                    lambda future, message=message: self._on_done(message, future)
+                )
+                futures.append(future)
+            wait(futures)
+
+            drained += len(messages)
+            if len(messages) < config.OUTBOX_BATCH_SIZE:
+                break
+        return drained
+
+    def run_forever(self) -> None:
+        # Woken by notify() after a scheduler tick, polls for retries and for
+        # messages enqueued by other processes
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception as exc:
+                logger.error("Error draining outbox: %s", exc)
+            self._wakeup.wait(config.OUTBOX_POLL_SECONDS)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run_forever, name="outbox", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+
+class AsyncOutboxSender(OutboxSender):
+    # Same outbox, drained on the bot's event loop with an async database
+    # manager and an AsyncMessageDispatcher
+
+    def __init__(self, dispatcher, db, worker_id: str = config.WORKER_ID):
+        super().__init__(dispatcher, db, worker_id)
+        self._async_wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        self._async_wakeup.set()
+
+    async def _send(self, message) -> None:
+        try:
+            await self.dispatcher.send(
+                message["chat_id"], message["text"], **send_kwargs(message)
+            )
+        except Exception as exc:
+            update = failure_update(message, exc, utc_now())
+            logger.error("Error sending outbox message %s: %s", message["id"], exc)
+            OUTBOX_MESSAGES.labels(update["status"]).inc()
+            await self.db.mark_outbox_failed([update])
+            return
+
+        await self.db.mark_outbox_sent([message["id"]], utc_now())
+        observe_sent(message)
+
+    async def drain(self) -> int:
+        lease = timedelta(seconds=config.CLAIM_LEASE_SECONDS)
+        drained = 0
+        while not self._stopped.is_set():
+            messages = await self.db.claim_outbox(
+                self.worker_id, utc_now(), lease, config.OUTBOX_BATCH_SIZE
+            )
+            await asyncio.gather(*(self._send(message) for message in messages))
+
+            drained += len(messages)
+            if len(messages) < config.OUTBOX_BATCH_SIZE:
+                break
+        return drained
+
+    async def run(self) -> None:
+        while not self._stopped.is_set():
+            self._async_wakeup.clear()
+            try:
+                await self.drain()
+            except Exception as exc:
+                logger.error("Error draining outbox: %s", exc)
+            try:
+                await asyncio.wait_for(
+                    self._async_wakeup.wait(), config.OUTBOX_POLL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._async_wakeup.set()
+
+
+if __name__ == "__main__":
+    # Standalone sender, scales independently of the scheduler processes
+    from bot import MyBot
+    from dispatcher import MessageDispatcher
+
+    configure_logging()
+    db.connect()
+    sender = OutboxSender(MessageDispatcher(MyBot(config.TELEGRAM_TOKEN)))
+    logger.info("Outbox sender %s started", sender.worker_id)
+    sender.run_forever()
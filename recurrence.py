@@ -0,0 +1,181 @@
+import re
+from calendar import monthrange
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from utils import as_utc, local_to_utc, utc_to_local
+
+# Supported RRULE subset: FREQ, INTERVAL, COUNT, UNTIL (YYYYMMDD, inclusive,
+# in the user's timezone) and BYDAY for weekly rules
+Rule = namedtuple("Rule", "freq interval count until byday")
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+ALIASES = {
+    "diario": "FREQ=DAILY",
+    "diaria": "FREQ=DAILY",
+    "semanal": "FREQ=WEEKLY",
+    "mensual": "FREQ=MONTHLY",
+    "anual": "FREQ=YEARLY",
+}
+RULE_PART = re.compile(r"^(FREQ|INTERVAL|COUNT|UNTIL|BYDAY)=([A-Z0-9,]+)$")
+
+# Occurrences skipped while catching up after downtime, a year of daily rules
+MAX_SKIPPED = 400
+
+FREQUENCY_NAMES = {
+    "DAILY": ("Diario", "días"),
+    "WEEKLY": ("Semanal", "semanas"),
+    "MONTHLY": ("Mensual", "meses"),
+    "YEARLY": ("Anual", "años"),
+}
+WEEKDAY_NAMES = ("lun", "mar", "mié", "jue", "vie", "sáb", "dom")
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(text):
+    # Accepts a stored rule, an "RRULE:" line or an alias with extra parts,
+    # e.g. "semanal;BYDAY=MO,TH;COUNT=10". Raises ValueError otherwise.
+    parts = [part.strip() for part in text.strip().split(";") if part.strip()]
+    if parts and parts[0].lower() in ALIASES:
+        parts[0] = ALIASES[parts[0].lower()]
+
+    freq, interval, count, until, byday = None, 1, None, None, None
+    for part in parts:
+        part = part.upper()
+        if part.startswith("RRULE:"):
+            part = part[len("RRULE:") :]
+
+        match = RULE_PART.match(part)
+        if not match:
+            raise ValueError(f"Unsupported recurrence rule part: {part}")
+
+        name, value = match.groups()
+        if name == "FREQ":
+            if value not in FREQUENCIES:
+                raise ValueError(f"Unsupported frequency: {value}")
+            freq = value
+        elif name == "INTERVAL":
+            interval = int(value)
+        elif name == "COUNT":
+            count = int(value)
+        elif name == "UNTIL":
+            until = datetime.strptime(value, "%Y%m%d").date()
+        else:
+            days = value.split(",")
+            if any(day not in WEEKDAYS for day in days):
+                raise ValueError(f"Unsupported weekdays: {value}")
+            byday = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+
+    if freq is None:
+        raise ValueError("Recurrence rule without FREQ")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL and COUNT must be positive")
+    if byday and freq != "WEEKLY":
+        raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+    return Rule(freq, interval, count, until, byday)
+
+
+def format_rule(rule):
+    parts = [f"FREQ={rule.freq}"]
+    if rule.interval != 1:
+        parts.append(f"INTERVAL={rule.interval}")
+    if rule.byday:
+        parts.append("BYDAY=" + ",".join(WEEKDAYS[day] for day in rule.byday))
+    if rule.count:
+        parts.append(f"COUNT={rule.count}")
+    if rule.until:
+        parts.append(f"UNTIL={rule.until.strftime('%Y%m%d')}")
+    return ";".join(parts)
+
+
+def describe_rule(text):
+    rule = parse_rule(text)
+    name, units = FREQUENCY_NAMES[rule.freq]
+    parts = [name if rule.interval == 1 else f"Cada {rule.interval} {units}"]
+    if rule.byday:
+        parts.append(", ".join(WEEKDAY_NAMES[day] for day in rule.byday))
+    if rule.count:
+        parts.append(f"{rule.count} veces")
+    if rule.until:
+        parts.append(f"hasta {rule.until.strftime('%d/%m/%Y')}")
+    return ", ".join(parts)
+
+
+def _nth_local(rule, start, n):
+    # n-th occurrence counted from the series start, in local wall-clock time,
+    # so months and years never drift from the start day
+    if rule.freq == "DAILY":
+        return start + timedelta(days=n * rule.interval)
+    if rule.freq == "WEEKLY":
+        return start + timedelta(weeks=n * rule.interval)
+
+    if rule.freq == "MONTHLY":
+        months = start.month - 1 + n * rule.interval
+        year, month = start.year + months // 12, months % 12 + 1
+    else:
+        year, month = start.year + n * rule.interval, start.month
+    day = min(start.day, monthrange(year, month)[1])
+    return start.replace(year=year, month=month, day=day)
+
+
+def _next_weekday_local(rule, start, current):
+    # Next BYDAY match after `current` in a week that belongs to the series
+    week_start = (start - timedelta(days=start.weekday())).date()
+    day = current + timedelta(days=1)
+    for _ in range(7 * rule.interval):
+        weeks = (day.date() - week_start).days // 7
+        if day.weekday() in rule.byday and weeks % rule.interval == 0:
+            return day
+        day += timedelta(days=1)
+    return None
+
+
+def next_occurrence(reminder, time_zone, after):
+    # Returns (occurrence, date) of the first occurrence after `after`, date
+    # in UTC, or None when the series is over. Wall-clock times are kept in
+    # the user's timezone, so a 09:00 reminder stays at 09:00 across DST.
+    rule = parse_rule(reminder["recurrence"])
+    time_zone = time_zone or "UTC"
+    start = utc_to_local(reminder["series_start"], time_zone).replace(tzinfo=None)
+    current = utc_to_local(reminder["date"], time_zone).replace(tzinfo=None)
+    occurrence = reminder["occurrence"] or 0
+    after = as_utc(after)
+
+    for _ in range(MAX_SKIPPED):
+        occurrence += 1
+        if rule.count and occurrence >= rule.count:
+            return None
+
+        if rule.byday:
+            current = _next_weekday_local(rule, start, current)
+        else:
+            current = _nth_local(rule, start, occurrence)
+        if current is None or (rule.until and current.date() > rule.until):
+            return None
+
+        date = local_to_utc(current, time_zone)
+        if date > after:
+            return occurrence, date
+    return None
+
+
+def advance_reminder(reminder, now):
+    # Values that move a fired recurring reminder to its next occurrence, None
+    # for one-shot reminders and finished series
+    if not reminder.get("recurrence"):
+        return None
+
+    found = next_occurrence(reminder, reminder["time_zone"], now)
+    if found is None:
+        return None
+
+    occurrence, date = found
+    lead = as_utc(reminder["date"]) - as_utc(reminder["reminder_time"])
+    return {
+        "_id": reminder["id"],
+        "date": date,
+        "reminder_time": date - lead,
+        "occurrence": occurrence,
+    }
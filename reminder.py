@@ -1,67 +1,100 @@
 import logging
-import time
-from datetime import datetime
+import threading
+from datetime import timedelta
+from functools import lru_cache
 
 import config
-import schedule
-import telebot
+from bot import MyBot
 from database import db
+from dispatcher import MessageDispatcher
 from logging_conf import configure_logging
+from metrics import REMINDERS_DUE, SCHEDULER_TICK_SECONDS
+from migrations import migrate
+from outbox import OutboxSender, plan_deliveries
+from scheduler import ReminderScheduler
+from utils import utc_now
 
-configure_logging()
 logger = logging.getLogger("app")
 
-bot = telebot.TeleBot(config.TELEGRAM_TOKEN)
-db.connect()
+# Set when the scheduler runs in this process, see check_reminders
+scheduler = None
 
 
+@lru_cache(maxsize=None)
+def get_sender() -> OutboxSender:
+    # The dispatcher starts its worker threads, built on first use
+    return OutboxSender(MessageDispatcher(MyBot(config.TELEGRAM_TOKEN)))
+
+
+@SCHEDULER_TICK_SECONDS.time()
 def check_reminders():
-    query = (
-        db.reminders.select()
-        .where(db.reminders.c.status != "completed")
-        .order_by(db.reminders.c.date.asc())
-    )
-    result = db.session.execute(query)
-    reminders = result.fetchall()
-    reminders = [reminder._asdict() for reminder in reminders]
-    logger.debug(reminders)
-    for reminder in reminders:
-        user = db.get_model(reminder["user_id"], db.users, "get user")
-        if not user["is_active"]:
-            continue
-
-        if datetime.now() >= reminder["date"]:
-            diferencia = datetime.now() - reminder['date']
-            diferencia = diferencia.total_seconds() / 60
-            message = f"⏰ Recordatorio: {reminder['title']}\n🔔 Faltan {diferencia} minutos!\n"
-            bot.send_message(reminder["user_id"], message)
-            db.update_model(
-                reminder["id"],
-                {"status": "completed"},
-                db.reminders,
-                f"update reminder {reminder['title']}",
-            )
-        elif (
-            datetime.now() >= reminder["reminder_time"]
-            and reminder["status"] == "pending"
-        ):
-            message = (
-                f"⏰ Recordatorio: {reminder['title']}\n📅 Fecha: {reminder['date']}\n"
-            )
-            bot.send_message(reminder["user_id"], message)
-            db.update_model(
-                reminder["id"],
-                {"status": "incoming"},
-                db.reminders,
-                f"update reminder {reminder['title']}",
-            )
+    # Only writes to the outbox, sending is left to the outbox senders
+    lease = timedelta(seconds=config.CLAIM_LEASE_SECONDS)
+    while True:
+        now = utc_now()
+        reminders = db.claim_due_reminders(
+            config.WORKER_ID, now, lease, config.CLAIM_BATCH_SIZE
+        )
+        logger.debug("%d reminders claimed by %s", len(reminders), config.WORKER_ID)
+        REMINDERS_DUE.inc(len(reminders))
+        messages, transitions, advances = plan_deliveries(reminders, now)
+        try:
+            db.enqueue_deliveries(messages, transitions, advances)
+        except Exception:
+            # The failed tick is retried and claims the rows again. If the
+            # release fails too they are retried when the lease expires.
+            if scheduler:
+                scheduler.wake_at(now + lease)
+            release_claims(reminders)
+            raise
+        if messages and config.OUTBOX_SENDER:
+            get_sender().notify()
+
+        if len(reminders) < config.CLAIM_BATCH_SIZE:
+            break
+
+
+def release_claims(reminders):
+    try:
+        db.release_claims(config.WORKER_ID, [reminder["id"] for reminder in reminders])
+    except Exception as exc:
+        logger.error("Error releasing %d claims: %s", len(reminders), exc)
 
 
 if __name__ == "__main__":
-    check_reminders()
-    schedule.every(1).minutes.do(check_reminders)
+    configure_logging()
+    if config.AUTO_MIGRATE:
+        migrate(db)
+    db.connect()
 
-    print("Scheduler iniciado. Verificando recordatorios cada minuto...")
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    if config.METRICS_PORT:
+        # Only the metrics, the REST API is served by api.py behind API_TOKEN
+        from prometheus_client import start_http_server
+
+        start_http_server(config.METRICS_PORT)
+
+    if config.OUTBOX_SENDER:
+        get_sender().start()
+
+    if config.BROADCAST_RUNNER:
+        from broadcast import BroadcastRunner
+
+        notify = get_sender().notify if config.OUTBOX_SENDER else None
+        BroadcastRunner(notify=notify).start()
+
+    if config.AGENDA_INTERVAL_SECONDS:
+        from agenda import start_agendas
+
+        notify = get_sender().notify if config.OUTBOX_SENDER else None
+        start_agendas(threading.Event(), notify)
+
+    if config.ARCHIVE_INTERVAL_SECONDS:
+        from retention import start_retention
+
+        start_retention(threading.Event())
+
+    # Overdue reminders are loaded with the first window and fire right away
+    scheduler = ReminderScheduler(check_reminders)
+
+    print("Scheduler iniciado. Esperando el próximo recordatorio...")
+    scheduler.run_forever()
@@ -0,0 +1,89 @@
+import re
+from datetime import datetime, timedelta
+
+from utils import local_to_utc, utc_to_local
+
+# One-message form of /reminder: "<when> <title> | <description>", e.g.
+#   /reminder 25/12/2026 15:30 Cena | Llevar el postre
+#   /reminder 2026-12-25T15:30 Cena
+#   /reminder en 2 horas Llamar a Ana
+#   /reminder mañana 9:00 Dentista
+ABSOLUTE_DATE = re.compile(
+    r"^(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4})\s+"
+    r"(?P<hour>\d{1,2}):(?P<minute>\d{2})\s+(?P<rest>.+)$",
+    re.DOTALL,
+)
+ISO_DATE = re.compile(
+    r"^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})[T ]"
+    r"(?P<hour>\d{2}):(?P<minute>\d{2})\s+(?P<rest>.+)$",
+    re.DOTALL,
+)
+RELATIVE_DATE = re.compile(
+    r"^en\s+(?P<amount>\d+)\s+(?P<unit>minutos?|min|horas?|h|d[ií]as?|semanas?)\s+"
+    r"(?P<rest>.+)$",
+    re.DOTALL | re.IGNORECASE,
+)
+DAY_WORD_DATE = re.compile(
+    r"^(?P<day>hoy|mañana|pasado\s+mañana)\s+(?:a\s+las\s+)?"
+    r"(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s+(?P<rest>.+)$",
+    re.DOTALL | re.IGNORECASE,
+)
+
+QUICK_REMINDER_HELP = (
+    "No entendí el recordatorio. Ejemplos:\n"
+    "/reminder 25/12/2026 15:30 Cena | Llevar el postre\n"
+    "/reminder 2026-12-25 15:30 Cena\n"
+    "/reminder en 2 horas Llamar a Ana\n"
+    "/reminder mañana 9:00 Dentista"
+)
+
+UNITS = {"min": "minutes", "h": "hours", "d": "days", "s": "weeks"}
+DAY_OFFSETS = {"hoy": 0, "mañana": 1, "pasado mañana": 2}
+
+
+def _split_rest(rest):
+    title, _, description = rest.partition("|")
+    title, description = title.strip(), description.strip()
+    if not title:
+        raise ValueError("Missing reminder title")
+    return title[:255], description or None
+
+
+def parse_reminder(text, time_zone, now):
+    # Returns (date in UTC, title, description), raises ValueError when the
+    # text doesn't match any of the supported forms
+    text = text.strip()
+    time_zone = time_zone or "UTC"
+
+    match = RELATIVE_DATE.match(text)
+    if match:
+        unit = match["unit"].lower()
+        unit = UNITS["min" if unit.startswith("min") else unit[0]]
+        date = now + timedelta(**{unit: int(match["amount"])})
+        return (date, *_split_rest(match["rest"]))
+
+    match = DAY_WORD_DATE.match(text)
+    if match:
+        day = DAY_OFFSETS[" ".join(match["day"].lower().split())]
+        local_day = utc_to_local(now, time_zone).date() + timedelta(days=day)
+        local_date = datetime(
+            local_day.year,
+            local_day.month,
+            local_day.day,
+            int(match["hour"]),
+            int(match["minute"] or 0),
+        )
+        return (local_to_utc(local_date, time_zone), *_split_rest(match["rest"]))
+
+    match = ABSOLUTE_DATE.match(text) or ISO_DATE.match(text)
+    if match:
+        local_date = datetime(
+            int(match["year"]),
+            int(match["month"]),
+            int(match["day"]),
+            int(match["hour"]),
+            int(match["minute"]),
+        )
+        return (local_to_utc(local_date, time_zone), *_split_rest(match["rest"]))
+
+    raise ValueError(f"Unrecognised reminder: {text}")
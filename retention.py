@@ -0,0 +1,54 @@
+import logging
+import threading
+from datetime import timedelta
+
+import config
+from database import db
+from logging_conf import configure_logging
+from utils import utc_now
+
+logger = logging.getLogger("app")
+
+
+def run_retention() -> int:
+    # Each batch is moved in its own short transaction, so the scheduler and
+    # handlers never wait long on the rows being archived
+    now = utc_now()
+    before = now - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while True:
+        moved = db.archive_completed(before, config.ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < config.ARCHIVE_BATCH_SIZE:
+            break
+
+    drafts = db.purge_drafts(now - timedelta(hours=config.DRAFT_TTL_HOURS))
+    outbox = db.purge_outbox(now - timedelta(days=config.OUTBOX_RETENTION_DAYS))
+    logger.info(
+        "%d completed reminders archived, %d drafts and %d outbox messages purged",
+        archived,
+        drafts,
+        outbox,
+    )
+    return archived
+
+
+def start_retention(stopped: threading.Event) -> threading.Thread:
+    # Runs right away and then every ARCHIVE_INTERVAL_SECONDS until `stopped`
+    def loop():
+        while True:
+            try:
+                run_retention()
+            except Exception as exc:
+                logger.error("Error archiving reminders: %s", exc)
+            if stopped.wait(config.ARCHIVE_INTERVAL_SECONDS):
+                break
+
+    thread = threading.Thread(target=loop, name="retention", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    configure_logging()
+    run_retention()
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import config
+from database import db
+from utils import as_utc, utc_now
+
+logger = logging.getLogger("app")
+
+# Backoff after a failed tick, e.g. while the database is unreachable
+RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 60
+
+
+def retry_delay(failures: int) -> float:
+    return min(RETRY_SECONDS * 2 ** (failures - 1), MAX_RETRY_SECONDS)
+
+
+class ReminderScheduler:
+    # Keeps the fire times (UTC epoch seconds) of the upcoming window in a
+    # min-heap and calls `on_due` when the earliest is reached.
+    # Created/changed reminders are picked up through `updated_at` every
+    # `sync_interval` seconds, or right away when `push` is called in-process.
+    # A failed tick is logged and retried with backoff, due reminders stay
+    # due until `on_due` succeeds.
+
+    def __init__(
+        self,
+        on_due: Callable[[], None],
+        window: timedelta = timedelta(minutes=config.SCHEDULER_WINDOW_MINUTES),
+        sync_interval: int = config.SCHEDULER_SYNC_SECONDS,
+        db=db,
+    ):
+        self.on_due = on_due
+        self.db = db
+        self.window = window
+        self.sync_interval = sync_interval
+
+        self._heap = []
+        self._fire_times: Dict[int, set] = {}
+        self._extra_wakeups = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._window_end: Optional[datetime] = None
+        self._last_sync: Optional[datetime] = None
+        self._due = False
+
+    def push(self, reminder: Dict) -> None:
+        fire_times = set()
+        if reminder["status"] == "pending" and reminder["reminder_time"]:
+            fire_times.add(as_utc(reminder["reminder_time"]).timestamp())
+        if reminder["status"] in ("pending", "incoming") and reminder["date"]:
+            fire_times.add(as_utc(reminder["date"]).timestamp())
+
+        with self._lock:
+            if self._window_end:
+                window_end = self._window_end.timestamp()
+                fire_times = {t for t in fire_times if t <= window_end}
+
+            known = self._fire_times.get(reminder["id"], set())
+            for fire_time in fire_times - known:
+                heapq.heappush(self._heap, (fire_time, reminder["id"]))
+
+            if fire_times:
+                self._fire_times[reminder["id"]] = fire_times
+            else:
+                self._fire_times.pop(reminder["id"], None)
+
+        self._notify()
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+
+    def wake_at(self, when: datetime) -> None:
+        # Runs `on_due` at `when` even if no reminder fires then, e.g. to retry
+        # reminders whose claim lease expires
+        with self._lock:
+            heapq.heappush(self._extra_wakeups, when.timestamp())
+        self._notify()
+
+    def _start_window(self, now: datetime) -> datetime:
+        with self._lock:
+            self._heap = []
+            self._fire_times = {}
+            self._window_end = now + self.window
+        return self._window_end
+
+    def _fill_window(self, now: datetime, reminders) -> None:
+        for reminder in reminders:
+            self.push(reminder)
+
+        self._last_sync = now
+        logger.info(
+            "%d reminders scheduled until %s", len(reminders), self._window_end
+        )
+
+    def _sync_since(self) -> datetime:
+        # Overlap the previous interval so rows committed late are not missed
+        return self._last_sync - timedelta(seconds=self.sync_interval)
+
+    def _sync_due(self, now: datetime) -> bool:
+        return now >= self._last_sync + timedelta(seconds=self.sync_interval)
+
+    def load_window(self, now: datetime) -> None:
+        window_end = self._start_window(now)
+        self._fill_window(now, self.db.get_upcoming_reminders(window_end))
+
+    def _window_due(self, now: datetime) -> bool:
+        # Also true until the first window loaded successfully
+        return self._last_sync is None or now >= self._window_end
+
+    def sync_changes(self, now: datetime) -> None:
+        reminders = self.db.get_changed_reminders(self._sync_since())
+        self._last_sync = now
+        for reminder in reminders:
+            self.push(reminder)
+
+    def _pop_due(self, now: float) -> bool:
+        due = False
+        with self._lock:
+            while self._extra_wakeups and self._extra_wakeups[0] <= now:
+                heapq.heappop(self._extra_wakeups)
+                due = True
+
+            while self._heap and self._heap[0][0] <= now:
+                fire_time, reminder_id = heapq.heappop(self._heap)
+                fire_times = self._fire_times.get(reminder_id)
+                if not fire_times or fire_time not in fire_times:
+                    continue  # stale entry, reminder was changed
+
+                fire_times.discard(fire_time)
+                if not fire_times:
+                    del self._fire_times[reminder_id]
+                due = True
+
+        return due
+
+    def _next_wakeup(self, now: float) -> float:
+        deadlines = [
+            self._window_end.timestamp(),
+            self._last_sync.timestamp() + self.sync_interval,
+        ]
+        with self._lock:
+            if self._heap:
+                deadlines.append(self._heap[0][0])
+            if self._extra_wakeups:
+                deadlines.append(self._extra_wakeups[0])
+
+        return max(min(deadlines) - now, 0)
+
+    def tick(self) -> None:
+        now = utc_now()
+        if self._window_due(now):
+            self.load_window(now)
+        elif self._sync_due(now):
+            self.sync_changes(now)
+
+        if self._pop_due(now.timestamp()):
+            self._due = True
+        if self._due:
+            self.on_due()
+            self._due = False
+
+    def run_forever(self) -> None:
+        failures = 0
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                self.tick()
+                failures = 0
+                timeout = self._next_wakeup(utc_now().timestamp())
+            except Exception as exc:
+                failures += 1
+                timeout = retry_delay(failures)
+                logger.error("Scheduler tick failed, retrying in %ss: %s", timeout, exc)
+            self._wakeup.wait(timeout)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+
+class AsyncReminderScheduler(ReminderScheduler):
+    # Same heap, run as a task on the bot's event loop with an async database
+    # manager and an awaitable `on_due`
+
+    def __init__(self, on_due, db, **kwargs):
+        super().__init__(on_due, db=db, **kwargs)
+        self._async_wakeup = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._async_wakeup.set()
+
+    async def load_window_async(self, now: datetime) -> None:
+        window_end = self._start_window(now)
+        self._fill_window(now, await self.db.get_upcoming_reminders(window_end))
+
+    async def sync_changes_async(self, now: datetime) -> None:
+        reminders = await self.db.get_changed_reminders(self._sync_since())
+        self._last_sync = now
+        for reminder in reminders:
+            self.push(reminder)
+
+    async def tick_async(self) -> None:
+        now = utc_now()
+        if self._window_due(now):
+            await self.load_window_async(now)
+        elif self._sync_due(now):
+            await self.sync_changes_async(now)
+
+        if self._pop_due(now.timestamp()):
+            self._due = True
+        if self._due:
+            await self.on_due()
+            self._due = False
+
+    async def run(self) -> None:
+        failures = 0
+        while not self._stopped.is_set():
+            self._async_wakeup.clear()
+            try:
+                await self.tick_async()
+                failures = 0
+                timeout = self._next_wakeup(utc_now().timestamp())
+            except Exception as exc:
+                failures += 1
+                timeout = retry_delay(failures)
+                logger.error("Scheduler tick failed, retrying in %ss: %s", timeout, exc)
+            try:
+                await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._async_wakeup.set()
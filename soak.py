@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import platform
+import threading
+import time
+
+from fake_telegram import FakeTelegram, SyntheticUsers, serve
+
+# Settings are read on import, so the soak ones go first
+parser = argparse.ArgumentParser(
+    description="Soak test of the bot and the scheduler against a fake Bot API"
+)
+parser.add_argument("--database-url", default="sqlite:///soak.db")
+parser.add_argument("--duration", type=float, default=600, help="seconds of load")
+parser.add_argument("--users", type=int, default=100)
+parser.add_argument("--rate", type=float, default=5, help="user actions/s")
+parser.add_argument("--delay-minutes", type=int, default=1)
+parser.add_argument("--done-ratio", type=float, default=0.5)
+parser.add_argument("--latency", type=float, default=0.05, help="mean API seconds")
+parser.add_argument("--flood-ratio", type=float, default=0.01)
+parser.add_argument("--retry-after", type=int, default=1)
+parser.add_argument("--error-ratio", type=float, default=0.01)
+parser.add_argument(
+    "--grace", type=float, default=120, help="seconds to wait for late deliveries"
+)
+parser.add_argument("--sample-seconds", type=float, default=10)
+parser.add_argument("--output", default="soak_results.json")
+args = parser.parse_args()
+
+fake = FakeTelegram(args.latency, args.flood_ratio, args.retry_after, args.error_ratio)
+server = serve(fake)
+os.environ["TELEGRAM_API_URL"] = (
+    f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+)
+os.environ["DATABASE_URL"] = args.database_url
+os.environ.setdefault("TELEGRAM_TOKEN", "0:soak")
+os.environ["AUTO_MIGRATE"] = "false"
+
+import main  # noqa: E402
+import migrations  # noqa: E402
+import reminder  # noqa: E402
+from database import db  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+from utils import utc_now  # noqa: E402
+
+
+def rss_bytes():
+    # Resident memory now, peak memory where /proc is missing
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_schema():
+    db.metadata.drop_all(db.engine)
+    migrations.metadata.drop_all(db.engine)
+    migrations.migrate(db)
+
+
+def run_load(users):
+    # Samples memory while the synthetic users run
+    samples = [rss_bytes()]
+    load = threading.Thread(target=users.run, args=(args.duration,), daemon=True)
+    load.start()
+    while load.is_alive():
+        load.join(args.sample_seconds)
+        samples.append(rss_bytes())
+    return samples
+
+
+if __name__ == "__main__":
+    reset_schema()
+    main.setup()
+    started_at = utc_now()
+
+    threading.Thread(
+        target=main.bot.polling,
+        kwargs={"non_stop": True, "timeout": 5, "long_polling_timeout": 5},
+        daemon=True,
+    ).start()
+    reminder.get_sender().start()
+    scheduler = reminder.scheduler = ReminderScheduler(reminder.check_reminders)
+    threading.Thread(target=scheduler.run_forever, daemon=True).start()
+
+    users = SyntheticUsers(
+        fake, args.users, args.rate, args.delay_minutes, args.done_ratio
+    )
+    print(f"Soaking for {args.duration:.0f}s with {args.users} users...")
+    start = time.monotonic()
+    samples = run_load(users)
+    elapsed = time.monotonic() - start
+    # Everything created during the load is due by now, plus the grace
+    deadline = time.time() + args.delay_minutes * 60
+    time.sleep(args.delay_minutes * 60 + args.grace)
+    samples.append(rss_bytes())
+
+    scheduler.stop()
+    reminder.get_sender().stop()
+    main.bot.stop_polling()
+
+    stats = fake.stats()
+    result = users.report(deadline)
+    result.update(stats)
+    result["updates_per_second"] = round(result["updates"] / elapsed, 2)
+    result["messages_per_second"] = round(stats["messages_sent"] / elapsed, 2)
+    result["memory"] = {
+        "start_bytes": samples[0],
+        "end_bytes": samples[-1],
+        "peak_bytes": max(samples),
+        "growth_bytes": samples[-1] - samples[0],
+    }
+
+    report = {
+        "database": db.engine.dialect.name,
+        "python": platform.python_version(),
+        "started_at": started_at.isoformat(),
+        "settings": vars(args),
+        "result": result,
+    }
+    print(json.dumps(result, indent=2, default=str))
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(report, file, indent=2, default=str)
+    print(f"Results written to {args.output}")
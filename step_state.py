@@ -0,0 +1,109 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+import config
+from database import DatabaseManager, LRUCache
+from telebot import Handler
+from telebot.handler_backends import HandlerBackend
+from utils import utc_now
+
+logger = logging.getLogger("app")
+
+# Next-step callbacks are stored by name, so they must be registered here
+STEP_HANDLERS = {}
+
+
+def step_handler(func):
+    STEP_HANDLERS[func.__name__] = func
+    return func
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return {"$dt": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__} is not serializable")
+
+
+def _object_hook(obj):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def dump_state(handler: Handler) -> str:
+    state = [handler.callback.__name__, handler.args, handler.kwargs]
+    return json.dumps(state, default=_default, separators=(",", ":"))
+
+
+def load_state(payload: str) -> Handler:
+    name, args, kwargs = json.loads(payload, object_hook=_object_hook)
+    return Handler(STEP_HANDLERS[name], *args, **kwargs)
+
+
+class StepStateBackend(HandlerBackend):
+    # Next-step backend for TeleBot. With a database the pending steps live
+    # only in the step_states table, so they survive restarts and any bot
+    # instance can continue a conversation. Without one they live in a bounded
+    # in-memory LRU. Steps not continued within the TTL are dropped.
+    #
+    # The table is the only copy when it is used: a step cached here could be
+    # continued meanwhile by another instance, or one registered there missed.
+
+    PURGE_EVERY = 1000
+
+    def __init__(
+        self,
+        db: DatabaseManager = None,
+        max_size: int = config.STEP_STATE_CACHE_SIZE,
+        ttl: int = config.STEP_STATE_TTL,
+        wrap=None,
+    ):
+        super().__init__()
+        self.db = db
+        # Adapts the loaded step callbacks, see handlers.sync_handler
+        self.wrap = wrap
+        self.ttl = ttl
+        self.cache = LRUCache(max_size, ttl)
+        self._registered = 0
+
+    def register_handler(self, handler_group_id, handler):
+        payload = dump_state(handler)
+        if self.db is None:
+            self.cache.set(handler_group_id, payload)
+            return
+
+        now = utc_now()
+        self.db.save_step_state(
+            handler_group_id, payload, now + timedelta(seconds=self.ttl)
+        )
+        self._registered += 1
+        if self._registered % self.PURGE_EVERY == 0:
+            purged = self.db.purge_step_states(now)
+            logger.debug("%d abandoned conversation steps purged", purged)
+
+    def clear_handlers(self, handler_group_id):
+        if self.db is None:
+            self.cache.invalidate(handler_group_id)
+        else:
+            self.db.delete_step_state(handler_group_id)
+
+    def get_handlers(self, handler_group_id):
+        if self.db is None:
+            payload = self.cache.get(handler_group_id)
+            self.cache.invalidate(handler_group_id)
+        else:
+            payload = self.db.pop_step_state(handler_group_id, utc_now())
+
+        if payload is LRUCache._MISSING or payload is None:
+            return None
+
+        try:
+            handler = load_state(payload)
+        except (KeyError, ValueError) as exc:
+            logger.error("Invalid conversation step for %s: %s", handler_group_id, exc)
+            return None
+
+        if self.wrap:
+            handler.callback = self.wrap(handler.callback)
+        return [handler]
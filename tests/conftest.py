@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+# Settings are read on import, so the test ones go before any app module
+os.environ["TELEGRAM_TOKEN"] = "0:test"
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["AUTO_MIGRATE"] = "false"
+os.environ.pop("TELEGRAM_API_URL", None)
+
+from database import DatabaseManager  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    # Empty SQLite database, migrate() creates the schema
+    database = DatabaseManager(f"sqlite:///{tmp_path / 'test.db'}")
+    yield database
+    database.engine.dispose()
+
+
+@pytest.fixture
+def migrated(database):
+    migrate(database)
+    return database
@@ -0,0 +1,34 @@
+import asyncio
+
+import async_main
+import config
+import pytest
+
+
+def test_failed_task_stops_polling(monkeypatch):
+    cancelled = []
+
+    async def polling():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def broken_scheduler():
+        raise RuntimeError("database down")
+
+    async def noop():
+        pass
+
+    monkeypatch.setattr(config, "OUTBOX_SENDER", False)
+    monkeypatch.setattr(config, "AGENDA_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(config, "BROADCAST_RUNNER", False)
+    monkeypatch.setattr(async_main.scheduler, "run", broken_scheduler)
+    monkeypatch.setattr(async_main.bot, "delete_webhook", noop)
+    monkeypatch.setattr(async_main.bot, "infinity_polling", polling)
+    monkeypatch.setattr(async_main.bot, "close_session", noop)
+
+    with pytest.raises(RuntimeError, match="database down"):
+        asyncio.run(async_main.main())
+    assert cancelled
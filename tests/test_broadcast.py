@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import config
+import pytest
+from broadcast import BroadcastRunner
+from sqlalchemy import select
+from utils import utc_now
+
+
+@pytest.fixture
+def users(migrated, monkeypatch):
+    monkeypatch.setattr(config, "BROADCAST_BATCH_SIZE", 2)
+    migrated.create_many(
+        [
+            {"id": id, "first_name": f"user{id}", "is_active": id != 3}
+            for id in range(1, 7)
+        ],
+        migrated.users,
+    )
+    return migrated
+
+
+def outbox_chats(database):
+    query = select(database.outbox.c.chat_id).order_by(database.outbox.c.id)
+    with database.session_scope() as session:
+        return session.execute(query).scalars().all()
+
+
+def test_broadcast_resumes_after_restart(users):
+    broadcast = users.create_broadcast("Hola", None)
+    assert broadcast["total"] == 5
+
+    # The first runner stops after one batch, e.g. the process restarts
+    assert BroadcastRunner(users, "w1", rate=1000).step()
+    assert outbox_chats(users) == [1, 2]
+
+    # A worker that restarts with the same id resumes after the cursor
+    runner = BroadcastRunner(users, "w1", rate=1000)
+    while runner.step():
+        pass
+    assert outbox_chats(users) == [1, 2, 4, 5, 6]
+    broadcast = users.get_model(broadcast["id"], users.broadcasts)
+    assert broadcast["enqueued"] == 5
+    assert broadcast["enqueued_at"] is not None
+
+    # Completed once everything was sent
+    claimed = users.claim_outbox("sender", utc_now(), timedelta(minutes=1), 10)
+    users.mark_outbox_sent([message["id"] for message in claimed], utc_now())
+    runner.step()
+    broadcast = users.get_model(broadcast["id"], users.broadcasts)
+    assert broadcast["status"] == "completed"
+    assert broadcast["sent"] == 5
+
+
+def test_other_worker_waits_for_the_lease(users):
+    users.create_broadcast("Hola", None)
+    assert BroadcastRunner(users, "w1", rate=1000).step()
+    assert not BroadcastRunner(users, "w2", rate=1000).step()
+    assert outbox_chats(users) == [1, 2]
+
+
+def test_cancelled_broadcast_stops(users):
+    broadcast = users.create_broadcast("Hola", None)
+    runner = BroadcastRunner(users, "w1", rate=1000)
+    assert runner.step()
+    assert users.cancel_broadcast(broadcast["id"], utc_now())
+    assert not runner.step()
+    assert outbox_chats(users) == [1, 2]
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+from dispatcher import MessageDispatcher
+from telebot.apihelper import ApiTelegramException
+
+
+def telegram_error(code, **parameters):
+    result_json = {"ok": False, "error_code": code, "description": "error"}
+    if parameters:
+        result_json["parameters"] = parameters
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+class Bot:
+    # Records the sends, `errors` are raised first for a chat
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, typing=True, **kwargs):
+        with self._lock:
+            errors = self.errors.get(chat_id)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+
+@pytest.fixture
+def make_dispatcher():
+    dispatchers = []
+
+    def make(bot, **kwargs):
+        kwargs.setdefault("global_rate", 1000)
+        dispatcher = MessageDispatcher(bot, **kwargs)
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.shutdown()
+
+
+def test_throttled_chat_does_not_block_others(make_dispatcher):
+    bot = Bot()
+    dispatcher = make_dispatcher(bot, workers=1, chat_rate=2)
+    start = time.monotonic()
+    slow = [dispatcher.submit(1, f"slow {i}") for i in range(4)]
+    fast = dispatcher.submit(2, "fast")
+
+    assert fast.result(timeout=5) == "fast"
+    assert time.monotonic() - start < 0.5
+    # The throttled chat keeps its order
+    assert [future.result(timeout=5) for future in slow] == [
+        f"slow {i}" for i in range(4)
+    ]
+    assert [text for chat_id, text, _ in bot.sent if chat_id == 1] == [
+        f"slow {i}" for i in range(4)
+    ]
+
+
+def test_throttled_chat_leaves_global_capacity_to_others(make_dispatcher):
+    bot = Bot()
+    dispatcher = make_dispatcher(bot, global_rate=10, chat_rate=5)
+    start = time.monotonic()
+    backlog = [dispatcher.submit(1, f"slow {i}") for i in range(20)]
+    # Reserving the backlog's global tokens up front delayed this by 1.1s
+    assert dispatcher.submit(2, "fast").result(timeout=5) == "fast"
+    assert time.monotonic() - start < 0.5
+    assert [future.result(timeout=10) for future in backlog] == [
+        f"slow {i}" for i in range(20)
+    ]
+
+
+def test_retries_flood_control(make_dispatcher):
+    bot = Bot({1: [telegram_error(429, retry_after=0.2)]})
+    dispatcher = make_dispatcher(bot, chat_rate=100)
+    start = time.monotonic()
+    assert dispatcher.submit(1, "hola").result(timeout=5) == "hola"
+    assert time.monotonic() - start >= 0.2
+
+
+def test_permanent_error_is_raised(make_dispatcher):
+    error = telegram_error(403)
+    dispatcher = make_dispatcher(Bot({1: [error]}), chat_rate=100)
+    with pytest.raises(ApiTelegramException):
+        dispatcher.submit(1, "hola").result(timeout=5)
+
+
+def test_shutdown_waits_for_delayed_messages(make_dispatcher):
+    bot = Bot()
+    dispatcher = make_dispatcher(bot, chat_rate=5)
+    futures = [dispatcher.submit(1, str(i)) for i in range(3)]
+    dispatcher.shutdown()
+    assert all(future.done() for future in futures)
+    assert len(bot.sent) == 3
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import handlers
+import pytest
+from async_database import AsyncDatabaseManager
+from async_main import AsyncMyBot, NextStepMiddleware
+from handlers import AwaitableCalls, sync_handler
+from step_state import StepStateBackend
+from telebot import Handler
+from telebot.asyncio_handler_backends import CancelUpdate
+from telebot.types import Message
+
+WIZARD = ["Dentista", "saltar", "25/12/2099 15:30", "No", "Sí"]
+
+
+def message(text, chat_id=1):
+    return Message.de_json(
+        {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Ana"},
+            "text": text,
+        }
+    )
+
+
+class SyncBot:
+    # TeleBot stand-in, steps go to the backend as in TeleBot
+    def __init__(self, steps):
+        self.next_step_backend = steps
+        self.sent = []
+
+    def send_message(self, chat_id, text, typing=True, **kwargs):
+        self.sent.append(text)
+        return message(text, chat_id)
+
+    def register_next_step_handler(self, message, callback, *args, **kwargs):
+        handler = Handler(callback, *args, **kwargs)
+        self.next_step_backend.register_handler(message.chat.id, handler)
+
+
+@pytest.fixture
+def user(migrated):
+    migrated.create_model(
+        {"id": 1, "first_name": "Ana", "time_zone": "Europe/Madrid"},
+        migrated.users,
+    )
+    return migrated
+
+
+@pytest.fixture
+def restore_handlers():
+    saved = (
+        handlers.bot,
+        handlers.db,
+        handlers.run_blocking,
+        handlers.reminder_changed,
+    )
+    yield
+    handlers.setup(*saved)
+
+
+def created_reminders(database):
+    return database.get_reminders_page(1, 10)
+
+
+def test_sync_wizard_keeps_steps_in_the_table(user, restore_handlers):
+    bot = SyncBot(StepStateBackend(user, wrap=sync_handler))
+    handlers.setup(AwaitableCalls(bot), AwaitableCalls(user))
+
+    sync_handler(handlers.create_reminder)(message("/reminder"))
+    for text in WIZARD:
+        # A new backend each time, as another bot instance would
+        (step,) = StepStateBackend(user, wrap=sync_handler).get_handlers(1)
+        step.callback(message(text), *step.args, **step.kwargs)
+
+    assert bot.sent[-1] == "✅ Recordatorio creado exitosamente!"
+    assert [row["title"] for row in created_reminders(user)] == ["Dentista"]
+
+
+def test_async_wizard_keeps_steps_in_the_table(user, restore_handlers):
+    bot = AsyncMyBot("0:test")
+    bot.next_step_backend = StepStateBackend(user)
+    sent = []
+
+    async def send_message(chat_id, text, typing=True, **kwargs):
+        sent.append(text)
+        return message(text, chat_id)
+
+    bot.send_message = send_message
+    url = f"sqlite+aiosqlite:///{user.engine.url.database}"
+    adb = AsyncDatabaseManager(user, url)
+    handlers.setup(bot, adb, asyncio.to_thread)
+    middleware = NextStepMiddleware(bot)
+
+    async def wizard():
+        await handlers.create_reminder(message("/reminder"))
+        for text in WIZARD:
+            result = await middleware.pre_process(message(text), {})
+            assert isinstance(result, CancelUpdate)
+        # No step left, the message goes to the handlers
+        assert await middleware.pre_process(message("/list"), {}) is None
+        await adb.disconnect()
+
+    asyncio.run(wizard())
+    assert sent[-1] == "✅ Recordatorio creado exitosamente!"
+    assert [row["title"] for row in created_reminders(user)] == ["Dentista"]
+
+
+def test_sync_handler_rejects_suspending_calls():
+    async def handler():
+        await asyncio.sleep(0)
+
+    with pytest.raises(RuntimeError):
+        sync_handler(handler)()
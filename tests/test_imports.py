@@ -0,0 +1,45 @@
+import importlib
+
+import pytest
+
+# Entry points and the modules they import, importing must not fail nor
+# need a database or the network
+MODULES = [
+    "agenda",
+    "api",
+    "async_main",
+    "broadcast",
+    "handlers",
+    "main",
+    "migrations",
+    "outbox",
+    "reminder",
+    "retention",
+    "scheduler",
+    "step_state",
+    "webhook",
+]
+
+
+@pytest.mark.parametrize("name", MODULES)
+def test_import(name):
+    importlib.import_module(name)
+
+
+
+def test_main_builds_the_bot_in_setup(monkeypatch):
+    import main
+    from bot import MyBot
+
+    assert main.bot is None
+    monkeypatch.setattr(main, "create_bot", lambda: MyBot("0:test", threaded=False))
+    monkeypatch.setattr(main.db, "connect", lambda: None)
+    monkeypatch.setattr(main, "bot", None)
+    main.setup()
+
+    commands = [
+        handler["filters"].get("commands") for handler in main.bot.message_handlers
+    ]
+    assert ["start"] in commands
+    assert ["reminder"] in commands
+    assert main.bot.callback_query_handlers
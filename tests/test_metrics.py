@@ -0,0 +1,54 @@
+import pytest
+from metrics import DB_QUERY_SECONDS, instrument_engine
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+
+def observed(statement):
+    return DB_QUERY_SECONDS.labels(statement)._sum.get()
+
+
+def test_failed_statement_leaves_no_timing_behind():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    with engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM missing"))
+
+        before = observed("SELECT")
+        connection.execute(text("SELECT 1"))
+        elapsed = observed("SELECT") - before
+        assert 0 < elapsed < 1
+        assert "query_start" not in connection.connection.info
+
+
+def user_cache_lookups():
+    return [
+        REGISTRY.get_sample_value(f"cache_{result}_total", {"cache": "users"})
+        for result in ("hits", "misses")
+    ]
+
+
+def test_user_cache_is_exported_and_skips_misses(migrated):
+    hits, misses = user_cache_lookups()
+    assert migrated.get_model(1, migrated.users) is None
+    # The miss is not cached, the user shows up once registered
+    with migrated.engine.begin() as connection:
+        connection.execute(migrated.users.insert().values(id=1, first_name="Ana"))
+    assert migrated.get_model(1, migrated.users)["first_name"] == "Ana"
+    assert migrated.get_model(1, migrated.users)["first_name"] == "Ana"
+
+    assert user_cache_lookups() == [hits + 1, misses + 2]
+
+
+def checked_out():
+    labels = {"engine": "sync", "state": "checkedout"}
+    return REGISTRY.get_sample_value("db_pool_connections", labels) or 0
+
+
+def test_pool_stats_are_exported(migrated):
+    before = checked_out()
+    with migrated.engine.connect():
+        assert checked_out() == before + 1
+    assert checked_out() == before
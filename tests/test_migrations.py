@@ -0,0 +1,102 @@
+from datetime import datetime
+
+import config
+import pytest
+from migrations import MIGRATIONS, migrate, schema_migrations
+from sqlalchemy import inspect, select, text
+
+# Schema of the last unversioned release, before any migration
+BASELINE_SCHEMA = [
+    """
+    CREATE TABLE users (
+        id BIGINT NOT NULL PRIMARY KEY,
+        username VARCHAR(100),
+        first_name VARCHAR(100) NOT NULL,
+        last_name VARCHAR(100),
+        time_zone VARCHAR(50),
+        default_reminder_minutes INTEGER,
+        is_active BOOLEAN NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE reminders (
+        id BIGINT NOT NULL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        title VARCHAR(255) NOT NULL,
+        description TEXT,
+        date TIMESTAMP,
+        reminder_time TIMESTAMP NOT NULL,
+        status VARCHAR(100),
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+    """,
+]
+
+
+def baseline(database):
+    with database.engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text(
+                "INSERT INTO users (id, first_name, time_zone, is_active) "
+                "VALUES (1, 'Ana', 'Europe/Madrid', 1)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO reminders (id, user_id, title, date, reminder_time, "
+                "status, updated_at) VALUES (1, 1, 'Dentista', "
+                "'2024-01-10 10:00:00.000000', '2024-01-10 09:00:00.000000', "
+                "'pending', '2024-01-01 12:00:00.000000')"
+            )
+        )
+
+
+def applied(database):
+    with database.engine.connect() as connection:
+        return list(connection.execute(select(schema_migrations.c.name)).scalars())
+
+
+def test_migrate_fresh_database(database, monkeypatch):
+    # Nothing to convert, so no server time zone is needed
+    monkeypatch.setattr(config, "SERVER_TIMEZONE", None)
+    migrate(database)
+    migrate(database)
+
+    assert sorted(applied(database)) == [name for name, _ in MIGRATIONS]
+    tables = set(inspect(database.engine).get_table_names())
+    assert {table.name for table in database.metadata.sorted_tables} <= tables
+
+    # Ids are generated on SQLite too
+    database.create_model({"id": 1, "first_name": "Ana"}, database.users)
+    reminder_id = database.create_model(
+        {"user_id": 1, "title": "Dentista", "reminder_time": datetime(2024, 2, 1)},
+        database.reminders,
+    )
+    assert reminder_id == 1
+
+
+def test_migrate_baseline_database(database, monkeypatch):
+    monkeypatch.setattr(config, "SERVER_TIMEZONE", "Europe/Madrid")
+    baseline(database)
+    migrate(database)
+
+    assert sorted(applied(database)) == [name for name, _ in MIGRATIONS]
+    reminder = database.get_model(1, database.reminders)
+    # Madrid is UTC+1 in January
+    assert reminder["date"].replace(tzinfo=None) == datetime(2024, 1, 10, 9, 0)
+    assert reminder["reminder_time"].replace(tzinfo=None) == datetime(2024, 1, 10, 8)
+    assert reminder["claimed_until"] is None
+    assert reminder["occurrence"] == 0
+
+    user = database.get_model(1, database.users)
+    assert user["digest_minutes"] is None
+
+
+def test_migrate_baseline_requires_server_timezone(database, monkeypatch):
+    monkeypatch.setattr(config, "SERVER_TIMEZONE", None)
+    baseline(database)
+    with pytest.raises(RuntimeError, match="SERVER_TIMEZONE"):
+        migrate(database)
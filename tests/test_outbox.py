@@ -0,0 +1,220 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+import requests
+from outbox import failure_update, plan_deliveries
+from telebot.apihelper import ApiTelegramException
+
+NOW = datetime(2026, 1, 13, 9, 0, tzinfo=pytz.utc)
+
+
+def telegram_error(code):
+    result_json = {"ok": False, "error_code": code, "description": "error"}
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+def reminder(id, date, status="pending", **values):
+    return {
+        "id": id,
+        "user_id": 1,
+        "title": f"R{id}",
+        "date": date,
+        "reminder_time": date - timedelta(hours=1),
+        "status": status,
+        "time_zone": "UTC",
+        "recurrence": None,
+        "series_start": date,
+        "occurrence": 0,
+        "digest_minutes": None,
+        **values,
+    }
+
+
+def message(attempts=0):
+    return {"id": 5, "attempts": attempts}
+
+
+@pytest.mark.parametrize(
+    "exc", [telegram_error(502), requests.ConnectionError("reset")]
+)
+def test_transient_failure_is_retried_with_backoff(exc):
+    update = failure_update(message(attempts=2), exc, NOW)
+    assert update["status"] == "pending"
+    assert update["attempts"] == 3
+    assert update["next_attempt_at"] == NOW + timedelta(seconds=120)
+
+
+@pytest.mark.parametrize("code", [400, 403])
+def test_permanent_failure_gives_up(code):
+    update = failure_update(message(), telegram_error(code), NOW)
+    assert update["status"] == "failed"
+    assert update["attempts"] == 1
+
+
+def test_failure_gives_up_after_max_attempts():
+    update = failure_update(message(attempts=4), telegram_error(502), NOW)
+    assert update["status"] == "failed"
+
+
+def test_plan_one_shot_alarm():
+    messages, transitions, advances = plan_deliveries([reminder(1, NOW)], NOW)
+    assert transitions == {"completed": [1], "incoming": []}
+    assert advances == []
+
+    (sent,) = messages
+    assert sent["idempotency_key"] == f"1:completed:{int(NOW.timestamp())}"
+    assert sent["kind"] == "completed"
+    assert sent["chat_id"] == 1
+    # Done/snooze buttons on one-shot alarms
+    buttons = json.loads(sent["reply_markup"])["inline_keyboard"][0]
+    assert buttons[0]["callback_data"] == "d:1"
+
+
+def test_plan_incoming_notice():
+    date = NOW + timedelta(minutes=30)
+    messages, transitions, _ = plan_deliveries([reminder(1, date)], NOW)
+    assert transitions == {"completed": [], "incoming": [1]}
+    assert messages[0]["kind"] == "incoming"
+    assert messages[0]["fire_time"] == date - timedelta(hours=1)
+    assert messages[0]["reply_markup"] is None
+
+
+def test_plan_recurring_reminder_advances():
+    recurring = reminder(1, NOW, recurrence="FREQ=DAILY")
+    messages, transitions, advances = plan_deliveries([recurring], NOW)
+    assert transitions == {"completed": [], "incoming": []}
+    assert advances[0]["date"] == NOW + timedelta(days=1)
+    assert messages[0]["reply_markup"] is None
+
+
+def test_plan_skips_reminders_not_due():
+    later = reminder(1, NOW + timedelta(hours=2))
+    assert plan_deliveries([later], NOW) == ([], {"completed": [], "incoming": []}, [])
+
+
+def test_plan_digest_groups_a_users_reminders():
+    reminders = [
+        reminder(1, NOW, digest_minutes=15),
+        reminder(2, NOW + timedelta(minutes=10), digest_minutes=15),
+    ]
+    messages, transitions, _ = plan_deliveries(reminders, NOW)
+    assert transitions["completed"] == [1]
+    assert transitions["incoming"] == [2]
+    (digest,) = messages
+    assert digest["kind"] == "digest"
+    assert "R1" in digest["text"] and "R2" in digest["text"]
+
+
+def test_plan_digest_does_not_complete_reminders_early():
+    reminders = [
+        reminder(1, NOW, digest_minutes=15),
+        # Its heads-up already went out, the alarm is due within the window
+        reminder(2, NOW + timedelta(minutes=10), "incoming", digest_minutes=15),
+        # Only the heads-up is due within the window
+        reminder(
+            3,
+            NOW + timedelta(hours=2),
+            digest_minutes=15,
+            reminder_time=NOW + timedelta(minutes=10),
+        ),
+    ]
+    messages, transitions, _ = plan_deliveries(reminders, NOW)
+    assert transitions["completed"] == [1]
+    assert transitions["incoming"] == [3]
+    (digest,) = messages
+    assert "R2" not in digest["text"] and "R3" in digest["text"]
+
+
+def test_enqueue_is_idempotent(migrated):
+    migrated.create_model({"id": 1, "first_name": "Ana"}, migrated.users)
+    messages, _, _ = plan_deliveries([reminder(1, NOW)], NOW)
+    empty = {"completed": [], "incoming": []}
+    migrated.enqueue_deliveries(messages, empty, [])
+    migrated.enqueue_deliveries(messages, empty, [])
+
+    claimed = migrated.claim_outbox("w1", NOW, timedelta(minutes=1), 10)
+    assert [row["idempotency_key"] for row in claimed] == [
+        messages[0]["idempotency_key"]
+    ]
+
+
+class FailingEnqueue:
+    # Wraps the database so the first enqueue fails like a lost connection
+    def __init__(self, database):
+        self.database = database
+        self.failures = 1
+
+    def enqueue_deliveries(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("connection lost")
+        return self.database.enqueue_deliveries(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+
+class WakeupRecorder:
+    def __init__(self):
+        self.wakeups = []
+
+    def wake_at(self, when):
+        self.wakeups.append(when)
+
+
+def test_failed_enqueue_releases_claims(migrated, monkeypatch):
+    import reminder as reminder_module
+    from utils import utc_now
+
+    migrated.create_model({"id": 1, "first_name": "Ana"}, migrated.users)
+    date = utc_now() - timedelta(minutes=1)
+    migrated.create_model(
+        {
+            "user_id": 1,
+            "title": "R1",
+            "date": date,
+            "reminder_time": date - timedelta(hours=1),
+            "status": "pending",
+        },
+        migrated.reminders,
+    )
+    scheduler = WakeupRecorder()
+    monkeypatch.setattr(reminder_module, "db", FailingEnqueue(migrated))
+    monkeypatch.setattr(reminder_module, "scheduler", scheduler)
+
+    with pytest.raises(RuntimeError):
+        reminder_module.check_reminders()
+    row = migrated.get_model(1, migrated.reminders)
+    assert row["claimed_by"] is None and row["claimed_until"] is None
+    assert len(scheduler.wakeups) == 1
+
+    # The retry of the tick claims the reminder again right away
+    reminder_module.check_reminders()
+    claimed = migrated.claim_outbox("w1", utc_now(), timedelta(minutes=1), 10)
+    assert [message["kind"] for message in claimed] == ["completed"]
+
+
+def test_digest_claim_leaves_alarms_for_their_date(migrated):
+    migrated.create_model(
+        {"id": 1, "first_name": "Ana", "digest_minutes": 15}, migrated.users
+    )
+    for title, date, status in [
+        ("R1", NOW, "pending"),
+        ("R2", NOW + timedelta(minutes=10), "incoming"),
+        ("R3", NOW + timedelta(minutes=10), "pending"),
+    ]:
+        migrated.create_model(
+            {
+                "user_id": 1,
+                "title": title,
+                "date": date,
+                "reminder_time": date - timedelta(hours=1),
+                "status": status,
+            },
+            migrated.reminders,
+        )
+
+    claimed = migrated.claim_due_reminders("w1", NOW, timedelta(minutes=1), 10)
+    assert sorted(row["title"] for row in claimed) == ["R1", "R3"]
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytz
+from utils import page_key, parse_page_key
+
+START = datetime(2026, 1, 1, 9, 0, tzinfo=pytz.utc)
+
+
+def add_reminders(database, user_id, dates):
+    database.create_model({"id": user_id, "first_name": "Ana"}, database.users)
+    for i, date in enumerate(dates):
+        database.create_model(
+            {
+                "user_id": user_id,
+                "title": f"R{i}",
+                "date": date,
+                "reminder_time": date,
+                "status": "pending",
+            },
+            database.reminders,
+        )
+
+
+def titles(rows):
+    return [row["title"] for row in rows]
+
+
+def key(row):
+    return parse_page_key(*page_key(row).split(":"))
+
+
+def test_page_key_round_trip():
+    row = {"id": 42, "date": START + timedelta(microseconds=7)}
+    assert parse_page_key(*page_key(row).split(":")) == (row["date"], 42)
+
+
+def test_pages_forward_and_back(migrated):
+    # Two reminders share a date, the id breaks the tie
+    dates = [START + timedelta(hours=i) for i in (0, 1, 1, 2, 3)]
+    add_reminders(migrated, 1, dates)
+    add_reminders(migrated, 2, [START])
+
+    first = migrated.get_reminders_page(1, 2)
+    assert titles(first) == ["R0", "R1"]
+    second = migrated.get_reminders_page(1, 2, after=key(first[-1]))
+    assert titles(second) == ["R2", "R3"]
+    third = migrated.get_reminders_page(1, 2, after=key(second[-1]))
+    assert titles(third) == ["R4"]
+
+    back = migrated.get_reminders_page(1, 2, before=key(third[0]))
+    assert titles(back) == ["R2", "R3"]
+    assert titles(migrated.get_reminders_page(1, 2, before=key(back[0]))) == [
+        "R0",
+        "R1",
+    ]
@@ -0,0 +1,120 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+import pytz
+from recurrence import advance_reminder, format_rule, parse_rule
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+def series(recurrence, start, occurrence=0, current=None, time_zone="UTC"):
+    # Fired reminder of a series, notified 30 minutes ahead
+    current = current or start
+    return {
+        "id": 7,
+        "recurrence": recurrence,
+        "series_start": start,
+        "date": current,
+        "reminder_time": current - timedelta(minutes=30),
+        "occurrence": occurrence,
+        "time_zone": time_zone,
+    }
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("diario", "FREQ=DAILY"),
+        ("RRULE:FREQ=WEEKLY;BYDAY=TH,MO", "FREQ=WEEKLY;BYDAY=MO,TH"),
+        ("semanal;byday=mo;count=10", "FREQ=WEEKLY;BYDAY=MO;COUNT=10"),
+        (
+            "FREQ=MONTHLY;UNTIL=20261231;INTERVAL=2",
+            "FREQ=MONTHLY;INTERVAL=2;UNTIL=20261231",
+        ),
+    ],
+)
+def test_parse_rule(text, expected):
+    assert format_rule(parse_rule(text)) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "FREQ=HOURLY",
+        "INTERVAL=2",
+        "FREQ=DAILY;INTERVAL=0",
+        "FREQ=DAILY;BYDAY=MO",
+        "FREQ=WEEKLY;BYDAY=XX",
+        "FREQ=DAILY;BYHOUR=9",
+    ],
+)
+def test_parse_rule_rejects(text):
+    with pytest.raises(ValueError):
+        parse_rule(text)
+
+
+def test_parse_rule_until():
+    assert parse_rule("diario;UNTIL=20260105").until == date(2026, 1, 5)
+
+
+def test_advance_one_shot_is_none():
+    assert advance_reminder({"id": 1, "recurrence": None}, utc(2026, 1, 1)) is None
+
+
+def test_advance_daily_keeps_lead():
+    start = utc(2026, 1, 1, 9, 45)
+    advance = advance_reminder(series("diario", start), utc(2026, 1, 1, 9, 46))
+    assert advance == {
+        "_id": 7,
+        "date": utc(2026, 1, 2, 9, 45),
+        "reminder_time": utc(2026, 1, 2, 9, 15),
+        "occurrence": 1,
+    }
+
+
+def test_advance_skips_missed_occurrences():
+    start = utc(2026, 1, 1, 9, 0)
+    advance = advance_reminder(series("diario", start), utc(2026, 1, 10, 12, 0))
+    assert advance["date"] == utc(2026, 1, 11, 9, 0)
+    assert advance["occurrence"] == 10
+
+
+def test_advance_monthly_clamps_to_month_end():
+    start = utc(2026, 1, 31, 9, 0)
+    advance = advance_reminder(series("mensual", start), utc(2026, 1, 31, 10, 0))
+    assert advance["date"] == utc(2026, 2, 28, 9, 0)
+    # Counted from the series start, March is back on the 31st
+    reminder = series("mensual", start, occurrence=1, current=advance["date"])
+    advance = advance_reminder(reminder, utc(2026, 2, 28, 10, 0))
+    assert advance["date"] == utc(2026, 3, 31, 9, 0)
+
+
+def test_advance_weekly_byday():
+    # Thursday 1 January 2026
+    start = utc(2026, 1, 1, 9, 0)
+    rule = "FREQ=WEEKLY;BYDAY=MO,TH"
+    advance = advance_reminder(series(rule, start), utc(2026, 1, 1, 10, 0))
+    assert advance["date"] == utc(2026, 1, 5, 9, 0)
+
+
+def test_advance_keeps_wall_clock_across_dst():
+    # 09:00 in Madrid is 08:00 UTC in winter and 07:00 UTC in summer
+    start = utc(2026, 3, 28, 8, 0)
+    reminder = series("diario", start, time_zone="Europe/Madrid")
+    advance = advance_reminder(reminder, utc(2026, 3, 28, 9, 0))
+    assert advance["date"] == utc(2026, 3, 29, 7, 0)
+
+
+@pytest.mark.parametrize(
+    "rule, now",
+    [
+        ("diario;COUNT=2", utc(2026, 1, 2, 10, 0)),
+        ("diario;UNTIL=20260102", utc(2026, 1, 2, 10, 0)),
+    ],
+)
+def test_advance_finished_series(rule, now):
+    start = utc(2026, 1, 1, 9, 0)
+    reminder = series(rule, start, occurrence=1, current=utc(2026, 1, 2, 9, 0))
+    assert advance_reminder(reminder, now) is None
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from utils import is_reminder_action, reminder_action_values
+
+NOW = datetime(2026, 3, 28, 8, 0, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        ("d:1", True),
+        ("s:1", True),
+        ("t:12", True),
+        ("c:1", False),
+        ("l:n:1:2", False),
+    ],
+)
+def test_is_reminder_action(data, expected):
+    assert is_reminder_action(data) is expected
+
+
+def test_done():
+    assert reminder_action_values("d", NOW, "UTC") == {"status": "completed"}
+
+
+def test_snooze_counts_from_now():
+    values = reminder_action_values("s", NOW, "UTC")
+    assert values == {
+        "date": NOW + timedelta(minutes=10),
+        "reminder_time": NOW + timedelta(minutes=10),
+        "status": "pending",
+    }
+
+
+def test_tomorrow_keeps_local_time_across_dst():
+    # 09:00 in Madrid, the clocks go forward that night
+    values = reminder_action_values("t", NOW, "Europe/Madrid")
+    assert values["date"] == datetime(2026, 3, 29, 7, 0, tzinfo=pytz.utc)
+
+
+@pytest.fixture
+def reminders(migrated):
+    migrated.create_model({"id": 1, "first_name": "Ana"}, migrated.users)
+
+    def add(**values):
+        data = {
+            "user_id": 1,
+            "title": "Dentista",
+            "date": NOW,
+            "reminder_time": NOW,
+            "status": "completed",
+            **values,
+        }
+        return migrated.create_model(data, migrated.reminders)
+
+    return add
+
+
+def test_apply_snooze(migrated, reminders):
+    id = reminders()
+    values = reminder_action_values("h", NOW, "UTC")
+    row = migrated.apply_reminder_action(id, 1, values, NOW)
+    assert row["status"] == "pending"
+    assert row["date"].replace(tzinfo=pytz.utc) == NOW + timedelta(hours=1)
+
+
+@pytest.mark.parametrize(
+    "values, user_id",
+    [
+        ({}, 2),
+        ({"recurrence": "FREQ=DAILY"}, 1),
+        ({"claimed_by": "w1", "claimed_until": NOW + timedelta(minutes=1)}, 1),
+    ],
+)
+def test_apply_refused(migrated, reminders, values, user_id):
+    # Another user's reminder, a series, or one a worker is delivering
+    id = reminders(**values)
+    action = reminder_action_values("d", NOW, "UTC")
+    assert migrated.apply_reminder_action(id, user_id, action, NOW) is None
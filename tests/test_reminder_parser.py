@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+import pytz
+from reminder_parser import parse_reminder
+
+# Tuesday 13 January 2026, 10:00 in Madrid
+NOW = datetime(2026, 1, 13, 9, 0, tzinfo=pytz.utc)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("25/12/2026 15:30 Cena | Llevar el postre", utc(2026, 12, 25, 14, 30)),
+        ("2026-07-01T15:30 Cena", utc(2026, 7, 1, 13, 30)),
+        ("2026-07-01 15:30 Cena", utc(2026, 7, 1, 13, 30)),
+        ("en 2 horas Cena", utc(2026, 1, 13, 11, 0)),
+        ("en 1 minuto Cena", utc(2026, 1, 13, 9, 1)),
+        ("en 3 días Cena", utc(2026, 1, 16, 9, 0)),
+        ("en 1 semana Cena", utc(2026, 1, 20, 9, 0)),
+        ("mañana 9:00 Cena", utc(2026, 1, 14, 8, 0)),
+        ("pasado  mañana a las 21 Cena", utc(2026, 1, 15, 20, 0)),
+        ("hoy 23:15 Cena", utc(2026, 1, 13, 22, 15)),
+    ],
+)
+def test_dates(text, expected):
+    date, title, _ = parse_reminder(text, "Europe/Madrid", NOW)
+    assert date == expected
+    assert title == "Cena"
+
+
+def test_title_and_description():
+    _, title, description = parse_reminder(
+        "en 2 horas Llamar a Ana | Por el cumpleaños", "UTC", NOW
+    )
+    assert title == "Llamar a Ana"
+    assert description == "Por el cumpleaños"
+
+
+def test_without_description():
+    assert parse_reminder("en 2 horas Llamar a Ana", None, NOW)[2] is None
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["Cena", "en horas Cena", "32/13/2026 10:00 Cena", "en 2 horas | Solo nota"],
+)
+def test_rejected(text):
+    with pytest.raises(ValueError):
+        parse_reminder(text, "UTC", NOW)
@@ -0,0 +1,67 @@
+import threading
+from datetime import timedelta
+
+import pytest
+import scheduler
+from scheduler import ReminderScheduler
+from utils import utc_now
+
+
+class Reminders:
+    # Scheduler queries stand-in, `failures` errors come first
+    def __init__(self, reminders, failures=0):
+        self.reminders = reminders
+        self.failures = failures
+
+    def get_upcoming_reminders(self, window_end):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database down")
+        return self.reminders
+
+    def get_changed_reminders(self, since):
+        return []
+
+
+def due_reminder():
+    now = utc_now()
+    return {
+        "id": 1,
+        "status": "pending",
+        "reminder_time": now - timedelta(seconds=1),
+        "date": now + timedelta(hours=1),
+    }
+
+
+def run_until(scheduler_, event):
+    thread = threading.Thread(target=scheduler_.run_forever, daemon=True)
+    thread.start()
+    assert event.wait(5)
+    scheduler_.stop()
+    thread.join(5)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(scheduler, "RETRY_SECONDS", 0.01)
+
+
+def test_failed_load_is_retried():
+    called = threading.Event()
+    db = Reminders([due_reminder()], failures=2)
+    run_until(ReminderScheduler(called.set, db=db), called)
+    assert db.failures == 0
+
+
+def test_failed_on_due_is_retried():
+    calls = []
+    done = threading.Event()
+
+    def on_due():
+        calls.append(True)
+        if len(calls) == 1:
+            raise RuntimeError("database down")
+        done.set()
+
+    run_until(ReminderScheduler(on_due, db=Reminders([due_reminder()])), done)
+    assert len(calls) == 2
@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from step_state import StepStateBackend, step_handler
+from telebot import Handler
+from utils import utc_now
+
+
+@step_handler
+def ask_title(msg, reminder_data):
+    pass
+
+
+class StepStore:
+    # step_states table stand-in
+    def __init__(self):
+        self.rows = {}
+
+    def save_step_state(self, chat_id, payload, expires_at):
+        self.rows[chat_id] = payload
+
+    def pop_step_state(self, chat_id, now):
+        return self.rows.pop(chat_id, None)
+
+    def delete_step_state(self, chat_id):
+        self.rows.pop(chat_id, None)
+
+    def purge_step_states(self, now):
+        return 0
+
+
+def test_without_database_steps_stay_in_memory():
+    backend = StepStateBackend()
+    assert backend.get_handlers(1) is None
+    backend.register_handler(1, Handler(ask_title, {}))
+    assert backend.get_handlers(1)[0].callback is ask_title
+    assert backend.get_handlers(1) is None
+
+
+def test_step_round_trip():
+    store = StepStore()
+    backend = StepStateBackend(store)
+    backend.register_handler(1, Handler(ask_title, {"title": "Dentista"}))
+
+    handlers = backend.get_handlers(1)
+    assert handlers[0].callback is ask_title
+    assert handlers[0].args == ({"title": "Dentista"},)
+    assert backend.get_handlers(1) is None
+    assert store.rows == {}
+
+
+def test_step_survives_restart():
+    store = StepStore()
+    StepStateBackend(store).register_handler(1, Handler(ask_title, {}))
+
+    restarted = StepStateBackend(store)
+    assert restarted.get_handlers(1)[0].callback is ask_title
+    assert restarted.get_handlers(1) is None
+
+
+def test_step_registered_by_another_instance():
+    store = StepStore()
+    first, second = StepStateBackend(store), StepStateBackend(store)
+    assert first.get_handlers(1) is None
+    second.register_handler(1, Handler(ask_title, {}))
+
+    assert first.get_handlers(1)[0].callback is ask_title
+
+
+def test_step_continued_by_another_instance_is_not_replayed():
+    store = StepStore()
+    first, second = StepStateBackend(store), StepStateBackend(store)
+    first.register_handler(1, Handler(ask_title, {"title": "Viejo"}))
+    assert second.get_handlers(1)[0].args == ({"title": "Viejo"},)
+    second.register_handler(1, Handler(ask_title, {"title": "Nuevo"}))
+
+    assert first.get_handlers(1)[0].args == ({"title": "Nuevo"},)
+    assert store.rows == {}
+
+
+def test_pop_step_state(migrated):
+    now = utc_now()
+    migrated.save_step_state(1, "step", now + timedelta(minutes=1))
+    migrated.save_step_state(2, "expired", now - timedelta(minutes=1))
+    assert migrated.pop_step_state(1, now) == "step"
+    assert migrated.pop_step_state(1, now) is None
+    assert migrated.pop_step_state(2, now) is None
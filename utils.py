@@ -1,19 +1,17 @@
-import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 import pytz
-from telebot.types import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telebot.types import (InlineKeyboardButton, InlineKeyboardMarkup,
+                           KeyboardButton, ReplyKeyboardMarkup)
 
-from bot import bot
-from logging_conf import configure_logging
 from time_zone_enum import TimeZoneEnum
 
-configure_logging()
-logger = logging.getLogger("app")
-
-
-def send_msg(obj_msg, msg, markup=ReplyKeyboardRemove()):
-    bot.send_chat_action(obj_msg.chat.id, "typing")
-    bot.send_message(obj_msg.chat.id, msg, reply_markup=markup)
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+MAX_DESCRIPTION = 300
+# Keyboard choices of /digest and /agenda
+DIGEST_OPTIONS = ("15", "30", "60", "No")
+AGENDA_OPTIONS = ("07:00", "08:00", "09:00", "No")
 
 
 def time_zone_markup():
@@ -24,14 +22,265 @@ def time_zone_markup():
     return markup
 
 
-def convert_timezone(date_time, from_tz_str, to_tz_str):
-    logger.info(f"Convert datetime from {from_tz_str} to {to_tz_str}")
-    from_tz = pytz.timezone(from_tz_str)
-    to_tz = pytz.timezone(to_tz_str)
+@lru_cache(maxsize=1024)
+def get_tz(name):
+    # Accepts zone names and the TimeZoneEnum names offered in time_zone_markup
+    if TimeZoneEnum.is_valid(name):
+        name = TimeZoneEnum[name].value
+    return pytz.timezone(name)
+
+
+def utc_now():
+    return datetime.now(pytz.utc)
+
+
+def as_utc(date_time):
+    # SQLite returns the stored UTC times without their offset
+    if date_time.tzinfo is None:
+        return date_time.replace(tzinfo=pytz.utc)
+    return date_time.astimezone(pytz.utc)
+
+
+def local_to_utc(date_time, tz_name):
+    return get_tz(tz_name).localize(date_time).astimezone(pytz.utc)
+
+
+def utc_to_local(date_time, tz_name):
+    return as_utc(date_time).astimezone(get_tz(tz_name))
+
+
+def build_reminder_message(reminder, now, heads_up_until=None):
+    # Returns (status, fire_time, text) for a due reminder, None if not due.
+    # Heads-ups due until `heads_up_until` are built early, alarms never.
+    date = as_utc(reminder["date"])
+    if now >= date:
+        diferencia = now - date
+        diferencia = diferencia.total_seconds() / 60
+        message = f"⏰ Recordatorio: {reminder['title']}\n🔔 Faltan {diferencia} minutos!\n"
+        return "completed", date, message
+
+    reminder_time = as_utc(reminder["reminder_time"])
+    if (heads_up_until or now) >= reminder_time and reminder["status"] == "pending":
+        local_date = utc_to_local(date, reminder["time_zone"] or "UTC")
+        message = (
+            f"⏰ Recordatorio: {reminder['title']}\n"
+            f"📅 Fecha: {local_date.strftime('%d/%m/%Y %H:%M')}\n"
+        )
+        return "incoming", reminder_time, message
+
+    return None
+
+
+def build_digest_message(items, time_zone):
+    # One message for the (status, fire_time, reminder) items of a digest
+    # user, due reminders first and then the ones coming up
+    tz = get_tz(time_zone or "UTC")
+    sections = {
+        "completed": "⏰ Tus recordatorios:",
+        "incoming": "📅 Próximamente:",
+    }
+    parts = []
+    for status, title in sections.items():
+        lines = [
+            f"• {as_utc(reminder['date']).astimezone(tz).strftime('%d/%m %H:%M')} "
+            f"{reminder['title']}"
+            for item_status, _, reminder in sorted(
+                items, key=lambda item: as_utc(item[2]["date"])
+            )
+            if item_status == status
+        ]
+        if lines:
+            parts.append("\n".join([title, *lines]))
+    return "\n\n".join(parts)
+
+
+def render_agenda(reminders, time_zone, max_items):
+    tz = get_tz(time_zone or "UTC")
+    parts = ["🗓️ Tu agenda para las próximas 24 horas:\n"]
+    for reminder in reminders[:max_items]:
+        date = as_utc(reminder["date"]).astimezone(tz)
+        parts.append(f"\n• {date.strftime('%d/%m %H:%M')} {reminder['title']}")
+    if len(reminders) > max_items:
+        parts.append(f"\n… y {len(reminders) - max_items} más, usa /list")
+    return "".join(parts)
+
+
+def parse_agenda_time(text):
+    # "HH:MM" or "H:MM", None to turn the agenda off. Raises ValueError.
+    text = text.strip().lower()
+    if text == "no":
+        return None
+    hour, _, minute = text.partition(":")
+    if not hour.isdigit() or not minute.isdigit() or len(minute) != 2:
+        raise ValueError(f"Invalid agenda time: {text}")
+    hour, minute = int(hour), int(minute)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid agenda time: {text}")
+    return f"{hour:02d}:{minute:02d}"
+
+
+def parse_digest_minutes(text):
+    # Window in minutes, None to turn digests off. Raises ValueError.
+    text = text.strip().lower()
+    if text == "no":
+        return None
+    if not text.isdigit() or not 0 < int(text) <= 24 * 60:
+        raise ValueError(f"Invalid digest window: {text}")
+    return int(text)
+
+
+def options_markup(*options):
+    markup = ReplyKeyboardMarkup(one_time_keyboard=True)
+    markup.add(*(KeyboardButton(option) for option in options))
+    return markup
+
+
+def page_key(reminder):
+    date = (as_utc(reminder["date"]) - EPOCH) // timedelta(microseconds=1)
+    return f"{date}:{reminder['id']}"
+
+
+def parse_page_key(date, reminder_id):
+    return EPOCH + timedelta(microseconds=int(date)), int(reminder_id)
+
+
+def render_reminders_page(reminders, time_zone, has_prev, has_next):
+    # recurrence imports the time helpers above
+    from recurrence import describe_rule
+
+    tz = get_tz(time_zone or "UTC")
+    parts = ["📅 Tus recordatorios pendientes:\n\n"]
+    for reminder in reminders:
+        date = as_utc(reminder["date"]).astimezone(tz)
+        reminder_time = as_utc(reminder["reminder_time"]).astimezone(tz)
+        parts.append(f"📌 {reminder['title']}\n\n")
+        parts.append(f"🕒 {date.strftime('%d/%m/%Y %H:%M %Z')}\n\n")
+        parts.append(
+            f"⏰ Recordatorio: {reminder_time.strftime('%d/%m/%Y %H:%M %Z')}\n\n"
+        )
+        if reminder.get("recurrence"):
+            parts.append(f"🔁 {describe_rule(reminder['recurrence'])}\n\n")
+        if reminder["description"]:
+            # Keeps a full page under Telegram's 4096 characters
+            parts.append(f"📖 {reminder['description'][:MAX_DESCRIPTION]}\n\n")
+
+    buttons = []
+    if has_prev:
+        callback_data = f"l:p:{page_key(reminders[0])}"
+        buttons.append(InlineKeyboardButton("⬅️ Anterior", callback_data=callback_data))
+    if has_next:
+        callback_data = f"l:n:{page_key(reminders[-1])}"
+        buttons.append(InlineKeyboardButton("Siguiente ➡️", callback_data=callback_data))
+
+    markup = InlineKeyboardMarkup().row(*buttons) if buttons else None
+    return "".join(parts), markup
+
+
+def draft_summary(title, description, local_date):
+    return (
+        f"📌 Resumen del recordatorio:\n\n"
+        f"🏷 Título: {title}\n"
+        f"📝 Descripción: {description or 'Ninguna'}\n"
+        f"📅 Fecha y hora: {local_date.strftime('%d/%m/%Y %H:%M')}"
+    )
+
+
+def draft_markup(reminder_id):
+    # callback_data is "c:<id>" to confirm and "x:<id>" to discard
+    return InlineKeyboardMarkup().row(
+        InlineKeyboardButton("✅ Confirmar", callback_data=f"c:{reminder_id}"),
+        InlineKeyboardButton("❌ Cancelar", callback_data=f"x:{reminder_id}"),
+    )
+
+
+# Buttons of a delivered reminder, callback_data is "<action>:<id>"
+REMINDER_ACTIONS = {
+    "d": ("✅ Hecho", None),
+    "s": ("⏰ 10 min", timedelta(minutes=10)),
+    "h": ("⏰ 1 h", timedelta(hours=1)),
+    "t": ("📅 Mañana", timedelta(days=1)),
+}
+
+
+def reminder_actions_markup(reminder_id):
+    return InlineKeyboardMarkup().row(
+        *(
+            InlineKeyboardButton(label, callback_data=f"{action}:{reminder_id}")
+            for action, (label, _) in REMINDER_ACTIONS.items()
+        )
+    )
+
+
+def is_reminder_action(data):
+    return data[:2] in [f"{action}:" for action in REMINDER_ACTIONS]
+
+
+def reminder_action_values(action, now, time_zone):
+    # Column values for a button press, snoozes count from now. "Mañana"
+    # keeps the local time, so it is still 09:00 after a DST change.
+    delay = REMINDER_ACTIONS[action][1]
+    if delay is None:
+        return {"status": "completed"}
+
+    if action == "t":
+        local_now = utc_to_local(now, time_zone or "UTC").replace(tzinfo=None)
+        date = local_to_utc(local_now + delay, time_zone or "UTC")
+    else:
+        date = now + delay
+    return {"date": date, "reminder_time": date, "status": "pending"}
+
+
+def reminder_action_response(values, time_zone):
+    if values["status"] == "completed":
+        return "✅ Hecho"
+    local_date = utc_to_local(values["date"], time_zone or "UTC")
+    return f"⏰ Pospuesto hasta el {local_date.strftime('%d/%m/%Y %H:%M')}"
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def render_table_stats(stats):
+    parts = ["📊 Tamaño de las tablas:\n"]
+    for name, table in stats.items():
+        size = ""
+        if table["bytes"] is not None:
+            size = f" ({format_bytes(table['bytes'])})"
+        parts.append(f"\n{name}: {table['rows']} filas{size}")
+    return "".join(parts)
+
+
+BROADCAST_STATUSES = {
+    "pending": "pendiente",
+    "running": "en curso",
+    "completed": "completado",
+    "cancelled": "cancelado",
+}
+
+
+def render_broadcasts(progresses):
+    if not progresses:
+        return "No hay envíos masivos"
+
+    parts = ["📣 Envíos masivos:\n"]
+    for progress in progresses:
+        parts.append(
+            f"\n#{progress['id']} {BROADCAST_STATUSES[progress['status']]}: "
+            f"{progress['sent']}/{progress['total']} enviados, "
+            f"{progress['failed']} fallidos"
+        )
+        if progress["status"] == "running" and progress["eta_seconds"] is not None:
+            parts.append(
+                f", {progress['messages_per_second']} msg/s, "
+                f"faltan ~{progress['eta_seconds'] // 60 + 1} min"
+            )
+    return "".join(parts)
 
-    from_timezone_dt = from_tz.localize(date_time)
-    to_timezone_dt = from_timezone_dt.astimezone(to_tz)
 
-    result = to_timezone_dt.replace(tzinfo=None)
-    logger.info(f"Date converted to: {result}")
-    return result
+for _tz in TimeZoneEnum:
+    get_tz(_tz.value)
@@ -0,0 +1,96 @@
+import hmac
+import logging
+import queue
+import threading
+
+import config
+from flask import Blueprint, jsonify, request
+from telebot.types import Update
+from waitress import serve
+
+logger = logging.getLogger("app")
+
+
+class UpdateQueue:
+    # Bounded hand-off between the HTTP threads and the handler workers.
+    # When it is full the webhook answers 503 and Telegram retries later.
+
+    def __init__(self, bot, workers: int, max_size: int):
+        self.bot = bot
+        self.workers = workers
+        self._queue = queue.Queue(max_size)
+        self._threads = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"webhook-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, update: Update) -> bool:
+        try:
+            self._queue.put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _work(self) -> None:
+        while True:
+            update = self._queue.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as exc:
+                logger.error("Error processing update %s: %s", update.update_id, exc)
+            finally:
+                self._queue.task_done()
+
+
+# Built by run_webhook, the blueprint is only registered after that
+update_queue = None
+webhook = Blueprint("webhook", __name__)
+
+
+@webhook.route(config.WEBHOOK_PATH, methods=["POST"])
+def receive_update():
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, config.WEBHOOK_SECRET):
+        return jsonify({"error": "Token secreto inválido"}), 403
+
+    update = Update.de_json(request.get_data(as_text=True))
+    if not update_queue.put(update):
+        logger.warning("Webhook queue full, asking Telegram to retry")
+        return jsonify({"error": "Servidor ocupado"}), 503
+
+    return "", 200
+
+
+def run_webhook(app, bot) -> None:
+    global update_queue
+    if not config.WEBHOOK_URL or not config.WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode")
+
+    # Handlers run on the bounded worker pool instead of TeleBot's own threads
+    bot.threaded = False
+    update_queue = UpdateQueue(bot, config.WEBHOOK_WORKERS, config.WEBHOOK_QUEUE_SIZE)
+    update_queue.start()
+    app.register_blueprint(webhook)
+
+    bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info(
+        "Webhook listening on %s:%s", config.WEBHOOK_HOST, config.WEBHOOK_PORT
+    )
+    serve(
+        app,
+        host=config.WEBHOOK_HOST,
+        port=config.WEBHOOK_PORT,
+        threads=config.WEBHOOK_THREADS,
+    )